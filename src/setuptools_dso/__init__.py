@@ -4,12 +4,10 @@
 from __future__ import print_function
 
 import os
+import sys
 import logging as log
-# import of setuptools implicitly monkey patches distutils...
-from setuptools import setup as _setup
-from .dsocmd import DSO, Extension, install, build, build_dso, build_ext, bdist_egg
+from importlib import import_module
 from .runtime import dylink_prepare_dso, find_dso
-from .probe import ProbeToolchain
 
 __all__ = (
     'DSO',
@@ -23,6 +21,41 @@ __all__ = (
     'ProbeToolchain',
 )
 
+# Build time names are imported on first use so that an installed package
+# which only calls eg. find_dso() at runtime does not also import setuptools.
+_lazy_names = {
+    'DSO': '.dsocmd',
+    'Extension': '.dsocmd',
+    'install': '.dsocmd',
+    'install_lib': '.dsocmd',
+    'build': '.dsocmd',
+    'build_dso': '.dsocmd',
+    'build_ext': '.dsocmd',
+    'bdist_egg': '.dsocmd',
+    'ProbeToolchain': '.probe',
+}
+
+if sys.version_info < (3, 7):
+    # no module __getattr__ (PEP 562)
+    # import of setuptools implicitly monkey patches distutils...
+    import setuptools
+    from .dsocmd import DSO, Extension, install, install_lib, build, build_dso, build_ext, bdist_egg
+    from .probe import ProbeToolchain
+
+else:
+    def __getattr__(name):
+        modname = _lazy_names.get(name)
+        if modname is None:
+            raise AttributeError("module {0!r} has no attribute {1!r}".format(__name__, name))
+        # import of setuptools implicitly monkey patches distutils...
+        import setuptools
+        value = getattr(import_module(modname, __name__), name)
+        globals()[name] = value
+        return value
+
+    def __dir__():
+        return sorted(set(globals()) | set(_lazy_names))
+
 def setup(**kws):
     """setup(..., x_dsos=[DSO(...)])
     Wrapper around setuptools.setup() which injects extra Commands needed to build DSOs.
@@ -30,6 +63,10 @@ def setup(**kws):
 
     :param x_dsos: None, a list of :py:class:`DSO` instances, or a callable with one argument returning such a list.
     """
+    # import of setuptools implicitly monkey patches distutils...
+    from setuptools import setup as _setup
+    from .dsocmd import install, install_lib, build, build_dso, build_ext, bdist_egg
+
     cmdclass = kws.setdefault('cmdclass', {})
     # cmdclass_setdefault sets default to cmdclass[name]=klass and verifies
     # that cmdclass[name] is a subclass of klass. This way we check, for
@@ -49,6 +86,7 @@ def setup(**kws):
     cmdclass_setdefault('build_ext', build_ext)
     cmdclass_setdefault('build', build, error=False)
     cmdclass_setdefault('install', install, error=False)
+    cmdclass_setdefault('install_lib', install_lib, error=False)
     try:
         from .dsocmd import bdist_wheel
     except ImportError:
@@ -60,37 +98,63 @@ def setup(**kws):
     kws.setdefault('zip_safe', len(kws.get('ext_modules', []))==0 and not has_dsos)
     _setup(**kws)
 
-try:
-    from Cython.Build import cythonize as _cythonize
-except ImportError:
-    def _cythonize(extensions, **kws):
-        """Dummy cythonize() used when Cython not installed.
-        Assumes that generated source files are distributed.
-        Cython docs say "It is strongly recommended that you
-        distribute the generated .c ...".
-        """
-        print("Cython not installed.  Trying to use dummy cythonize()")
-        for E in extensions:
-            srcs = []
-            for src in E.sources:
-                # how to match up .pyx with .c or .cpp ?
-                # there are (at least) three ways to specify language.
-                # kws['language'], E.language, and as a directive in the .pyx
-                # This last is not something we can detect, so try to guess.
-                base, ext = os.path.splitext(src)
-                if ext=='.pyx':
-                    if os.path.isfile(base+'.cpp'):
-                        src = base+'.cpp'
-                    else:
-                        src = base+'.c'
-                srcs.append(src)
-            E.sources[:] = srcs
-        return extensions
+def _dummy_cythonize(extensions, **kws):
+    """Dummy cythonize() used when Cython not installed.
+    Assumes that generated source files are distributed.
+    Cython docs say "It is strongly recommended that you
+    distribute the generated .c ...".
+    """
+    print("Cython not installed.  Trying to use dummy cythonize()")
+    for E in extensions:
+        srcs = []
+        for src in E.sources:
+            # how to match up .pyx with .c or .cpp ?
+            # there are (at least) three ways to specify language.
+            # kws['language'], E.language, and as a directive in the .pyx
+            # This last is not something we can detect, so try to guess.
+            base, ext = os.path.splitext(src)
+            if ext=='.pyx':
+                if os.path.isfile(base+'.cpp'):
+                    src = base+'.cpp'
+                else:
+                    src = base+'.c'
+            srcs.append(src)
+        E.sources[:] = srcs
+    return extensions
 
-def cythonize(orig, **kws):
+def _cythonize(extensions, **kws):
+    try:
+        from Cython.Build import cythonize as _real_cythonize
+    except ImportError:
+        return _dummy_cythonize(extensions, **kws)
+    return _real_cythonize(extensions, **kws)
+
+def cythonize(orig, defer=False, **kws):
     """Wrapper around Cython.Build.cythonize() to correct handling of
     :py:class:`DSO` s and :py:class:`Extension` s using them.
+
+    :param bool defer: If True, and Cython is installed, generate sources later as part of ``build_ext``.
+                       Each Extension is then compiled as soon as its own sources are generated,
+                       while other sources are being generated or compiled.
+                       Generated sources are cached.  cf. :ref:`cython_defer`
+                       (Added in 2.12)
     """
+    from .dsocmd import Extension
+    if defer:
+        try:
+            import Cython
+        except ImportError:
+            pass
+        else:
+            from .cythonjobs import defer_extension
+            if all([isinstance(ext, Extension) for ext in orig]):
+                if all([defer_extension(ext, kws) for ext in orig]):
+                    return list(orig)
+                # some can not be deferred
+                for ext in orig:
+                    ext.__dict__.pop('cython_options', None)
+            else:
+                log.debug("Unable to defer cythonize() of names or patterns")
     cmods = _cythonize(orig, **kws)
     for new, old in zip(cmods, orig):
         if new is old or not isinstance(old, Extension):
@@ -0,0 +1,112 @@
+# Copyright 2022  Michael Davidsaver
+# SPDX-License-Identifier: BSD
+# See LICENSE
+"""Store of built DSOs shared between builds.  cf. build_dso --artifact-store
+
+DSOs are not linked against libpython.  So a DSO built for one Python interpreter
+may be re-used when building for another.  eg. wheels for several Python versions.
+
+Entries are keyed by compiler identity, the preprocessed sources, the compile and link flags of each DSO,
+and the keys of local DSOs it is linked against.
+Not by Python version, by the sysconfig flags of an interpreter, or by include directories (eg. build/temp.*).
+"""
+
+import os
+import json
+import hashlib
+import logging as log
+
+from .probe import _ProbeCache
+from .runtime import _user_cache_dir
+from .staging import stage_file, _atomic
+
+__all__ = (
+    'ArtifactStore',
+)
+
+def _store_dir(store=None):
+    """Resolve build_dso --artifact-store to a directory, or None if disabled.
+    """
+    if store is None:
+        store = os.environ.get('SETUPTOOLS_DSO_ARTIFACT_STORE', '0')
+    if store in ('0', '', False):
+        return None
+    elif store in ('1', True):
+        return _user_cache_dir('artifacts')
+    return store
+
+def _target_args(args):
+    """Arguments which select the target of a compiler.  eg. "-m32" or "-arch arm64"
+    """
+    ret = []
+    for prev, arg in zip([None]+args[:-1], args):
+        if arg.startswith(('-m', '--target=', '-target', '-arch', '--sysroot', '-isysroot')) or prev in ('-arch', '-target', '-isysroot'):
+            ret.append(arg)
+    return ret
+
+class ArtifactStore(object):
+    """Directory of built files.  Each entry is a sub-directory named by its key.
+
+    :param str cdir: Directory name.
+    """
+    def __init__(self, cdir):
+        self.dir = cdir
+        # caches the version output of compiler executables
+        self._probes = _ProbeCache(os.path.join(cdir, 'compilers'))
+
+    def identity(self, compiler):
+        """Describe the compiler and linker executables, their versions, and the target.
+        Not the flags from the sysconfig of this interpreter (eg. compiler_so), which may differ
+        between interpreters.  The flags which a DSO passes are part of its key.
+        """
+        if compiler.compiler_type=='msvc':
+            return [compiler.compiler_type, self._probes.executable(getattr(compiler, 'cc', None), [])]
+        ident = [compiler.compiler_type]
+        for name in ('compiler_so', 'linker_so', 'archiver'):
+            argv = getattr(compiler, name, None)
+            ident.append(self._probes.executable(argv[0]) if argv else None)
+        CC = compiler.compiler_so or ['cc']
+        target = _target_args(CC[1:])
+        ident.extend([target, self._probes.executable(CC[0], target+['-dumpmachine'])])
+        return ident
+
+    def key(self, parts):
+        return hashlib.sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.dir, key[:2], key)
+
+    def get(self, key, outputs):
+        """Place copies of the files of an entry, newer than any sources.
+
+        :param dict outputs: Map name in entry to destination file name.
+        :returns: True if the entry has all of these files.
+        """
+        entry = self._path(key)
+        if not all([os.path.isfile(os.path.join(entry, name)) for name in outputs]):
+            return False
+        for name, dst in outputs.items():
+            if not os.path.isdir(os.path.dirname(dst)):
+                os.makedirs(os.path.dirname(dst))
+            # never hard linked.  Entries must not be modified.
+            stage_file(os.path.join(entry, name), dst, hardlink=False, preserve_times=False, verbose=0)
+        return True
+
+    def put(self, key, outputs):
+        """Add an entry, unless one already exists.
+
+        :param dict outputs: Map name in entry to file name.
+        """
+        entry = self._path(key)
+        if os.path.isdir(entry):
+            return
+        try:
+            with _atomic(entry) as tmp:
+                for name, src in outputs.items():
+                    dst = os.path.join(tmp, name)
+                    if not os.path.isdir(os.path.dirname(dst)):
+                        os.makedirs(os.path.dirname(dst))
+                    stage_file(src, dst, hardlink=False, verbose=0)
+            log.debug('Stored %s', entry)
+        except (IOError, OSError) as e:
+            log.debug('Unable to store %s : %s', entry, e) # eg. another process stored first
@@ -2,6 +2,8 @@
 # SPDX-License-Identifier: BSD
 # See LICENSE
 import os
+import copy
+from types import MethodType
 from functools import partial
 
 try:
@@ -24,6 +26,7 @@ import logging as log
 
 __all__ = (
     'new_compiler',
+    'copy_compiler',
 )
 
 
@@ -103,3 +106,31 @@ def new_compiler(**kws):
             compiler.preprocess = _default_preprocess
 
     return compiler
+
+def _rebind(val, old, new):
+    if val is old:
+        return new
+    elif isinstance(val, list):
+        return list(val)
+    elif isinstance(val, dict):
+        return dict(val)
+    elif isinstance(val, MethodType) and val.__self__ is old:
+        return MethodType(val.__func__, new)
+    elif isinstance(val, partial):
+        return partial(val.func, *[_rebind(arg, old, new) for arg in val.args], **(val.keywords or {}))
+    return val
+
+def copy_compiler(compiler, **kws):
+    """Returns an independent copy of a compiler returned by :py:func:`new_compiler`,
+    without repeating customization and (for MSVC) initialization.
+    Executable and option lists are copied, and patched methods re-bound to the copy.
+    Keyword arguments are set as attributes of the copy.  eg. verbose=True
+
+    Added in 2.12
+    """
+    new = copy.copy(compiler)
+    for name, val in vars(compiler).items():
+        setattr(new, name, _rebind(val, compiler, new))
+    for name, val in kws.items():
+        setattr(new, name, val)
+    return new
@@ -0,0 +1,214 @@
+# Copyright 2022  Michael Davidsaver
+# SPDX-License-Identifier: BSD
+# See LICENSE
+"""Deferred cythonize.  cf. setuptools_dso.cythonize(..., defer=True)
+
+Sources are generated by build_ext, as jobs of the same :py:class:`jobs.Scheduler`
+which compiles and links.  Each is generated with a separate Cython process,
+and optionally cached by content.
+"""
+
+import os
+import re
+import sys
+import json
+import shutil
+import hashlib
+import logging as log
+
+from .compiler import CompileError
+from .jobs import popen
+from .runtime import _user_cache_dir
+from .staging import _atomic, _hash_file
+
+__all__ = (
+    'defer_extension',
+    'cythonize_extension',
+)
+
+# cythonize() keyword arguments understood when deferring
+_options = ('language', 'include_path', 'compiler_directives', 'language_level', 'build_dir',
+            'force', 'quiet', 'nthreads', 'cache')
+
+# leading "# distutils: key = value" comments of a .pyx
+_distutils_comment = re.compile(r'#\s*distutils\s*:\s*(\w+)\s*=\s*(.*)')
+
+def _cython_version():
+    import Cython
+    return Cython.__version__
+
+def _distutils_info(src):
+    """Parse "# distutils: ..." comments in the leading comment block of a Cython source.
+    """
+    ret = {}
+    with open(src, 'r') as F:
+        for line in F:
+            line = line.strip()
+            if not line:
+                continue
+            elif not line.startswith('#'):
+                break
+            M = _distutils_comment.match(line)
+            if M is not None:
+                ret[M.group(1)] = M.group(2).strip()
+    return ret
+
+def _target(src, language, build_dir=None):
+    """Name of generated source.  eg. "pkg/mod.pyx" -> "pkg/mod.c"
+    """
+    target = os.path.splitext(src)[0] + ('.cpp' if language=='c++' else '.c')
+    if build_dir:
+        # same as Cython.Build.cythonize()
+        target = os.path.join(build_dir, os.path.splitdrive(target)[1].lstrip(os.sep+(os.altsep or '')))
+    return target
+
+def defer_extension(ext, options):
+    """Prepare to cythonize an Extension with :py:func:`cythonize_extension`.
+
+    :param ext: A :py:class:`setuptools_dso.Extension`
+    :param dict options: Keyword arguments of cythonize()
+    :returns: False if cythonize() must be called now.
+    """
+    unknown = set(options) - set(_options)
+    if unknown:
+        log.debug("Unable to defer cythonize() of %s with %s", ext.name, sorted(unknown))
+        return False
+
+    language = None
+    for src in ext.sources:
+        if os.path.splitext(src)[1]!='.pyx':
+            continue
+        info = _distutils_info(src)
+        if set(info) - set(['language']):
+            log.debug("Unable to defer cythonize() of %s with '# distutils: %s'", src, sorted(info))
+            return False
+        language = info.get('language') or language
+
+    language = language or ext.language or options.get('language')
+    if language=='c++':
+        ext.language = 'c++'
+    ext.cython_options = dict(options, language=language)
+    return True
+
+def _dependency_tree(include_path):
+    """A new Cython DependencyTree.  Not the memoized one of Cython.Build.Dependencies.create_dependency_tree()
+    as files may have changed (eg. with --watch).
+    """
+    from Cython.Build.Dependencies import DependencyTree
+    from Cython.Compiler.Main import CompilationOptions, default_options
+    options = CompilationOptions(default_options, include_path=list(include_path) + ['.'])
+    try:
+        from Cython.Compiler.Main import Context
+        ctx = Context.from_options(options) # Cython >= 3.0
+    except (ImportError, AttributeError):
+        ctx = options.create_context()
+    return DependencyTree(ctx, quiet=True)
+
+def _depends(src, include_path):
+    """Files which src depends on, as found by Cython.  Transitively.
+    Including .pxd and .pxi files found through sys.path.  eg. from numpy or Cython itself.
+    """
+    deps = _dependency_tree(include_path).all_dependencies(src)
+    return sorted(set([os.path.normpath(dep) for dep in deps if os.path.isfile(dep)]) - set([os.path.normpath(src)]))
+
+def _args(options):
+    """Cython command line arguments
+    """
+    args = []
+    if options.get('language')=='c++':
+        args.append('--cplus')
+    for D in options.get('include_path') or []:
+        args.extend(['-I', D])
+    directives = dict(options.get('compiler_directives') or {})
+    if options.get('language_level') is not None:
+        directives['language_level'] = options['language_level']
+    for name in sorted(directives):
+        args.extend(['-X', '%s=%s'%(name, directives[name])])
+    return args
+
+def _cache_dir(cache):
+    """Resolve cythonize(cache=) to a directory, or None if disabled.  cf. probe._probe_cache_dir()
+    """
+    if cache is None:
+        cache = os.environ.get('SETUPTOOLS_DSO_CYTHON_CACHE', '0')
+        if cache in ('0', ''):
+            cache = False
+        elif cache=='1':
+            cache = True
+    if cache is True:
+        return _user_cache_dir('cython')
+    return cache or None
+
+def _makedirs(path):
+    if path and not os.path.isdir(path):
+        try:
+            os.makedirs(path)
+        except OSError:
+            if not os.path.isdir(path): # may race with another job
+                raise
+
+def _copy(src, dst):
+    with _atomic(dst) as tmp:
+        shutil.copyfile(src, tmp)
+
+def cythonize_extension(ext, force=False, dry_run=False):
+    """Generate C or C++ sources for the .pyx sources of an Extension prepared by :py:func:`defer_extension`.
+    The generated sources then replace .pyx sources in ext.sources.
+
+    Generated sources may be cached by the contents of each .pyx, and its dependencies,
+    Cython version, Cython options, and module name.
+    Only when $SETUPTOOLS_DSO_CYTHON_CACHE is '1' (a per-user directory) or a directory name,
+    or with ``cythonize(..., cache=True)`` (or a directory name).
+    """
+    options = ext.cython_options
+    force = force or options.get('force')
+    include_path = options.get('include_path') or []
+    args = _args(options)
+    cdir = _cache_dir(options.get('cache'))
+
+    sources = []
+    for src in ext.sources:
+        if os.path.splitext(src)[1]!='.pyx':
+            sources.append(src)
+            continue
+
+        target = _target(src, options.get('language'), options.get('build_dir'))
+        sources.append(target)
+        depends = [src] + _depends(src, include_path)
+
+        if not force and os.path.isfile(target):
+            mtime = os.stat(target).st_mtime
+            if all([os.stat(dep).st_mtime <= mtime for dep in depends]):
+                log.debug("%s up-to-date", target)
+                continue
+
+        H = hashlib.sha256(json.dumps([_cython_version(), ext.name, args]).encode('utf-8'))
+        for dep in depends:
+            H.update(dep.replace(os.sep, '/').encode('utf-8'))
+            H.update(_hash_file(dep).encode())
+        cached = cdir and os.path.join(cdir, H.hexdigest()[:2], H.hexdigest()+os.path.splitext(target)[1])
+
+        if dry_run:
+            continue
+
+        _makedirs(os.path.dirname(target))
+
+        if cached and os.path.isfile(cached):
+            log.info("cached %s -> %s", src, target)
+            _copy(cached, target)
+            continue
+
+        cmd = [sys.executable, '-m', 'cython'] + args + ['-o', target, src]
+        log.info(' '.join(cmd))
+        if popen(cmd).wait()!=0:
+            raise CompileError("Cython failed to translate %s"%src)
+
+        if cached:
+            try:
+                _makedirs(os.path.dirname(cached))
+                _copy(target, cached)
+            except (IOError, OSError) as e:
+                log.debug('Unable to cache %s : %s', target, e)
+
+    ext.sources[:] = sources
+    del ext.cython_options
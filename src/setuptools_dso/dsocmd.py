@@ -4,11 +4,13 @@
 import sys
 import os
 import re
+import json
+import shutil
+import hashlib
 
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 from importlib import import_module # say that three times fast...
-from multiprocessing import Pool
-import multiprocessing as MP
+from contextlib import contextmanager
 import logging as log
 
 def _import_bdist_wheel():
@@ -27,19 +29,30 @@ _bdist_wheel = _import_bdist_wheel()
 del _import_bdist_wheel
 
 from setuptools import Command, Distribution, Extension as _Extension
+from setuptools.extension import Library as _Library
 from setuptools.command.build_ext import build_ext as _build_ext
 from setuptools.command.install import install as _install
+from setuptools.command.install_lib import install_lib as _install_lib
 from setuptools.command.bdist_egg import bdist_egg as _bdist_egg
 
 try:
     # Allows for 3.12 support
     from setuptools.command.build import build as _build
     from setuptools.modified import newer_group
+    from setuptools.errors import OptionError as DistutilsOptionError
+    from setuptools.errors import SetupError as DistutilsSetupError
 except ImportError:
     from distutils.command.build import build as _build
     from distutils.dep_util import newer_group
+    from distutils.errors import DistutilsOptionError, DistutilsSetupError
 
-from .compiler import new_compiler
+from .probe import get_session
+from .executor import get_executor
+from .compiler import CompileError, copy_compiler
+from .artifacts import ArtifactStore, _store_dir
+from .jobs import Scheduler, track_spawn
+from .staging import stage_file, _hash_file, stage_tree, _is_native, _atomic
+from .runtime import _lookup_dso
 
 __all__ = (
     'DSO',
@@ -48,32 +61,24 @@ __all__ = (
     'build_ext',
     'bdist_egg',
     'install',
+    'install_lib',
 )
 
 Distribution.x_dsos = None
 
-if sys.version_info<(3,4) or MP.get_start_method()!='fork':
-    # bypass multiprocessing optimization (parallel compile)
-    # for older py (can't pickle the necessary pieces)
-    # freeze_support() is a pain, and is needed by methods other than 'fork'.
-    # Contrary to documentation, this is not limited to Windows.
-    # https://bugs.python.org/issue32146
-    # https://bugs.python.org/issue33725
-    class Pool(object):
-        def __init__(self, N):
-            pass
-        def __enter__(self):
-            return self
-        def __exit__(self,A,B,C):
-            pass
-        class DummyJob(object):
-            def __init__(self, fn, args, kws):
-                self._F = fn, args, kws
-            def get(self):
-                fn, args, kws = self._F
-                return fn(*args, **kws)
-        def apply_async(self, fn, args, kws):
-            return self.DummyJob(fn, args, kws)
+# As before 2.12, build serially where multiprocessing would not 'fork' (Windows, macOS).
+# eg. MSVC initializes lazily, and both adjust os.environ for each command.
+_max_jobs = 1 if sys.platform in ('win32', 'darwin') else None
+
+# preprocessor line marker.  eg. '# 1 "foo.h" 1' (GCC and clang) or '#line 1 "foo.h"' (MSVC)
+_line_marker = re.compile(br'^#(?:line)?\s+\d+\s+"(.*)"')
+
+def _file_stamp(fname):
+    try:
+        S = os.stat(fname)
+        return [S.st_size, S.st_mtime]
+    except OSError:
+        return None
 
 def _system_concurrency():
     if 'NUM_JOBS' in os.environ: # because it is so very cumbersome to pass extra build args through pip and setuptools ...
@@ -134,6 +139,41 @@ def system_concurrency():
         log.warning('Warning: Unable to estimate system concurrency, default to sequential build: %r'%e)
         return 1
 
+# cf. DSO(..., profile=) and build_dso --profile
+_profiles = ('default', 'release-small')
+
+# options of both build_dso and build_ext
+_lazy_options = [
+    ('lazy-dsos', None,
+     "with --inplace, build DSOs, and Extensions linked against them, on first use.  cf. $SETUPTOOLS_DSO_LAZY_BUILD.  "
+     "To import such an Extension before any DSO is looked up, the package __init__.py must import "
+     "a _dsomanifest (eg. 'from .lib import _dsomanifest'), or call setuptools_dso.lazy.install()"),
+    ('build-only=', None,
+     "comma separated names of the only DSOs and Extensions to build.  With the DSOs these need"),
+]
+
+def _finalize_lazy(cmd):
+    if isinstance(cmd.build_only, str):
+        cmd.build_only = [name.strip() for name in cmd.build_only.split(',') if name.strip()]
+    if cmd.lazy_dsos is None:
+        cmd.lazy_dsos = os.environ.get('SETUPTOOLS_DSO_LAZY_BUILD', '0')=='1'
+    if cmd.build_only:
+        cmd.lazy_dsos = False # building on first use.  cf. lazy.build()
+    elif cmd.lazy_dsos and not cmd.inplace:
+        log.warning("--lazy-dsos ignored without --inplace")
+        cmd.lazy_dsos = False
+
+def _file_size(fname):
+    try:
+        return os.path.getsize(fname)
+    except OSError:
+        return None # dry_run
+
+def _log_size(fname, before, after, step):
+    if before and after is not None:
+        log.info("size of %s %d -> %d bytes (%+.1f%%) with %s",
+                 os.path.basename(fname), before, after, 100.0*(after-before)/before, step)
+
 def massage_dir_list(bdirs, indirs):
     """Process a list of directories for use with -I or -L
     For relative paths, also include paths relative to a build directory
@@ -149,6 +189,81 @@ def massage_dir_list(bdirs, indirs):
 
     return list(filter(os.path.isdir, dirs))
 
+# changes to files with these extensions, in an include directory, cause a rebuild when watching
+_header_exts = ('.h', '.hh', '.hpp', '.hxx', '.inc', '.inl', '.ipp', '.tcc')
+
+def _watch_files(target, exclude):
+    """Files, and directories of headers, of a DSO or Extension.
+    Only include directories within the current directory are watched.  eg. not /usr/include
+    :returns: ({absolute file path: name in target.sources}, set(directories))
+    """
+    files = dict([(os.path.abspath(F), F) for F in list(target.sources) + list(target.depends or [])])
+    dirs = set([os.path.dirname(F) for F in files])
+    top = os.path.abspath(os.curdir)
+    for D in target.include_dirs or []:
+        D = os.path.abspath(D)
+        if os.path.isdir(D) and not os.path.relpath(D, top).startswith(os.pardir) \
+                and not any([D==E or D.startswith(E+os.sep) for E in exclude]):
+            dirs.add(D)
+    return files, dirs
+
+# lists of a DSO or Extension which are extended when building
+_extended_lists = ('include_dirs', 'library_dirs', 'libraries', 'extra_objects', 'extra_link_args')
+
+def _snapshot_lists(target):
+    """Remember the lists of a DSO or Extension before the first build extends them.  cf. _restore_lists()
+    """
+    if not hasattr(target, '_orig_lists'):
+        target._orig_lists = dict([(A, list(getattr(target, A) or [])) for A in _extended_lists])
+
+def _restore_lists(target):
+    """Undo the changes of a previous build before re-building.  eg. duplicate -L or -Wl,-rpath
+    """
+    for A, L in getattr(target, '_orig_lists', {}).items():
+        setattr(target, A, list(L))
+
+def _affected(targets, changed, dsos):
+    """Which DSOs and Extensions must be rebuilt after some files changed.
+    :param targets: A list of (DSO or Extension, files, dirs) from :py:func:`_watch_files`
+    :param changed: A set of absolute file names, or None if unknown.
+    :param dsos: All :py:class:`DSO` s.
+    :returns: {name: None to rebuild, or set(changed sources) to re-compile only these}
+    """
+    stale = {}
+    for target, files, dirs in targets:
+        if changed is None:
+            stale[target.name] = None
+            continue
+        hits = changed.intersection(files)
+        headers = [F for F in changed if os.path.dirname(F) in dirs and os.path.splitext(F)[1].lower() in _header_exts]
+        sources = set([files[F] for F in hits if files[F] in target.sources])
+        if headers or len(sources)<len(hits): # a header, or other depends=, changed
+            stale[target.name] = None
+        elif sources:
+            stale[target.name] = sources
+
+    # re-link consumers of a changed static DSO
+    static = set([dso.name for dso in dsos if dso.kind=='static'])
+    while True:
+        relink = [target.name for target, _files, _dirs in targets
+                  if target.name not in stale and static.intersection(stale).intersection(getattr(target, 'dsos', []))]
+        if not relink:
+            return stale
+        for name in relink:
+            stale[name] = set()
+
+def _objects(compiled):
+    """Object files from a list of compile Jobs
+    """
+    return [obj for job in compiled for obj in job.result()]
+
+def _unless_restored(restored, fn, *args, **kws):
+    """Call fn, unless a DSO was restored from the artifact store.  cf. build_dso._restore_dso()
+    """
+    if restored is not None and restored.result()[1]:
+        return None
+    return fn(*args, **kws)
+
 def expand_sources(cmd, sources):
     for i,src in enumerate(sources):
         if os.path.exists(src):
@@ -191,18 +306,46 @@ class DSO(_Extension):
                          True (default) uses the conventional filename,
                          False disables generation,
                          or a specific filename string.
+    :param str kind: 'shared' (default) or 'static'.  A 'static' DSO is built as
+                     a static archive of position independent objects in the build_temp
+                     directory, and is linked directly into each :py:class:`Extension`
+                     or :py:class:`DSO` which lists it in ``dsos=``.
+                     No library file or "info" module is installed.
+                     (Added in 2.12)
+    :param list isa_variants: CPU micro-architecture levels (eg. ``['x86-64-v2', 'x86-64-v3', 'x86-64-v4']``)
+                              for which to build additional copies of this DSO with ``-march=<level>``.
+                              Each is placed in a ``glibc-hwcaps/<level>/`` sub-directory.
+                              Levels not supported by the compiler are skipped.
+                              At runtime, the best variant for the running CPU is selected.
+                              Order from lowest to highest.  ELF targets only.
+                              (Added in 2.12)
+    :param str profile: None (default) to use the ``build_dso --profile`` of the build,
+                        'default', or 'release-small'.  See :ref:`profiles`.
+                        (Added in 2.12)
     """
     def __init__(self, name, sources,
                  soversion=None,
                  lang_compile_args=None,
                  dsos=None,
                  gen_info=True,
+                 kind='shared',
+                 isa_variants=None,
+                 profile=None,
                  **kws):
         _Extension.__init__(self, name, sources, **kws)
+        if kind not in ('shared', 'static'):
+            raise ValueError("DSO %s kind must be 'shared' or 'static', not %r"%(name, kind))
+        if profile is not None and profile not in _profiles:
+            raise ValueError("DSO %s profile must be one of %s, not %r"%(name, _profiles, profile))
+        if kind=='static' and isa_variants:
+            raise ValueError("DSO %s kind='static' does not support isa_variants"%name)
         self.lang_compile_args = lang_compile_args or {}
         self.soversion = soversion or None
         self.dsos = dsos or []
         self.gen_info = gen_info
+        self.kind = kind
+        self.isa_variants = list(isa_variants or [])
+        self.profile = profile
 
 class dso2libmixin:
     def __add_ext_candidates(self, parts, dsosearch):
@@ -230,15 +373,72 @@ class dso2libmixin:
         except ImportError as e:
             log.debug("Error finding external candidates for %s: %s"%(parts, e))
 
+    def __versioned(self, dsodir, dso):
+        """Find the soversion qualified library file.  eg. "libmylib.so.0"
+        Named by the soversion of a DSO built by this distribution,
+        otherwise by the soname recorded in the manifest, or info module, of an installed DSO.
+        """
+        if sys.platform == "win32":
+            return None
+        local = self._local_dsos().get(dso)
+        if local is not None:
+            soname = self.get_finalized_command('build_dso')._name2libname(local, so=True)
+        else:
+            try:
+                soname = _lookup_dso(dso, dso.rpartition('.')[0]).soname
+            except ImportError:
+                return None
+        fname = os.path.join(dsodir, soname)
+        return fname if os.path.isfile(fname) else None
+
+    def _local_dsos(self):
+        """Map names of the DSOs built by this distribution to :py:class:`DSO` instances
+        """
+        dsos = self.get_finalized_command('build_dso').dsos
+        if dsos is None or callable(dsos):
+            return {}
+        return dict([(dso.name, dso) for dso in dsos])
+
+    def _static_lib(self, dso):
+        """Location of the archive for a kind='static' DSO
+        eg. "build/temp.../pkg/mod/libmylib.a"
+        """
+        parts = dso.name.split('.')
+        libname = self.compiler.library_filename(parts[-1], lib_type='static')
+        return os.path.join(self.build_temp, *(parts[:-1]+[libname]))
+
     def dso2lib_pre(self, ext):
         # ext may be our Extension or DSO
+        _snapshot_lists(ext)
         mypath = os.path.join('.', *ext.name.split('.')[:-1])
 
         soargs = set()
         solibs = []
         sodirs = []
+        soobjs = []
+        staticargs = [] # in order.  eg. "-framework Foo"
+
+        local = self._local_dsos()
+        todo, seen = list(getattr(ext, 'dsos', [])), set()
+
+        while todo:
+            dso = todo.pop(0)
+            if dso in seen:
+                continue
+            seen.add(dso)
+
+            static = local.get(dso)
+            if static is not None and static.kind=='static':
+                # link archive directly.  Also link whatever the archive would have been linked against.
+                log.debug("Will link static DSO %s"%dso)
+                soobjs.append(self._static_lib(static))
+                soobjs.extend(static.extra_objects or [])
+                solibs.extend(static.libraries or [])
+                sodirs.extend(massage_dir_list([self.build_lib], static.library_dirs or []))
+                staticargs.extend(static.extra_link_args or [])
+                todo.extend(static.dsos)
+                continue
 
-        for dso in getattr(ext, 'dsos', []):
             log.debug("Will link against DSO %s"%dso)
 
             parts = dso.split('.')
@@ -256,17 +456,22 @@ class dso2libmixin:
 
             for candidate in dsosearch:
                 C = os.path.join(candidate, libname)
-                if not os.path.isfile(C):
-                    log.debug("  Not %s"%C)
-                else:
+                if os.path.isfile(C):
                     log.debug("  Found %s"%C)
                     sodirs.append(candidate)
+                    solibs.append(parts[-1])
+                    break
+                versioned = self.__versioned(candidate, dso)
+                if versioned:
+                    # eg. installed from a wheel, which omits the soversion alias.
+                    # link by file name.  The SONAME is recorded either way.
+                    log.debug("  Found %s"%versioned)
+                    soobjs.append(versioned)
                     break
+                log.debug("  Not %s"%C)
             else:
                 raise RuntimeError("Unable to find DSO %s needed by extension %s in %s"%(dso, ext.name, dsosearch))
 
-            solibs.append(parts[-1])
-
             if sys.platform=='win32':
                 pass # nothing line -rpath available
 
@@ -287,10 +492,21 @@ class dso2libmixin:
 
         # Do not append to extisting list as it may be shared
         # between multiple extensions
+        ext.extra_objects = (ext.extra_objects or []) + soobjs
         ext.libraries = ext.libraries + solibs
         ext.library_dirs = ext.library_dirs + sodirs
-        ext.extra_link_args = ext.extra_link_args + list(soargs)                
+        ext.extra_link_args = ext.extra_link_args + staticargs + list(soargs)
         
+    def copy_file(self, infile, outfile, preserve_mode=1, preserve_times=1, link=None, level=1):
+        """Place build products with :py:func:`staging.stage_file`.
+        link='sym' is left to :py:meth:`distutils.cmd.Command.copy_file`
+        """
+        if link=='sym':
+            return Command.copy_file(self, infile, outfile, preserve_mode, preserve_times, link, level)
+        return stage_file(infile, outfile, hardlink=True if link=='hard' else None,
+                          preserve_mode=preserve_mode, preserve_times=preserve_times,
+                          verbose=self.verbose, dry_run=self.dry_run)
+
     def dso2lib_post(self, ext_path):
         if sys.platform == 'darwin':
             self.spawn(['otool', '-L', ext_path])
@@ -308,9 +524,28 @@ class build_dso(dso2libmixin, Command):
          "directory alongside your pure Python modules"),
         ('force', 'f',
          "forcibly build everything (ignore file timestamps)"),
-    ]
-
-    boolean_options = ['inplace', 'force']
+        ('probe-cache', None,
+         "cache ProbeToolchain results in a per-user directory"),
+        ('no-probe-cache', None,
+         "do not use cached ProbeToolchain results"),
+        ('batch-compile', None,
+         "compile several sources with one compiler process.  cf. $SETUPTOOLS_DSO_BATCH_COMPILE"),
+        ('profile=', None,
+         "default build profile of DSOs: %s.  cf. $SETUPTOOLS_DSO_PROFILE"%', '.join(_profiles)),
+        ('size-report', None,
+         "report the size change of each size reducing step of a profile.  Each DSO which is linked "
+         "is linked again once per step.  Does not rebuild up-to-date, or re-used, DSOs.  Use --force to report on all"),
+        ('artifact-store=', None,
+         "directory of DSOs re-used between builds.  eg. for other Python versions.  "
+         "'1' for a per-user directory.  cf. $SETUPTOOLS_DSO_ARTIFACT_STORE"),
+        ('keep-going', 'k',
+         "after an error, continue to build what does not depend on the failure.  cf. $SETUPTOOLS_DSO_KEEP_GOING"),
+        ('watch', None,
+         "after building, wait for changes to sources and rebuild.  Until interrupted"),
+    ] + _lazy_options
+
+    boolean_options = ['inplace', 'force', 'probe-cache', 'batch-compile', 'size-report', 'keep-going', 'watch', 'lazy-dsos']
+    negative_opt = {'no-probe-cache': 'probe-cache'}
 
     # eg. allow injection of extra work (eg. code generation)
     # before DSOs are built
@@ -323,6 +558,25 @@ class build_dso(dso2libmixin, Command):
         self.build_temp = None
         self.inplace = None
         self.force = None
+        self.probe_cache = None
+        self.batch_compile = None
+        self.profile = None
+        self.size_report = None
+        self.artifact_store = None
+        self.keep_going = None
+        self.watch = None
+        self.lazy_dsos = None
+        self.build_only = None
+
+        # shared with build_ext, when run by build_ext
+        self.scheduler = None
+        # DSO name -> final Job of each DSO built
+        self.dso_jobs = {}
+        # when watching.  DSO name -> None to rebuild, or a set of the changed sources
+        self._stale = {}
+        # with --artifact-store.  An ArtifactStore, and DSO name -> Job computing its key
+        self._store = None
+        self._keys = {}
 
     def finalize_options(self):
 
@@ -331,10 +585,24 @@ class build_dso(dso2libmixin, Command):
                                    ('build_temp', 'build_temp'),
                                    ('inplace', 'inplace'),
                                    ('force', 'force'),
+                                   ('keep_going', 'keep_going'),
+                                   ('watch', 'watch'),
+                                   ('lazy_dsos', 'lazy_dsos'),
+                                   ('build_only', 'build_only'),
                                    )
+        _finalize_lazy(self)
 
         self.dsos = self.distribution.x_dsos
 
+        if self.profile is None:
+            self.profile = os.environ.get('SETUPTOOLS_DSO_PROFILE') or 'default'
+        if self.profile not in _profiles:
+            raise DistutilsOptionError("--profile must be one of %s, not %r"%(', '.join(_profiles), self.profile))
+
+        if self.probe_cache is not None:
+            # default for ProbeToolchain(cache=None), which may be created by a x_dsos callable
+            get_session().cache = bool(self.probe_cache)
+
     def run(self):
         for cmd_name in self.get_sub_commands():
             self.run_command(cmd_name)
@@ -350,10 +618,10 @@ class build_dso(dso2libmixin, Command):
 
         log.info("Building DSOs")
 
-        self.compiler = new_compiler(#compiler=self.compiler,
-                                     verbose=self.verbose,
-                                     dry_run=self.dry_run,
-                                     force=self.force)
+        # share toolchain detection with any ProbeToolchain used by x_dsos
+        self.compiler = get_session().new_compiler(verbose=self.verbose,
+                                                   dry_run=self.dry_run,
+                                                   force=self.force)
 
         # fixup for MAC to build dylib (MH_DYLIB) instead of bundle (MH_BUNDLE)
         if sys.platform == 'darwin':
@@ -363,9 +631,120 @@ class build_dso(dso2libmixin, Command):
                     if val=='-bundle':
                         linker_so[i] = '-dynamiclib'
 
-        for dso in self.dsos:
-            self.build_dso(dso)
-            self.gen_info_module(dso)
+        # compile locally, or with workers from $SETUPTOOLS_DSO_WORKERS
+        self.executor = get_executor(self.compiler, batch=self.batch_compile)
+        track_spawn(self.compiler)
+
+        store = None if self.dry_run else _store_dir(self.artifact_store)
+        if store and self.compiler.compiler_type!='unix':
+            log.warning("--artifact-store ignored.  Not supported with %s compiler", self.compiler.compiler_type)
+        elif store:
+            log.info("Re-using DSOs from %s", store)
+            self._store = ArtifactStore(store)
+            self._store_ident = self._store.identity(self.compiler)
+
+        # when run by build_ext, DSOs are built while Extensions are compiled.
+        own = self.scheduler is None
+        if own:
+            self.scheduler = Scheduler(self.executor.njobs, keep_going=self.keep_going, limit=_max_jobs)
+        self.scheduler.reserve(self.executor.njobs)
+        log.info('effective NUM_JOBS=%d'%self.scheduler.njobs)
+
+        # with --build-only, info modules and manifests are left as written with --lazy-dsos
+        selected = self._build_closure(self.build_only) if self.build_only else None
+
+        try:
+            for dso in self.dsos:
+                if self.lazy_dsos:
+                    log.info("DSO %s will be built on first use", dso.name)
+                elif selected is None or dso.name in selected:
+                    self.dso_jobs[dso.name] = self.build_dso(dso)
+                if selected is None:
+                    self.gen_info_module(dso)
+
+            if selected is None:
+                self.gen_manifest()
+        except:
+            self.scheduler.wait(check=False)
+            raise
+
+        if own:
+            self.scheduler.wait()
+            if self.watch:
+                self.watch_changes()
+
+    def _build_closure(self, names):
+        """Names of the DSOs needed to build the named DSOs and Extensions.  Including static DSOs.
+        """
+        local = self._local_dsos()
+        todo = list(names)
+        for ext in self.distribution.ext_modules or []:
+            if ext.name in names:
+                todo.extend(getattr(ext, 'dsos', None) or [])
+        ret = set()
+        while todo:
+            name = todo.pop()
+            if name in local and name not in ret:
+                ret.add(name)
+                todo.extend(local[name].dsos)
+        return ret
+
+    def watch_changes(self, ext_cmd=None):
+        """Wait for changes to the sources of each DSO, and of each Extension of ext_cmd,
+        then rebuild those affected.  Until interrupted.
+        The compiler, and the result of x_dsos, are kept between rebuilds.
+
+        :param ext_cmd: A :py:class:`build_ext` which has run, or None.
+        (Added in 2.12)
+        """
+        from .watch import Watcher
+
+        dsos = list(self.dsos or [])
+        exts = list(ext_cmd.extensions) if ext_cmd is not None else []
+        exclude = [os.path.abspath(D) for D in (self.build_temp, self.build_lib)]
+        targets = [(T,)+_watch_files(T, exclude) for T in dsos+exts]
+        dirs = set([D for _T, _files, tdirs in targets for D in tdirs])
+
+        log.info("Watching %d directories for changes.  Ctrl+C to stop", len(dirs))
+        with Watcher(dirs) as W:
+            try:
+                while True:
+                    stale = _affected(targets, W.wait(), dsos)
+                    if not stale:
+                        continue
+                    log.info("Rebuilding %s", ', '.join(sorted(stale)))
+                    try:
+                        self._rebuild(stale, ext_cmd)
+                    except Exception as e: # eg. CompileError.  Wait for a fix.
+                        log.error("Rebuild failed : %s", e)
+                    else:
+                        log.info("Rebuilt.  Watching for changes")
+            except KeyboardInterrupt:
+                log.info("Stop watching")
+
+    def _rebuild(self, stale, ext_cmd):
+        dsos = dict([(dso.name, dso) for dso in self.dsos or []])
+        self._stale = dict([(name, stale[name]) for name in stale if name in dsos])
+        self.dso_jobs = {}
+        self._keys = {}
+        self.scheduler = Scheduler(self.scheduler.njobs if self.scheduler else None, keep_going=self.keep_going,
+                                   limit=_max_jobs)
+        exts = [ext for ext in (ext_cmd.extensions if ext_cmd is not None else [])
+                if ext.name in stale and ext.name not in dsos]
+        for T in [dsos[name] for name in self._stale] + exts:
+            _restore_lists(T)
+        try:
+            for dso in self.dsos or []:
+                if dso.name in self._stale:
+                    self.dso_jobs[dso.name] = self.build_dso(dso)
+            if ext_cmd is not None:
+                ext_cmd._rebuild_extensions(self.scheduler, exts)
+        except:
+            self.scheduler.wait(check=False)
+            raise
+        finally:
+            self._stale = {}
+        self.scheduler.wait()
 
     def _name2file(self, dso, so=False):
         """Translate DSO name (eg. "pkg.mod.mylib" into
@@ -400,65 +779,392 @@ class build_dso(dso2libmixin, Command):
             else:
                 return 'lib%s.so'%(parts[-1],)
 
-    def build_dso(self, dso):
-        # dso is an instance of DSO
-        self.dso2lib_pre(dso)
+    def _compile_dso(self, dso, SRC, macros, include_dirs, output_dir, extra_args, restored=None):
+        """Submit jobs to compile sources, sorted by language.
+        Skipped if the DSO is restored from the artifact store.
+        :returns: List of Jobs, each returning a list of object files
+        """
+        jobs = []
+        changed = self._stale.get(dso.name)
+        for lang, srcs in SRC.items():
+            if changed is not None:
+                # when watching, re-use objects of unchanged sources
+                objects = self.compiler.object_filenames([S for S in srcs if S not in changed], output_dir=output_dir)
+                if all(map(os.path.isfile, objects)):
+                    if objects:
+                        jobs.append(self.scheduler.submit(list, objects, name='reuse objects of %s'%dso.name))
+                    srcs = [S for S in srcs if S in changed]
+                    if not srcs:
+                        continue
+
+            if self.executor.batch:
+                # divide sources evenly between concurrent batches.  Only as many as could start now,
+                # as jobs already running or queued (eg. of other DSOs) occupy the rest.
+                nslices = min(self.scheduler.free_slots(), len(srcs))
+            else:
+                nslices = len(srcs)
+
+            for inputs in [srcs[n::nslices] for n in range(nslices)]:
+                jobs.append(self.scheduler.submit(_unless_restored, restored, self.executor.compile, inputs,
+                                                  output_dir=output_dir,
+                                                  macros=macros,
+                                                  include_dirs=include_dirs,
+                                                  extra_postargs=extra_args + (dso.lang_compile_args.get(lang) or []),
+                                                  depends=dso.depends,
+                                                  deps=[restored],
+                                                  name='compile %s'%inputs[0]))
+        return jobs
+
+    def _compile_inputs(self, dso):
+        """:returns: (sources by language, macros, include_dirs, extra compiler arguments) of a DSO
+        """
         expand_sources(self, dso.sources)
         expand_sources(self, dso.depends)
 
-        baselib = self._name2file(dso)        # eg. "pkg/mod/mylib.so"
+        macros = dso.define_macros[:]
+        for undef in dso.undef_macros:
+            macros.append((undef,))
+
+        extra_args = (dso.extra_compile_args or []) + self._profile_compile_args(dso)
+
+        include_dirs = massage_dir_list([self.build_temp, self.build_lib], dso.include_dirs or [])
+
+        SRC = defaultdict(list)
+
+        # sort by language
+        for src in dso.sources:
+            SRC[self.compiler.language_map[os.path.splitext(src)[-1]]].append(src)
+
+        return SRC, macros, include_dirs, extra_args
+
+    def _artifact_key(self, dso):
+        """Submit jobs to compute the artifact store key of a DSO.
+        Sources are preprocessed, so that changes to headers are noticed.
+        Local DSOs linked against are keyed recursively.
+
+        :returns: A Job returning the key, or None if the DSO can not be stored.
+        """
+        if dso.name in self._keys:
+            return self._keys[dso.name]
+
+        SRC, macros, include_dirs, extra_args = self._compile_inputs(dso)
+        digests = []
+        for lang, srcs in SRC.items():
+            args = extra_args + (dso.lang_compile_args.get(lang) or [])
+            for src in srcs:
+                digests.append(self.scheduler.submit(self._preprocess_digest, src, macros, include_dirs, args,
+                                                     name='preprocess %s'%src))
+
+        # changes to a local dependency, shared or static, change the key
+        local = self._local_dsos()
+        upstream = [self._artifact_key(local[name]) for name in dso.dsos if name in local]
+
+        def build_lib(path): # eg. "build/lib.linux-x86_64-cpython-39" -> "$build_lib"
+            return '$build_lib' if os.path.abspath(path)==os.path.abspath(self.build_lib) else path
+
+        parts = [
+            'setuptools_dso-artifact-1', sys.platform, self._store_ident,
+            dso.name, dso.kind, dso.soversion, dso.language or self.compiler.detect_language(dso.sources),
+            (dso.profile or self.profile), [] if dso.kind=='static' else self._isa_levels(dso),
+            macros, extra_args, dso.lang_compile_args,
+            [src.replace(os.sep, '/') for src in dso.sources],
+            dso.libraries, [build_lib(D) for D in dso.library_dirs or []], dso.runtime_library_dirs,
+            dso.extra_link_args, [_hash_file(obj) for obj in dso.extra_objects or []], dso.dsos,
+        ]
+        if dso.kind!='static':
+            parts.extend([self._profile_link_steps(dso), self._profile_strip(dso)])
+
+        def key():
+            deps = [J.result() for J in digests+upstream]
+            if any([D is None for D in deps]):
+                return None
+            return self._store.key(parts + [deps])
+
+        self._keys[dso.name] = job = self.scheduler.submit(key, deps=digests+upstream, name='key %s'%dso.name)
+        return job
+
+    def _preprocess_digest(self, src, macros, include_dirs, extra_args):
+        """:returns: The sha256 of a preprocessed source, without line markers.  Or None on error.
+
+        Re-used while the size and modification time of the source, and of each file it includes
+        (from the line markers), are unchanged.
+        """
+        # unique for sources with the same basename
+        out = os.path.join(self.build_temp, 'preprocess',
+                           os.path.splitdrive(os.path.abspath(src))[1].lstrip(os.sep)+'.i')
+        args = json.loads(json.dumps([macros, include_dirs, extra_args]))
+        try:
+            with open(out+'.json', 'r') as F:
+                prev = json.load(F)
+            if prev['args']==args and all([_file_stamp(fname)==stamp for fname, stamp in prev['deps']]):
+                return prev['digest']
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            pass
+
+        self.mkpath(os.path.dirname(out))
+        if os.path.exists(out):
+            os.remove(out) # preprocess() skips if newer than src
+        try:
+            self.compiler.preprocess(src, out, macros=macros, include_dirs=include_dirs,
+                                     extra_postargs=extra_args)
+            H, deps = hashlib.sha256(), set()
+            with open(out, 'rb') as F:
+                for line in F:
+                    M = _line_marker.match(line)
+                    if M is not None:
+                        deps.add(M.group(1).decode('utf-8', 'replace'))
+                    elif line.strip():
+                        H.update(line)
+            digest = H.hexdigest()
+        except (CompileError, IOError, OSError) as e:
+            log.debug("Unable to preprocess %s : %s", src, e) # reported by compile
+            return None
+
+        deps = [[fname, _file_stamp(fname)] for fname in sorted(deps) if not fname.startswith('<')] # eg. "<built-in>"
+        try:
+            with _atomic(out+'.json') as tmp:
+                with open(tmp, 'w') as F:
+                    json.dump({'args':args, 'deps':deps, 'digest':digest}, F)
+        except (IOError, OSError) as e:
+            log.debug("Unable to save %s : %s", out+'.json', e)
+        return digest
+
+    def _artifact_files(self, dso, outlib, levels):
+        """:returns: Map name in an artifact store entry to build product.
+        """
+        name = os.path.basename(outlib)
+        ret = {name: outlib}
+        for level in levels:
+            ret['/'.join(['glibc-hwcaps', level, name])] = os.path.join(os.path.dirname(outlib), 'glibc-hwcaps', level, name)
+        if sys.platform == "win32" and dso.kind!='static':
+            for ext in ('.lib', '.exp'):
+                ret[os.path.splitext(name)[0]+ext] = os.path.splitext(outlib)[0]+ext
+        return ret
+
+    def _restore_dso(self, dso, key, outlib, levels):
+        """Place a DSO from the artifact store.
+        :returns: (key, True if restored)
+        """
+        key = key.result()
+        if key is None or self.force or dso.name in self._stale:
+            return key, False
+        elif self._store.get(key, self._artifact_files(dso, outlib, levels)):
+            log.info("re-using '%s' DSO from %s", dso.name, self._store.dir)
+            return key, True
+        return key, False
+
+    def _store_dso(self, dso, restored, outlib, levels):
+        if restored is not None:
+            key, hit = restored.result()
+            if key is not None and not hit:
+                self._store.put(key, self._artifact_files(dso, outlib, levels))
+
+    def _isa_levels(self, dso):
+        """The subset of dso.isa_variants which will be built.
+        """
+        if not dso.isa_variants:
+            return []
+        elif sys.platform in ('win32', 'darwin'):
+            log.warning("DSO %s isa_variants ignored.  Only supported for ELF targets", dso.name)
+            return []
+
+        supported = self.__dict__.setdefault('_isa_supported', {})
+        ret = []
+        for level in dso.isa_variants:
+            if level not in supported:
+                from .probe import ProbeToolchain
+                supported[level] = ProbeToolchain().try_compile('int probe_isa;', extra_postargs=['-march=%s'%level])
+                if not supported[level]:
+                    log.warning("Compiler does not support -march=%s.  Skipping this variant", level)
+            if supported[level]:
+                ret.append(level)
+        return ret
+
+    def _profile_compile_args(self, dso):
+        """Extra compiler arguments for the profile of a DSO.
+        """
+        if (dso.profile or self.profile)!='release-small':
+            return []
+        elif self.compiler.compiler_type=='msvc':
+            return ['/Gy', '/Gw']
+        # a section for each function and variable, which the linker may then discard
+        return ['-ffunction-sections', '-fdata-sections']
+
+    def _profile_link_steps(self, dso):
+        """Size reducing steps of the profile of a DSO, in the order applied.
+        :returns: A list of (step name, [linker arguments])
+        """
+        if (dso.profile or self.profile)!='release-small':
+            return []
+        elif self.compiler.compiler_type=='msvc':
+            return [('/OPT:REF', ['/OPT:REF']), ('/OPT:ICF', ['/OPT:ICF'])]
+        elif sys.platform=='darwin':
+            return [('dead_strip', ['-Wl,-dead_strip'])]
+
+        steps = [('gc-sections', ['-Wl,--gc-sections'])]
+        icf = self._icf_args()
+        if icf:
+            steps.append(('icf', icf))
+        return steps
+
+    def _icf_args(self):
+        """Linker arguments for safe identical code folding.  Or None if not supported.
+        GNU ld does not.  gold and lld do.
+        """
+        if '_icf' not in self.__dict__:
+            from .probe import ProbeToolchain
+            P = ProbeToolchain()
+            for args in ([], ['-fuse-ld=lld'], ['-fuse-ld=gold']):
+                args = args + ['-Wl,--icf=safe']
+                if P.try_link('int probe_icf(void) { return 0; }', extra_link_args=args):
+                    break
+            else:
+                log.warning("Linker does not support --icf=safe.  Install lld or gold to enable identical code folding")
+                args = None
+            self._icf = args
+        return self._icf
+
+    def _profile_strip(self, dso):
+        """Command to discard symbols not needed for dynamic linking.  Or None.
+        """
+        if (dso.profile or self.profile)!='release-small' or self.compiler.compiler_type=='msvc':
+            return None # MSVC already places debug symbols in a separate .pdb
+
+        if '_strip' not in self.__dict__:
+            exe = os.environ.get('STRIP')
+            if not exe:
+                # same prefix as a cross compiler.  eg. "aarch64-linux-gnu-gcc" -> "aarch64-linux-gnu-strip"
+                cc = os.path.basename((getattr(self.compiler, 'compiler_so', None) or ['cc'])[0])
+                M = re.match(r'(.*-)(?:gcc|cc|clang)(?:-[0-9.]+)?$', cc)
+                for cand in ([M.group(1)+'strip'] if M else []) + ['strip']:
+                    exe = shutil.which(cand) if hasattr(shutil, 'which') else cand # py >= 3.3
+                    if exe:
+                        break
+                else:
+                    log.warning("Unable to find 'strip'.  DSOs will not be stripped")
+            self._strip = exe and [exe, '-x' if sys.platform=='darwin' else '--strip-unneeded']
+        return self._strip
+
+    def _strip_dso(self, outlib, strip):
+        """Strip a linked library.  The stripped copy replaces, rather than re-writes, outlib.
+        So any hard linked copy, eg. an earlier in place build, is not modified.
+        """
+        before = _file_size(outlib)
+        tmp = '%s.strip.tmp'%outlib
+        self.spawn(strip + ['-o', tmp, outlib])
+        if not self.dry_run:
+            getattr(os, 'replace', os.rename)(tmp, outlib)
+        _log_size(outlib, before, _file_size(outlib), 'strip')
+
+    def _link_isa_variant(self, dso, level, compiled, linked, outlib, language, strip, restored=None):
+        """Link a copy of a DSO for a CPU micro-architecture level.
+        eg. "build/.../pkg/mod/libmylib.so.0" -> "build/.../pkg/mod/glibc-hwcaps/x86-64-v3/libmylib.so.0"
+
+        glibc >= 2.33 searches these sub-directories automatically.
+        The runtime makes the selection explicit.  cf. runtime._isa_variant()
+        """
+        voutlib = os.path.join(os.path.dirname(outlib), 'glibc-hwcaps', level, os.path.basename(outlib))
+        if restored is not None and restored.result()[1]:
+            return voutlib
+
+        march = ['-march=%s'%level]
+        objects = _objects(compiled) + (dso.extra_objects or [])
+
+        # variant is two directories deeper than the baseline library
+        link_args = [arg.replace('$ORIGIN', '$ORIGIN/../..') for arg in linked.result()]
+
+        self.mkpath(os.path.dirname(voutlib))
+
+        self.compiler.link_shared_object(
+            objects, voutlib,
+            libraries=dso.libraries,
+            library_dirs=massage_dir_list([self.build_lib], dso.library_dirs or []),
+            runtime_library_dirs=dso.runtime_library_dirs,
+            extra_postargs=link_args + march,
+            export_symbols=None,
+            build_temp=self.build_temp,
+            target_lang=language)
+        if strip:
+            self._strip_dso(voutlib, strip)
+        return voutlib
+
+    def build_dso(self, dso):
+        """Submit jobs to build one DSO.
+        Linking waits for the DSOs named in dso.dsos when these are also being built.
+
+        :returns: The final :py:class:`jobs.Job`, or None if up-to-date.
+        """
+        # dso is an instance of DSO
+        SRC, macros, include_dirs, extra_args = self._compile_inputs(dso)
+
         solib = self._name2file(dso, so=True) # eg. "pkg/mod/mylib.so.0"
-        # on windows always baselib==solib
 
         # prepend staging area path
-        outbaselib = os.path.join(self.build_lib, baselib)
         outlib = os.path.join(self.build_lib, solib)
+        if dso.kind=='static':
+            outlib = self._static_lib(dso) # eg. "build/temp.../pkg/mod/libmylib.a"
         sources = list(dso.sources)
 
         depends = sources + dso.depends
-        if not (self.force or newer_group(depends, outlib, 'newer')):
+        if not (self.force or dso.name in self._stale or newer_group(depends, outlib, 'newer')):
             log.debug("skipping '%s' DSO (up-to-date)", dso.name)
             return
         else:
             log.info("building '%s' DSO as %s", dso.name, outlib)
 
-        macros = dso.define_macros[:]
-        for undef in dso.undef_macros:
-            macros.append((undef,))
-
-        extra_args = dso.extra_compile_args or []
-
-        include_dirs = massage_dir_list([self.build_temp, self.build_lib], dso.include_dirs or [])
-
-        SRC = defaultdict(list)
-
-        # sort by language
-        for src in sources:
-            SRC[self.compiler.language_map[os.path.splitext(src)[-1]]].append(src)
+        language = dso.language or self.compiler.detect_language(sources)
+        levels = [] if dso.kind=='static' else self._isa_levels(dso)
+
+        # with --artifact-store, compiling and linking are skipped when the DSO is found
+        restored = None
+        if self._store is not None:
+            key = self._artifact_key(dso)
+            restored = self.scheduler.submit(self._restore_dso, dso, key, outlib, levels,
+                                             deps=[key], name='restore %s'%dso.name)
+
+        # compiling does not wait for other DSOs
+        compiled = self._compile_dso(dso, SRC, macros, include_dirs, self.build_temp, extra_args, restored)
+        deps = [self.dso_jobs.get(name) for name in dso.dsos]
+
+        if dso.kind=='static':
+            # consumers of an archive also wait for whatever the archive will be linked against
+            return self.scheduler.submit(self._archive_dso, dso, compiled, outlib, language, restored,
+                                         deps=compiled+deps+[restored], name='archive %s'%dso.name)
+
+        steps, strip = self._profile_link_steps(dso), self._profile_strip(dso)
+
+        linked = self.scheduler.submit(_unless_restored, restored, self._link_dso, dso, compiled, outlib, language, steps, strip,
+                                       deps=compiled+deps+[restored], name='link %s'%dso.name)
+
+        variants = []
+        for level in levels:
+            log.info("building '%s' DSO variant for %s", dso.name, level)
+            vcompiled = self._compile_dso(dso, SRC, macros, include_dirs,
+                                          os.path.join(self.build_temp, 'isa', level),
+                                          extra_args + ['-march=%s'%level], restored)
+            variants.append(self.scheduler.submit(self._link_isa_variant, dso, level, vcompiled, linked, outlib, language, strip, restored,
+                                                  deps=vcompiled+[linked], name='link %s %s'%(dso.name, level)))
+
+        return self.scheduler.submit(self._stage_dso, dso, outlib, variants, restored, levels,
+                                     deps=[linked]+variants, name='stage %s'%dso.name)
+
+    def _archive_dso(self, dso, compiled, outlib, language, restored=None):
+        if restored is not None and restored.result()[1]:
+            return
+        # objects are already position independent (cf. compiler_so)
+        self.compiler.create_static_lib(_objects(compiled), dso.name.split('.')[-1],
+                                        output_dir=os.path.dirname(outlib),
+                                        target_lang=language)
+        self._store_dso(dso, restored, outlib, [])
+
+    def _link_dso(self, dso, compiled, outlib, language, steps, strip):
+        """Link a shared DSO once its objects, and any DSOs it depends on, are built.
+        Then apply the size reducing steps of its profile.
+        :returns: The extra linker arguments used.
+        """
+        self.dso2lib_pre(dso)
 
-        # do the actual compiling
-        objects = []
-
-        nworkers = system_concurrency()
-        log.info('effective NUM_JOBS=%d'%nworkers)
-        with Pool(nworkers) as P:
-            jobs = []
-            for lang, srcs in SRC.items():
-
-                # submit jobs
-                # allocate every n-th object to the n-th worker.
-                # Load not well balanced, but easy to do.
-                for inputs in [srcs[n::nworkers] for n in range(nworkers)]:
-                    jobs.append(P.apply_async(self.compiler.compile, [inputs], {
-                        'output_dir':self.build_temp,
-                        'macros':macros,
-                        'include_dirs':include_dirs,
-                        'extra_postargs':extra_args + (dso.lang_compile_args.get(lang) or []),
-                        'depends':dso.depends,
-                    }))
-
-            # work for completion
-            [objects.extend(job.get()) for job in jobs]
+        objects = _objects(compiled)
 
         library_dirs = massage_dir_list([self.build_lib], dso.library_dirs or [])
 
@@ -468,8 +1174,8 @@ class build_dso(dso2libmixin, Command):
         if dso.extra_objects:
             objects.extend(dso.extra_objects)
 
-        extra_args = dso.extra_link_args or []
-        solibbase = os.path.basename(solib) # eg. "mylib.so.0"
+        extra_args = list(dso.extra_link_args or [])
+        solibbase = os.path.basename(outlib) # eg. "mylib.so.0"
 
         if sys.platform == 'darwin':
             # we always want to produce relocatable (movable) binaries
@@ -480,36 +1186,78 @@ class build_dso(dso2libmixin, Command):
             # The .lib is considered "temporary" for extensions, but not for us
             # so we pass export_symbols=None and put it along side the .dll
             # eg. "pkg\mod\mylib.dll" and "pkg\mod\mylib.lib"
-            outlib_lib = '%s.lib' % os.path.splitext(outlib)[0]
-            outlib_exp = '%s.exp' % os.path.splitext(outlib)[0]
-            extra_args.append('/IMPLIB:%s'%outlib_lib)
+            extra_args.append('/IMPLIB:%s.lib' % os.path.splitext(outlib)[0])
 
-        elif baselib!=solib: # ELF
+        else: # ELF
+            # Since 2.12, always set SONAME.  Previously only for a versioned DSO.
+            # Allows a dependent to find this library when it was loaded from somewhere
+            # other than its filename.  eg. from a zipapp (cf. runtime._materialize()),
+            # which can not be known when building.
             extra_args.extend(['-Wl,-h,%s'%solibbase])
 
-        language = dso.language or self.compiler.detect_language(sources)
-
-        self.compiler.link_shared_object(
-            objects, outlib,
-            libraries=dso.libraries,
-            library_dirs=library_dirs,
-            runtime_library_dirs=dso.runtime_library_dirs,
-            extra_postargs=extra_args,
-            export_symbols=None,
-            #debug=self.debug,
-            build_temp=self.build_temp,
-            target_lang=language)
+        def link(output, args):
+            self.compiler.link_shared_object(
+                objects, output,
+                libraries=dso.libraries,
+                library_dirs=library_dirs,
+                runtime_library_dirs=dso.runtime_library_dirs,
+                extra_postargs=args,
+                export_symbols=None,
+                #debug=self.debug,
+                build_temp=self.build_temp,
+                target_lang=language)
+
+        sizes = []
+        if self.size_report:
+            # link again with only the first N steps, to show the effect of each
+            for n in range(len(steps)):
+                trial = os.path.join(self.build_temp, 'size-report', '%s.%d'%(solibbase, n))
+                self.mkpath(os.path.dirname(trial))
+                link(trial, extra_args + [arg for _name, args in steps[:n] for arg in args])
+                sizes.append(_file_size(trial))
+
+        for _name, args in steps:
+            extra_args.extend(args)
+
+        link(outlib, extra_args)
+
+        sizes.append(_file_size(outlib))
+        for (name, _args), before, after in zip(steps, sizes, sizes[1:]):
+            _log_size(outlib, before, after, name)
 
         self.dso2lib_post(outlib)
 
+        if strip:
+            self._strip_dso(outlib, strip)
+
+        return extra_args
+
+    def _stage_dso(self, dso, outlib, variants, restored=None, levels=()):
+        """Add to any artifact store.  Create the soversion symlink, and copy in place.
+        """
+        self._store_dso(dso, restored, outlib, levels)
+
+        baselib = self._name2file(dso)        # eg. "pkg/mod/mylib.so"
+        solib = self._name2file(dso, so=True) # eg. "pkg/mod/mylib.so.0"
+        # on windows always baselib==solib
+
+        outbaselib = os.path.join(self.build_lib, baselib)
+        solibbase = os.path.basename(solib) # eg. "mylib.so.0"
+
         if baselib!=solib:
-            # we make best effort here, even though zipfiles (.whl or .egg) will contain copies
+            # wheels omit this alias.  cf. bdist_wheel.egg2dist().  eggs will contain a copy.
             log.info("symlink %s <- %s", solibbase, outbaselib)
             if not self.dry_run:
                 if os.path.exists(outbaselib):
                     os.unlink(outbaselib)
                 os.symlink(solibbase, outbaselib)
             #self.copy_file(outlib, outbaselib) # link="sym" seem to get the target path wrong
+            for vjob in variants: # eg. glibc-hwcaps/x86-64-v3/mylib.so -> mylib.so.0
+                vbaselib = os.path.join(os.path.dirname(vjob.result()), os.path.basename(outbaselib))
+                if not self.dry_run:
+                    if os.path.lexists(vbaselib):
+                        os.unlink(vbaselib)
+                    os.symlink(solibbase, vbaselib)
 
         if self.inplace:
             build_py = self.get_finalized_command('build_py')
@@ -521,15 +1269,40 @@ class build_dso(dso2libmixin, Command):
 
             self.mkpath(os.path.dirname(inplace_dst(outlib)))
             self.copy_file(outlib, inplace_dst(outlib))
+            for vjob in variants: # eg. build/.../path/to/glibc-hwcaps/x86-64-v3/dso.so
+                voutlib = vjob.result()
+                vdst = os.path.join(pkgdir, os.path.relpath(voutlib, os.path.dirname(outlib)))
+                self.mkpath(os.path.dirname(vdst))
+                self.copy_file(voutlib, vdst)
             if baselib!=solib:
                 self.copy_file(outbaselib, inplace_dst(outbaselib))
+                for vjob in variants:
+                    vbaselib = os.path.join(os.path.dirname(vjob.result()), os.path.basename(outbaselib))
+                    self.copy_file(vbaselib, os.path.join(pkgdir, os.path.relpath(vbaselib, os.path.dirname(outlib))))
             if sys.platform == "win32":
                 # on windows linking to x.dll goes through x.lib and x.exp first
+                outlib_lib = '%s.lib' % os.path.splitext(outlib)[0]
+                outlib_exp = '%s.exp' % os.path.splitext(outlib)[0]
                 self.copy_file(outlib_lib, inplace_dst(outlib_lib))
                 self.copy_file(outlib_exp, inplace_dst(outlib_exp))
 
+    def _shared_depends(self, dso):
+        """Names of the shared DSOs which must be loaded along with this DSO.
+        Static DSOs are replaced with their own dependencies.
+        """
+        local = self._local_dsos()
+        todo, ret = list(dso.dsos), []
+        while todo:
+            name = todo.pop(0)
+            static = local.get(name)
+            if static is not None and static.kind=='static':
+                todo.extend(static.dsos)
+            elif name not in ret:
+                ret.append(name)
+        return ret
+
     def gen_info_module(self, dso):
-        if not dso.gen_info:
+        if not dso.gen_info or dso.kind=='static':
             log.debug("skiping creation of info module")
             return
 
@@ -548,6 +1321,9 @@ class build_dso(dso2libmixin, Command):
             )
         )
 
+        # may be created before the DSO is linked
+        self.mkpath(os.path.dirname(info_module_filename))
+
         if not self.dry_run:
             import textwrap
 
@@ -561,15 +1337,21 @@ class build_dso(dso2libmixin, Command):
                     dsoname = {dso.name!r}
                     libname = {libname!r}
                     soname = {soname!r}
-                    depends = {dso.dsos!r}
+                    depends = {depends!r}
+                    isa_variants = {isa_variants!r}
                     dir = os.path.dirname(__file__)
                     filename = os.path.join(dir, libname)
                     sofilename = os.path.join(dir, soname)
+                    if not os.path.exists(filename):
+                        # soversion alias not installed.  eg. from a wheel
+                        filename = sofilename
                     del dir
                     del os
                     __all__ = ("dsoname", "libname", "soname", "filename", "sofilename")
                     """
                     ).format(dso=dso,
+                             depends=self._shared_depends(dso),
+                             isa_variants=self._isa_levels(dso),
                              libname=self._name2libname(dso),
                              soname=self._name2libname(dso, so=True))
                 )
@@ -586,18 +1368,111 @@ class build_dso(dso2libmixin, Command):
             self.mkpath(os.path.dirname(info_module_dest))
             self.copy_file(info_module_filename, info_module_dest)
 
+    def _closure(self, dso):
+        """Names of DSOs which must be loaded along with this DSO, including itself.
+        Topologically sorted so that each DSO appears before its dependencies.
+        Dependencies of DSOs external to this distribution are not expanded.
+        """
+        local = self._local_dsos()
+        post, seen = [], set()
+        def visit(name):
+            if name in seen:
+                return
+            seen.add(name)
+            dep = local.get(name)
+            if dep is not None:
+                for name2 in self._shared_depends(dep):
+                    visit(name2)
+            post.append(name)
+        visit(dso.name)
+        return post[::-1]
+
+    def gen_manifest(self):
+        """Write one manifest module for each package directory containing DSOs.
+        eg. "pkg/mod/_dsomanifest.py" describes "pkg/mod/*.so"
+        """
+        bypkg = OrderedDict()
+        for dso in self.dsos:
+            if dso.gen_info and dso.kind!='static':
+                pkg = '.'.join(dso.name.split('.')[:-1])
+                bypkg.setdefault(pkg, []).append(dso)
+
+        for pkg, dsos in bypkg.items():
+            manifest_filename = os.path.join(self.build_lib, *(pkg.split('.')+['_dsomanifest.py']))
+            log.info("creating DSO manifest for %s at %s", pkg, manifest_filename)
+
+            entries = ['    %r: %r,'%(dso.name, {
+                'libname': self._name2libname(dso),
+                'soname': self._name2libname(dso, so=True),
+                'depends': self._shared_depends(dso),
+                'closure': self._closure(dso),
+                'isa_variants': self._isa_levels(dso),
+            }) for dso in dsos]
+
+            lines = ['# generated by setuptools_dso', 'dsos = {'] + entries + ['}']
+            if self.lazy_dsos:
+                # what to build on first use.  cf. setuptools_dso.lazy
+                lines.append('lazy = %r'%({
+                    'setup': os.path.abspath(self.distribution.script_name or 'setup.py'),
+                    'dsos': [dso.name for dso in self.dsos if dso.kind!='static'],
+                    'extensions': [ext.name for ext in self.distribution.ext_modules or [] if getattr(ext, 'dsos', None)],
+                },))
+                # Extensions imported before any DSO is looked up.  eg. "from .lib import _dsomanifest" in a package __init__.py
+                lines += ['from setuptools_dso.lazy import register as _register', '_register(lazy)']
+
+            if not self.dry_run:
+                self.mkpath(os.path.dirname(manifest_filename))
+                with open(manifest_filename, 'w') as F:
+                    F.write('\n'.join(lines + ['']))
+
+            if self.inplace:
+                build_py = self.get_finalized_command("build_py")
+                pkgdir = build_py.get_package_dir(pkg)  # path.to -> src/path/to
+                self.mkpath(pkgdir)
+                self.copy_file(manifest_filename, os.path.join(pkgdir, '_dsomanifest.py'))
+
+
+# placeholder result of a failed compile of an optional Extension
+_failed = object()
 
 class build_ext(dso2libmixin, _build_ext):
 
     # allow build_ext to depend on other commands
     sub_commands = _build_ext.sub_commands[:]
 
+    user_options = _build_ext.user_options + [
+        ('keep-going', 'k',
+         "after an error, continue to build what does not depend on the failure.  cf. $SETUPTOOLS_DSO_KEEP_GOING"),
+        ('watch', None,
+         "after building, wait for changes to sources and rebuild.  Until interrupted"),
+    ] + _lazy_options
+    boolean_options = _build_ext.boolean_options + ['keep-going', 'watch', 'lazy-dsos']
+
+    def initialize_options(self):
+        _build_ext.initialize_options(self)
+        self.keep_going = None
+        self.watch = None
+        self.lazy_dsos = None
+        self.build_only = None
+        self.scheduler = None
+        self.executor = None
+
     def finalize_options(self):
         _build_ext.finalize_options(self)
 
         self.include_dirs = massage_dir_list([self.build_temp], self.include_dirs or [])
         self.library_dirs = massage_dir_list([self.build_lib]  , self.library_dirs or [])
 
+        if self.keep_going is None:
+            self.keep_going = os.environ.get('SETUPTOOLS_DSO_KEEP_GOING', '0')=='1'
+
+        _finalize_lazy(self)
+        if self.build_only:
+            self.extensions = [ext for ext in self.extensions or [] if ext.name in self.build_only]
+        elif self.lazy_dsos:
+            # built on first import.  cf. setuptools_dso.lazy
+            self.extensions = [ext for ext in self.extensions or [] if not getattr(ext, 'dsos', None)]
+
         self._propagate_inplace()
 
     def _propagate_inplace(self):
@@ -610,15 +1485,89 @@ class build_ext(dso2libmixin, _build_ext):
                     cmd.inplace = True
 
     def run(self):
-        # original setuptools/distutils don't call sub_commands for build_ext
-        for cmd_name in self.get_sub_commands():
-            self.run_command(cmd_name)
+        # Extensions are compiled while DSOs are built.  Only linking waits.
+        # The Scheduler may be shared by build.run()
+        if self.scheduler is None:
+            self.scheduler = Scheduler(keep_going=self.keep_going, limit=_max_jobs)
+        if 'build_dso' in self.get_sub_commands() and not self.distribution.have_run.get('build_dso'):
+            self.get_finalized_command('build_dso').scheduler = self.scheduler
 
-        # the Darwin linker errors if given non-existant directories :(
-        [self.mkpath(D) for D in self.library_dirs]
-        _build_ext.run(self)
+        try:
+            # original setuptools/distutils don't call sub_commands for build_ext
+            for cmd_name in self.get_sub_commands():
+                self.run_command(cmd_name)
 
-    def build_extension(self, ext):
+            # the Darwin linker errors if given non-existant directories :(
+            [self.mkpath(D) for D in self.library_dirs]
+            _build_ext.run(self)
+        except:
+            self.scheduler.wait(check=False)
+            raise
+
+        # when there are no Extensions
+        self.scheduler.wait()
+
+        if self.watch:
+            self.get_finalized_command('build_dso').watch_changes(self)
+
+    def _rebuild_extensions(self, scheduler, exts):
+        """Build some Extensions again.  cf. build_dso.watch_changes()
+        """
+        orig = self.extensions, self.force, self.inplace
+        self.extensions, self.force, self.inplace = exts, True, 0
+        self.scheduler = scheduler
+        try:
+            if exts:
+                self.build_extensions()
+            # as setuptools build_ext.run()
+            self.inplace = orig[2]
+            if self.inplace and hasattr(self, 'copy_extensions_to_source'):
+                self.copy_extensions_to_source()
+        finally:
+            self.extensions, self.force, self.inplace = orig
+
+    def build_extensions(self):
+        self.check_extensions_list(self.extensions)
+
+        if self.executor is None: # not when re-building.  cf. _rebuild_extensions()
+            self.executor = get_executor(self.compiler)
+            if self.executor.parallel:
+                # sources of each Extension compiled by the executor.  eg. with remote workers
+                self.compiler.compile = self.executor.compile
+            for compiler in (self.compiler, getattr(self, 'shlib_compiler', None)):
+                if compiler is not None:
+                    track_spawn(compiler)
+        self.scheduler.reserve(self.executor.njobs)
+
+        # from cythonize(..., defer=True)
+        generated = dict([(ext.name, self.scheduler.submit(self._cythonize_extension, ext, name='cythonize %s'%ext.name))
+                          for ext in self.extensions if getattr(ext, 'cython_options', None) is not None])
+
+        if type(self).build_extension != build_ext.build_extension:
+            # sub-class customizes build_extension().  So build serially after DSOs.
+            self.scheduler.wait()
+            _build_ext.build_extensions(self)
+            return
+
+        dso_jobs = self.get_finalized_command('build_dso').dso_jobs
+
+        for ext in self.extensions:
+            compiled = self.scheduler.submit(self._compile_extension, ext,
+                                             deps=[generated.get(ext.name)],
+                                             name='compile %s'%ext.name)
+            deps = [compiled] + [dso_jobs.get(name) for name in getattr(ext, 'dsos', [])]
+            self.scheduler.submit(self._link_extension, ext, compiled,
+                                  deps=deps, name='link %s'%ext.name)
+
+        # before setuptools copies Extensions in place
+        self.scheduler.wait()
+
+    def _cythonize_extension(self, ext):
+        from .cythonjobs import cythonize_extension
+        cythonize_extension(ext, force=self.force, dry_run=self.dry_run)
+
+    def _prepare_extension(self, ext):
+        _snapshot_lists(ext)
         expand_sources(self, ext.sources)
         expand_sources(self, ext.depends)
 
@@ -627,6 +1576,84 @@ class build_ext(dso2libmixin, _build_ext):
 
         ext.extra_link_args = ext.extra_link_args or []
 
+    def _ext_compiler(self, ext):
+        """A copy of the compiler for one job.  Concurrent jobs do not share compiler state.
+        As setuptools, a Library is built with shlib_compiler.
+        """
+        if isinstance(ext, _Library):
+            return copy_compiler(self.shlib_compiler)
+        return copy_compiler(self.compiler)
+
+    def _compile_extension(self, ext):
+        """Compile, but do not link, an Extension.  As build_extension() of setuptools and distutils.
+        :returns: (objects, sources), None if up-to-date, or _failed
+        """
+        with getattr(self, '_filter_build_errors', _no_filter)(ext):
+            self._prepare_extension(ext)
+            if hasattr(ext, '_convert_pyx_sources_to_lang'):
+                ext._convert_pyx_sources_to_lang()
+
+            sources = ext.sources
+            if sources is None or not isinstance(sources, (list, tuple)):
+                raise DistutilsSetupError("in 'ext_modules' option (extension '%s'), "
+                                          "'sources' must be present and must be a list of source filenames"%ext.name)
+            sources = sorted(sources)
+
+            if not (self.force or newer_group(sources + ext.depends, self.get_ext_fullpath(ext.name), 'newer')):
+                log.debug("skipping '%s' extension (up-to-date)", ext.name)
+                return None
+            log.info("building '%s' extension", ext.name)
+
+            sources = self.swig_sources(sources, ext)
+
+            macros = ext.define_macros[:]
+            for undef in ext.undef_macros:
+                macros.append((undef,))
+
+            objects = self._ext_compiler(ext).compile(sources,
+                                                      output_dir=self.build_temp,
+                                                      macros=macros,
+                                                      include_dirs=ext.include_dirs,
+                                                      debug=self.debug,
+                                                      extra_postargs=ext.extra_compile_args or [],
+                                                      depends=ext.depends)
+            return objects, sources
+        return _failed
+
+    def _link_extension(self, ext, compiled):
+        """Link an Extension once compiled, and once the DSOs it uses are built.
+        """
+        result = compiled.result()
+        if result is None or result is _failed:
+            return
+        objects, sources = result
+
+        with getattr(self, '_filter_build_errors', _no_filter)(ext):
+            self.dso2lib_pre(ext)
+
+            # the Darwin linker errors if given non-existant directories :(
+            [self.mkpath(D) for D in ext.library_dirs]
+
+            compiler = self._ext_compiler(ext)
+            ext_path = self.get_ext_fullpath(ext.name)
+            compiler.link_shared_object(objects + (ext.extra_objects or []),
+                                        ext_path,
+                                        libraries=self.get_libraries(ext),
+                                        library_dirs=ext.library_dirs,
+                                        runtime_library_dirs=ext.runtime_library_dirs,
+                                        extra_postargs=ext.extra_link_args or [],
+                                        export_symbols=self.get_export_symbols(ext),
+                                        debug=self.debug,
+                                        build_temp=self.build_temp,
+                                        target_lang=ext.language or compiler.detect_language(sources))
+            if getattr(ext, '_needs_stub', False):
+                self.write_stub(self.get_finalized_command('build_py').build_lib, ext)
+
+            self.dso2lib_post(ext_path)
+
+    def build_extension(self, ext):
+        self._prepare_extension(ext)
+
         self.dso2lib_pre(ext)
 
         # the Darwin linker errors if given non-existant directories :(
@@ -636,6 +1663,10 @@ class build_ext(dso2libmixin, _build_ext):
 
         self.dso2lib_post(self.get_ext_fullpath(ext.name))
 
+@contextmanager
+def _no_filter(ext):
+    yield
+
 # hack...
 # setuptools/distutils decides to treat build as a "purelib" vs. "platlib"
 # by testing 'dist.ext_modules' (not call 'dist.has_ext_modules()' mind you...)
@@ -649,12 +1680,45 @@ class build(_build):
         if self.distribution.x_dsos:
             self.build_lib = self.build_platlib
 
+    def run(self):
+        # build_dso runs before build_ext.  Share one Scheduler so that DSOs are built
+        # while Extensions are compiled.  build_ext waits for the jobs it needs, then we wait for any others.
+        scheduler = None
+        build_ext_cmd = self.get_finalized_command('build_ext')
+        if has_dsos(self) and isinstance(build_ext_cmd, build_ext) \
+                and not self.distribution.have_run.get('build_dso') and not self.distribution.have_run.get('build_ext'):
+            scheduler = Scheduler(keep_going=build_ext_cmd.keep_going, limit=_max_jobs)
+            build_ext_cmd.scheduler = self.get_finalized_command('build_dso').scheduler = scheduler
+
+        try:
+            _build.run(self)
+        except:
+            if scheduler is not None:
+                scheduler.wait(check=False)
+            raise
+
+        if scheduler is not None:
+            scheduler.wait()
+
 class install(_install):
     def finalize_options(self):
         _install.finalize_options(self)
         if self.distribution.x_dsos:
             self.install_lib = self.install_platlib
 
+class install_lib(_install_lib):
+    def copy_tree(self, infile, outfile, preserve_mode=1, preserve_times=1, preserve_symlinks=0, level=1):
+        if self.get_exclusions():
+            # namespace packages
+            return _install_lib.copy_tree(self, infile, outfile, preserve_mode, preserve_times, preserve_symlinks, level)
+        # keeps soversion symlinks, and hard links native libraries
+        return stage_tree(infile, outfile, verbose=self.verbose, dry_run=self.dry_run)
+
+def _is_alias(fname):
+    """Symlink from one native library to another in the same directory.
+    """
+    target = os.readlink(fname)
+    return os.path.basename(target)==target and _is_native(fname) and _is_native(target)
 
 if _bdist_wheel:
     class bdist_wheel(_bdist_wheel):
@@ -670,6 +1734,19 @@ if _bdist_wheel:
             # wheels with DSO are not "pure" python
             self.root_is_pure &= not has_dsos(self)
 
+        def egg2dist(self, egginfo_path, distinfo_path):
+            # Called after installing to bdist_dir, before the archive is written.
+            # Zip files can not contain symlinks, so each soversion alias would be a second copy.
+            # eg. "libmylib.so" -> "libmylib.so.0"
+            for dirpath, dirnames, filenames in os.walk(self.bdist_dir):
+                for name in filenames:
+                    fname = os.path.join(dirpath, name)
+                    if os.path.islink(fname) and _is_alias(fname):
+                        log.info("omit soversion alias %s", fname)
+                        if not self.dry_run:
+                            os.remove(fname)
+            return _bdist_wheel.egg2dist(self, egginfo_path, distinfo_path)
+
         def get_tag(self):
             impl, abi_tag, plat_name = _bdist_wheel.get_tag(self)
             log.info('Original Wheel Tag: %s, %s, %s'%(impl, abi_tag, plat_name))
@@ -0,0 +1,373 @@
+# Copyright 2022  Michael Davidsaver
+# SPDX-License-Identifier: BSD
+# See LICENSE
+"""Executors run the compile step of build_dso and build_ext.
+
+Linking always happens locally.
+"""
+
+import os
+import sys
+import shutil
+import socket
+import tempfile
+import threading
+import subprocess
+import logging as log
+from multiprocessing.pool import ThreadPool
+
+from . import worker as _worker
+from .compiler import gen_preprocess_options
+from .jobs import popen
+
+__all__ = (
+    'LocalExecutor',
+    'RemoteExecutor',
+    'get_executor',
+)
+
+class LocalExecutor(object):
+    """Compile with the local compiler.
+
+    :param compiler: A :py:class:`distutils.ccompiler.CCompiler`
+    :param int njobs: Number of concurrent compiles.  Default from :py:func:`dsocmd.system_concurrency`.
+    :param bool batch: If True, compile several sources with one compiler process.  (gcc and clang only)
+                       Default (None) is enabled when $SETUPTOOLS_DSO_BATCH_COMPILE=1
+    """
+    # True if compile() itself runs concurrently.  Otherwise callers should
+    # divide sources between njobs concurrent calls.
+    parallel = False
+
+    # upper limit on the number of sources in one batch
+    max_batch = 32
+
+    def __init__(self, compiler, njobs=None, batch=None):
+        if njobs is None:
+            from .dsocmd import system_concurrency
+            njobs = system_concurrency()
+        if batch is None:
+            batch = os.environ.get('SETUPTOOLS_DSO_BATCH_COMPILE', '0')=='1'
+        self.compiler = compiler
+        self.njobs = njobs
+        # only for the common 'unix' compile command.  Darwin adjusts this per source.
+        self.batch = batch and compiler.compiler_type=='unix' and sys.platform!='darwin'
+        # keep original, in case compiler.compile is replaced by self.compile
+        self._compile = compiler.compile
+
+    def compile(self, sources, output_dir=None, macros=None, include_dirs=None, debug=0,
+                extra_preargs=None, extra_postargs=None, depends=None):
+        """Same as :py:meth:`distutils.ccompiler.CCompiler.compile`.
+        """
+        kws = dict(output_dir=output_dir, macros=macros, include_dirs=include_dirs, debug=debug,
+                   extra_preargs=extra_preargs, extra_postargs=extra_postargs, depends=depends)
+        if not self.batch or len(sources)<2:
+            return self._compile(sources, **kws)
+
+        CC = self.compiler
+        macros, objects, extra_postargs, _pp_opts, build = CC._setup_compile(
+            output_dir, macros, include_dirs, sources, depends, extra_postargs)
+
+        # compiler runs in a temporary directory.  So relative paths must be made absolute.
+        _outdir, _macros, include_dirs = CC._fix_compile_args(output_dir, macros, include_dirs)
+        pp_opts = gen_preprocess_options(macros, [os.path.abspath(D) for D in include_dirs])
+        extra_preargs, extra_postargs = _abs_paths(extra_preargs or []), _abs_paths(extra_postargs)
+        if extra_preargs is None or extra_postargs is None:
+            log.debug("Not batching.  Arguments depend on the working directory")
+            return self._compile(sources, **kws)
+        cc_args = CC._get_cc_args(pp_opts, debug, extra_preargs)
+
+        for batch in self._batches([(obj, build[obj]) for obj in objects if obj in build]):
+            failed = self._compile_batch(batch, cc_args, extra_postargs, output_dir)
+            if failed:
+                log.info("Batch compile failed.  Compiling individually %s", ' '.join([src for _obj, (src, _ext) in failed]))
+                for obj, (src, _ext) in failed:
+                    self._compile([src], **kws)
+
+        return objects
+
+    def _batches(self, todo):
+        """Divide (obj, (src, ext)) into groups of the same language,
+        with no two sources producing an object of the same name.
+        """
+        groups = []
+        for obj, (src, ext) in todo:
+            lang = self.compiler.language_map.get(ext)
+            base = os.path.basename(obj)
+            for lang2, bases, batch in groups:
+                if lang2==lang and base not in bases and len(batch)<self.max_batch:
+                    break
+            else:
+                lang2, bases, batch = lang, set(), []
+                groups.append((lang2, bases, batch))
+            bases.add(base)
+            batch.append((obj, (src, ext)))
+        return [batch for _lang, _bases, batch in groups]
+
+    def _compile_batch(self, batch, cc_args, extra_postargs, output_dir):
+        """Compile several sources with one compiler process.
+        The compiler continues past a source with errors, so objects of the other sources are kept.
+        :returns: The entries of batch which were not compiled.  Empty if successful.
+        """
+        CC = self.compiler
+        lang = CC.language_map.get(batch[0][1][1])
+        compiler_so = CC.compiler_so
+        if lang=='c++':
+            compiler_so = getattr(CC, 'compiler_so_cxx', None) or compiler_so
+
+        # eg. "gcc -c .../a.c .../b.c" writes "a.o" and "b.o" to the current directory
+        cmd = compiler_so + cc_args + [os.path.abspath(src) for _obj, (src, _ext) in batch] + extra_postargs
+        log.info(' '.join(cmd))
+        if CC.dry_run:
+            return []
+
+        tdir = tempfile.mkdtemp(prefix='batch-', dir=output_dir or None)
+        try:
+            P = popen(cmd, cwd=tdir, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            output = P.communicate()[0]
+            if output and P.returncode==0:
+                sys.stderr.write(output.decode('utf-8', 'replace')) # warnings
+            failed = []
+            for obj, (src, ext) in batch:
+                # map output back to the object file name expected by distutils
+                out = os.path.join(tdir, os.path.splitext(os.path.basename(src))[0] + CC.obj_extension)
+                if os.path.isfile(out): # not written on error
+                    getattr(os, 'replace', os.rename)(out, obj)
+                else:
+                    failed.append((obj, (src, ext)))
+            if P.returncode!=0 and not failed:
+                return batch # error not attributable to any one source.  Retry all
+            return failed
+        except OSError as e:
+            log.debug("Batch compile error : %r", e)
+            return batch
+        finally:
+            shutil.rmtree(tdir, ignore_errors=True)
+
+# options naming a file or directory.  eg. "-Idir" or "-isystem dir".  Longest first.
+_path_opts = ('-isystem', '-idirafter', '-imacros', '-include', '-iquote', '-I')
+# options writing files relative to the working directory
+_cwd_opts = ('-o', '-MF', '-MD', '-MMD', '-save-temps')
+
+def _abs_paths(args):
+    """Make relative paths in compiler arguments absolute.  eg. "-Idir", "-isystem dir", or "extra.c"
+
+    :returns: A new list, or None if output would be written relative to the working directory.
+    """
+    out, args = [], list(args)
+    while args:
+        arg = args.pop(0)
+        opt = ([O for O in _path_opts if arg.startswith(O)] or [None])[0]
+        if arg in _cwd_opts or arg.startswith('-save-temps'):
+            return None
+        elif opt is not None and arg==opt:
+            if not args:
+                return None
+            out.extend([opt, os.path.abspath(args.pop(0))])
+        elif opt is not None:
+            out.append(opt+os.path.abspath(arg[len(opt):]))
+        elif not arg.startswith('-') and not os.path.isabs(arg) and os.path.exists(arg):
+            out.append(os.path.abspath(arg)) # eg. an extra source or object file
+        else:
+            out.append(arg)
+    return out
+
+class _Remote(object):
+    def __init__(self, address, njobs):
+        self.address = address
+        self.njobs = njobs
+        self.inflight = 0
+        self.alive = True
+
+def _request(address, header, payload=b'', timeout=None, token=None):
+    family, addr = _worker.parse_address(address)
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(timeout)
+        sock.connect(addr)
+        hello, _payload = _worker.recv_msg(sock)
+        if hello.get('protocol')!=_worker.PROTOCOL:
+            raise ValueError('Worker protocol %r not supported'%hello.get('protocol'))
+        header = dict(header, protocol=_worker.PROTOCOL, size=len(payload))
+        if token is not None:
+            header['auth'] = _worker.auth_token(token, hello['challenge'], header)
+        _worker.send_msg(sock, header, payload)
+        return _worker.recv_msg(sock)
+    finally:
+        sock.close()
+
+# options which only affect preprocessing, and are therefore not sent to workers.
+# eg. "-DFOO" or "-D FOO"
+_pp_only_args = ('-I', '-D', '-U', '-include', '-imacros', '-isystem', '-iquote', '-idirafter')
+
+class RemoteExecutor(LocalExecutor):
+    """Preprocess locally, and send the preprocessed source to compile workers.
+    cf. :py:mod:`setuptools_dso.worker`
+
+    C and C++ sources are sent to the least loaded worker.
+    Other sources, sources whose compiler arguments a worker would not accept,
+    and sources which fail to compile remotely, are compiled locally.
+    A worker which can not be reached is not used again.
+
+    :param compiler: A :py:class:`distutils.ccompiler.CCompiler`
+    :param list workers: Worker addresses.  eg. ``['buildbox:3632', 'unix:/run/dsoworker.sock']``
+    :param float timeout: Timeout in seconds for each remote compile.
+    :param str token: Shared secret of the workers.  Default from $SETUPTOOLS_DSO_WORKER_TOKEN.
+    """
+    parallel = True
+    connect_timeout = 5.0
+
+    def __init__(self, compiler, workers, timeout=600.0, token=None):
+        LocalExecutor.__init__(self, compiler)
+        self.timeout = timeout
+        self._token = _worker._token(token)
+        self._lock = threading.Lock()
+        self.workers = []
+        self.nremote = 0
+
+        for address in workers:
+            try:
+                info, _payload = _request(address, {'op':'info'}, timeout=self.connect_timeout, token=self._token)
+            except (socket.error, EOFError, ValueError) as e:
+                log.warning("Compile worker %s unavailable : %s", address, e)
+                continue
+            if not info.get('ok'):
+                log.warning("Compile worker %s refuses : %s", address, info.get('output'))
+                continue
+            log.info("Using compile worker %s with %d jobs", address, info['njobs'])
+            self.workers.append(_Remote(address, info['njobs']))
+
+        # remote plus local concurrency, as preprocessing is local
+        self.njobs = self.njobs + sum([W.njobs for W in self.workers])
+
+    def compile(self, sources, output_dir=None, macros=None, include_dirs=None, debug=0,
+                extra_preargs=None, extra_postargs=None, depends=None):
+        """Same as :py:meth:`distutils.ccompiler.CCompiler.compile`.
+        Sources are compiled concurrently.
+        """
+        macros, objects, extra_postargs, pp_opts, build = self.compiler._setup_compile(
+            output_dir, macros, include_dirs, sources, depends, extra_postargs)
+
+        def one(obj):
+            src, ext = build[obj]
+            lang = self.compiler.language_map.get(ext)
+            if lang in ('c', 'c++') and self._remote(obj, src, lang, macros, include_dirs, debug,
+                                                     extra_preargs, extra_postargs):
+                return
+            self._compile([src], output_dir=output_dir, macros=macros, include_dirs=include_dirs,
+                          debug=debug, extra_preargs=extra_preargs, extra_postargs=extra_postargs,
+                          depends=depends)
+
+        todo = [obj for obj in objects if obj in build]
+        if len(todo)<=1:
+            [one(obj) for obj in todo]
+        else:
+            P = ThreadPool(min(self.njobs, len(todo)))
+            try:
+                P.map(one, todo)
+            finally:
+                P.close()
+                P.join()
+
+        return objects
+
+    def _args(self, lang, debug, extra_postargs):
+        """Compiler arguments, without executable.  All are also given when preprocessing
+        as some (eg. -O2) define macros.
+        :returns: (all arguments, arguments to send) or None if a worker would not accept these arguments.
+        """
+        cmd = self.compiler.compiler_so
+        if lang=='c++':
+            cmd = getattr(self.compiler, 'compiler_so_cxx', None) or cmd
+        args = cmd[1:] + (['-g'] if debug else []) + list(extra_postargs or [])
+        ret, skip = [], False
+        for arg in args:
+            if skip:
+                skip = False
+            elif arg in _pp_only_args:
+                skip = True
+            elif arg.startswith(_pp_only_args):
+                pass
+            elif not _worker.allowed_arg(arg):
+                log.debug("Compile locally due to %r", arg)
+                return None
+            else:
+                ret.append(arg)
+        return args, ret
+
+    def _pick(self):
+        with self._lock:
+            alive = [W for W in self.workers if W.alive]
+            if not alive:
+                return None
+            W = min(alive, key=lambda W: float(W.inflight)/W.njobs)
+            W.inflight += 1
+            return W
+
+    def _remote(self, obj, src, lang, macros, include_dirs, debug, extra_preargs, extra_postargs):
+        """Try to compile one source remotely.
+        :returns: True if successful
+        """
+        if self.compiler.compiler_type!='unix' or extra_preargs:
+            return False
+        args = self._args(lang, debug, extra_postargs)
+        if args is None:
+            return False
+        ppargs, args = args
+        W = self._pick()
+        if W is None:
+            return False
+
+        try:
+            pre = obj + ('.i' if lang=='c' else '.ii')
+            if os.path.exists(pre):
+                os.unlink(pre) # preprocess() skips an output newer than the source
+            self.compiler.preprocess(src, pre, macros=macros, include_dirs=include_dirs,
+                                     extra_postargs=ppargs)
+            with open(pre, 'rb') as F:
+                payload = F.read()
+            os.unlink(pre)
+
+            log.info("%s: compiling %s", W.address, src)
+            try:
+                reply, data = _request(W.address, {'op':'compile', 'language':lang, 'args':args},
+                                       payload, timeout=self.timeout, token=self._token)
+            except (socket.error, EOFError, ValueError) as e:
+                log.warning("Compile worker %s failed, no longer used : %s", W.address, e)
+                W.alive = False
+                return False
+
+        finally:
+            with self._lock:
+                W.inflight -= 1
+
+        if not reply.get('ok'):
+            # compile locally for error messages which name the original source file
+            log.debug("%s: unable to compile %s : %s", W.address, src, reply.get('output'))
+            return False
+
+        if reply.get('output'):
+            log.warning('%s', reply['output'])
+        with open(obj, 'wb') as F:
+            F.write(data)
+        with self._lock:
+            self.nremote += 1
+        return True
+
+def get_executor(compiler, njobs=None, batch=None):
+    """Select an executor.
+
+    Compile workers may be listed in $SETUPTOOLS_DSO_WORKERS.
+    eg. "buildbox:3632,unix:/run/dsoworker.sock"
+    If none are listed, or none are reachable, compile locally.
+
+    :param int njobs: Passed to :py:class:`LocalExecutor`
+    :param bool batch: Passed to :py:class:`LocalExecutor`
+    :returns: A :py:class:`LocalExecutor` or :py:class:`RemoteExecutor`
+    """
+    workers = [W.strip() for W in os.environ.get('SETUPTOOLS_DSO_WORKERS', '').split(',') if W.strip()]
+    if workers:
+        E = RemoteExecutor(compiler, workers)
+        if E.workers:
+            return E
+        log.warning("No compile workers available.  Compiling locally.")
+    return LocalExecutor(compiler, njobs=njobs, batch=batch)
@@ -0,0 +1,299 @@
+# Copyright 2022  Michael Davidsaver
+# SPDX-License-Identifier: BSD
+# See LICENSE
+"""Job scheduler shared by build_dso and build_ext.
+
+Compiling and linking happens in sub-processes, so a pool of threads
+is enough to keep several compilers busy.
+Each job may depend on other jobs, and is run once all of these have completed.
+eg. the link of an Extension waits for its own compile, and for the DSOs it is linked against.
+
+By default, the first failure cancels queued jobs, and kills the sub-processes of running jobs.
+"""
+
+import sys
+import threading
+import subprocess
+from collections import deque
+import logging as log
+
+from .compiler import ExecError
+
+__all__ = (
+    'Cancelled',
+    'Job',
+    'Scheduler',
+    'popen',
+    'track_spawn',
+)
+
+# attributes of worker threads.  .scheduler
+_current = threading.local()
+
+class Cancelled(Exception):
+    """Result of a Job not run because another Job failed.  cf. ``Scheduler(keep_going=False)``
+    """
+
+def popen(cmd, **kws):
+    """Same as subprocess.Popen().  When called by a Job, the process is killed if the Scheduler
+    cancels pending jobs.
+    :raises Cancelled: If already cancelled.
+    """
+    sched = getattr(_current, 'scheduler', None)
+    if sched is None:
+        return subprocess.Popen(cmd, **kws)
+    with sched._lock:
+        if sched._cancelled:
+            raise Cancelled()
+        P = subprocess.Popen(cmd, **kws)
+        sched._procs = [Q for Q in sched._procs if Q.poll() is None] + [P]
+    return P
+
+def track_spawn(compiler):
+    """Replace compiler.spawn() to run commands with :py:func:`popen`.
+    Only for the common 'unix' compiler.  Darwin, and MSVC, adjust the environment of each command.
+    """
+    if compiler.compiler_type!='unix' or sys.platform=='darwin':
+        return
+    orig = compiler.spawn
+    def spawn(cmd, **kws):
+        if getattr(_current, 'scheduler', None) is None or compiler.dry_run or set(kws)-set(['env']):
+            return orig(cmd, **kws)
+        cmd = list(cmd)
+        log.info(subprocess.list2cmdline(cmd))
+        try:
+            P = popen(cmd, env=kws.get('env'))
+            P.wait()
+        except OSError as e:
+            raise ExecError("command %r failed: %s"%(cmd[0], e.args[-1]))
+        if P.returncode:
+            raise ExecError("command %r failed with exit code %s"%(cmd[0], P.returncode))
+    compiler.spawn = spawn
+
+class Job(object):
+    """Handle for work submitted to a :py:class:`Scheduler`.
+    """
+    def __init__(self, name, fn, args, kws):
+        self.name = name
+        self._fn, self._args, self._kws = fn, args, kws
+        self._done = threading.Event()
+        self._value = None
+        self._error = None
+        self._nwait = 0
+        self._dependents = []
+
+    def __repr__(self):
+        return 'Job(%r)'%self.name
+
+    def done(self):
+        """True once completed, successfully or not.
+        """
+        return self._done.is_set()
+
+    def failed(self):
+        """True if completed with an error, or skipped due to an error in a dependency.
+        """
+        return self.done() and self._error is not None
+
+    def exception(self):
+        """Wait for completion.
+        :returns: The exception raised by this Job, or by a dependency, or None.
+        """
+        self._done.wait()
+        return self._error
+
+    def result(self):
+        """Wait for completion.
+        :returns: The value returned by the job function.
+        :raises: Any exception raised by the job function, or by a dependency.
+
+        A job function must not wait on a Job which is not one of its dependencies.
+        """
+        self._done.wait()
+        if self._error is not None:
+            raise self._error
+        return self._value
+
+class Scheduler(object):
+    """Run jobs with a pool of threads.
+
+    :param int njobs: Maximum number of concurrent jobs.  Default from :py:func:`dsocmd.system_concurrency`.
+    :param bool keep_going: If False (default), the first failure cancels queued jobs,
+                            and kills sub-processes started with :py:func:`popen`.
+                            If True, run all jobs whose dependencies succeed,
+                            then :py:meth:`wait` logs a report of all failures.
+    :param int limit: Upper limit of njobs, also applied by :py:meth:`reserve`.  eg. 1 to run jobs serially.
+
+    Threads are started as needed, and exit once the Scheduler is idle.
+    """
+    def __init__(self, njobs=None, keep_going=False, limit=None):
+        if njobs is None:
+            from .dsocmd import system_concurrency
+            njobs = system_concurrency()
+        self.limit = limit
+        self.njobs = self._limited(njobs)
+        self.keep_going = keep_going
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._ready = deque()
+        self._jobs = []
+        self._nthreads = 0
+        self._nidle = 0
+        # Jobs which failed, not including those skipped or cancelled.  In order of failure.
+        self._errors = []
+        self._cancelled = False
+        self._procs = []
+
+    def _limited(self, njobs):
+        return max(1, min(njobs, self.limit) if self.limit else njobs)
+
+    def reserve(self, njobs):
+        """Allow at least njobs concurrent jobs, up to the limit.  eg. when compiling with remote workers
+        """
+        with self._lock:
+            self.njobs = self._limited(max(self.njobs, njobs))
+
+    def free_slots(self):
+        """Estimate of the number of further jobs which could start now.
+        njobs less those running, or ready to run.  At least 1.
+        """
+        with self._lock:
+            return max(1, self.njobs - (self._nthreads - self._nidle) - len(self._ready))
+
+    def submit(self, fn, *args, **kws):
+        """Submit fn(*args, **kws) to be run after all of the (optional) ``deps=`` Jobs
+        have completed successfully.
+        If any dependency fails, this Job fails with the same exception without being run.
+
+        :param list deps: Jobs.  Elements which are None are ignored.
+        :param str name: For log messages.  Default is the function name.
+        :returns: A :py:class:`Job`
+        """
+        deps = [D for D in kws.pop('deps', None) or [] if D is not None]
+        name = kws.pop('name', None) or getattr(fn, '__name__', repr(fn))
+        job = Job(name, fn, args, kws)
+
+        with self._lock:
+            self._jobs.append(job)
+            if self._cancelled:
+                self._complete(job, error=Cancelled())
+                return job
+            for D in deps:
+                if not D.done():
+                    D._dependents.append(job)
+                    job._nwait += 1
+                elif D._error is not None:
+                    self._complete(job, error=D._error)
+                    return job
+            if job._nwait==0:
+                self._queue(job)
+
+        return job
+
+    def cancel(self):
+        """Complete all queued jobs with :py:class:`Cancelled`, and kill any sub-processes of running jobs.
+        Jobs submitted later are also cancelled.
+        """
+        with self._lock:
+            self._cancel()
+
+    def wait(self, check=True):
+        """Wait for all submitted jobs, including those submitted while waiting, to complete.
+
+        :param bool check: If True, re-raise the exception of the first Job to fail.
+        """
+        while True:
+            with self._lock:
+                pending = [J for J in self._jobs if not J.done()]
+                if not pending:
+                    jobs = self._jobs
+                    break
+            for J in pending:
+                J._done.wait()
+
+        if check and self._errors:
+            if self.keep_going:
+                self._report(jobs)
+            raise self._errors[0]._error
+
+    def _report(self, jobs):
+        skipped = len([J for J in jobs if J._error is not None]) - len(self._errors)
+        lines = ['%d job(s) failed%s :'%(len(self._errors), ', %d skipped'%skipped if skipped else '')]
+        lines += ['  %s : %s'%(J.name, J._error) for J in self._errors]
+        log.error('\n'.join(lines))
+
+    # below called with self._lock held
+
+    def _cancel(self):
+        self._cancelled = True
+        ready, self._ready = self._ready, deque()
+        for job in ready:
+            self._complete(job, error=Cancelled())
+        for P in self._procs:
+            if P.poll() is None:
+                try:
+                    P.terminate()
+                except OSError:
+                    pass # already exited
+        self._procs = []
+
+    def _queue(self, job):
+        if self._cancelled:
+            self._complete(job, error=Cancelled())
+            return
+        self._ready.append(job)
+        if self._nidle >= len(self._ready):
+            self._wakeup.notify()
+        elif self._nthreads < self.njobs:
+            T = threading.Thread(target=self._worker, name='dsojob-%d'%self._nthreads)
+            T.daemon = True
+            self._nthreads += 1
+            T.start()
+
+    def _complete(self, job, value=None, error=None, ran=False):
+        job._value, job._error = value, error
+        job._done.set()
+        if ran and error is not None and not self._cancelled:
+            self._errors.append(job)
+            if not self.keep_going:
+                log.error("%s failed : %s", job.name, error)
+                self._cancel()
+        dependents, job._dependents = job._dependents, []
+        job._fn = job._args = job._kws = None
+        for D in dependents:
+            if D.done():
+                continue
+            elif error is not None:
+                self._complete(D, error=error)
+            else:
+                D._nwait -= 1
+                if D._nwait==0:
+                    self._queue(D)
+
+    def _worker(self):
+        _current.scheduler = self
+        with self._lock:
+            while True:
+                if not self._ready:
+                    self._nidle += 1
+                    # linger briefly, as more jobs are usually on the way
+                    self._wakeup.wait(1.0)
+                    self._nidle -= 1
+                    if not self._ready:
+                        self._nthreads -= 1
+                        return
+
+                job = self._ready.popleft()
+                fn, args, kws = job._fn, job._args, job._kws
+
+                self._lock.release()
+                try:
+                    log.debug("Start job %s", job.name)
+                    value, error = fn(*args, **kws), None
+                except BaseException as e:
+                    log.debug("Job %s fails : %r", job.name, e)
+                    value, error = None, e
+                finally:
+                    self._lock.acquire()
+
+                self._complete(job, value, error, ran=True)
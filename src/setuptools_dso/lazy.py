@@ -0,0 +1,141 @@
+# Copyright 2022  Michael Davidsaver
+# SPDX-License-Identifier: BSD
+# See LICENSE
+"""Build DSOs, and the Extensions linked against them, on first use.  cf. build_ext --lazy-dsos
+
+With ``--lazy-dsos``, the DSO manifest of each package records what was not built.
+When such a manifest is first imported, eg. by :py:func:`find_dso`, :py:func:`dylink_prepare_dso`,
+or by the ``__init__.py`` of a package, a :py:class:`LazyBuildFinder` is added to ``sys.meta_path``.
+Missing DSOs, and Extensions, are then built on first use by running
+``setup.py build_ext -i --build-only=...``.
+"""
+
+import os
+import sys
+import threading
+import subprocess
+import logging
+from contextlib import contextmanager
+from importlib import import_module
+
+__all__ = (
+    'LazyBuildFinder',
+    'install',
+)
+
+_log = logging.getLogger(__name__)
+
+# setup.py path -> 'lazy' record of a DSO manifest
+_projects = {}
+
+# DSO or Extension name -> Lock held while a thread of this process builds it
+_build_locks = {}
+
+# guards _projects and _build_locks.  Not held while building.
+_lock = threading.Lock()
+
+@contextmanager
+def _file_lock(fname):
+    """Exclusive lock shared with other processes.
+    """
+    try:
+        os.makedirs(os.path.dirname(fname))
+    except OSError:
+        pass # already exists
+    with open(fname, 'a+') as F:
+        if os.name=='nt':
+            import msvcrt
+            F.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(F.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    pass # LK_LOCK gives up after 10 seconds
+            try:
+                yield
+            finally:
+                F.seek(0)
+                msvcrt.locking(F.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(F.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(F.fileno(), fcntl.LOCK_UN)
+
+def register(record):
+    """Note the 'lazy' record of a DSO manifest, and add :py:class:`LazyBuildFinder`
+    to ``sys.meta_path`` if not already present.
+    """
+    with _lock:
+        _projects.setdefault(record['setup'], record)
+        if not any([isinstance(F, LazyBuildFinder) for F in sys.meta_path]):
+            sys.meta_path.append(LazyBuildFinder())
+
+def install(package):
+    """Add :py:class:`LazyBuildFinder` for the project which built the DSOs of a package.
+    eg. from a ``conftest.py``, when Extensions are imported before any DSO is looked up.
+
+    :param str package: Name of a package containing DSOs.  eg. 'dsodemo.lib'
+    :returns: True if DSOs of this package are built on first use.
+    """
+    record = getattr(import_module(package+'._dsomanifest'), 'lazy', None)
+    if record:
+        register(record)
+    return bool(record)
+
+def build(record, names, check):
+    """Build the named DSOs and/or Extensions, unless check() returns True once
+    this process holds the build lock of the project.  eg. built by another process.
+    """
+    top = os.path.dirname(record['setup'])
+    with _lock:
+        locks = [_build_locks.setdefault(name, threading.Lock()) for name in sorted(set(names))]
+    for L in locks:
+        L.acquire()
+    try:
+        # builds of the same project by other processes, or threads, share a build directory
+        with _file_lock(os.path.join(top, 'build', 'setuptools_dso-lazy.lock')):
+            if check():
+                return
+
+            cmd = [sys.executable, record['setup'], '-q', 'build_ext', '-i', '--build-only='+','.join(names)]
+            env = os.environ.copy()
+            env.pop('SETUPTOOLS_DSO_LAZY_BUILD', None)
+
+            _log.info('Building %s : %s', ', '.join(names), ' '.join(cmd))
+            P = subprocess.Popen(cmd, cwd=top, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            output = P.communicate()[0].decode('utf-8', 'replace')
+            _log.debug('%s', output)
+            if P.returncode!=0:
+                raise ImportError('Unable to build %s :\n%s'%(', '.join(names), output))
+    finally:
+        for L in reversed(locks):
+            L.release()
+
+class LazyBuildFinder(object):
+    """Meta path finder which builds an Extension when first imported.
+    Added at the end of ``sys.meta_path``, so only consulted for modules not otherwise found.
+    """
+    def find_spec(self, fullname, path=None, target=None):
+        with _lock:
+            records = [R for R in _projects.values() if fullname in R['extensions']]
+        if not records:
+            return None
+
+        from importlib.machinery import PathFinder
+        from importlib import invalidate_caches
+        def find():
+            invalidate_caches()
+            return PathFinder.find_spec(fullname, path)
+
+        build(records[0], [fullname], check=lambda: find() is not None)
+        return find()
+
+def _ensure_dso(record, info):
+    """Build a DSO listed in a manifest, if needed.  cf. runtime._manifest_info()
+    """
+    if info.dsoname in record['dsos'] and not os.path.exists(info.sofilename):
+        build(record, [info.dsoname], check=lambda: os.path.exists(info.sofilename))
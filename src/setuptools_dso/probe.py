@@ -6,9 +6,15 @@ from __future__ import print_function
 
 from collections import OrderedDict
 from itertools import chain
+import itertools
 import re
 import os
+import sys
+import json
 import shutil
+import hashlib
+import threading
+import subprocess
 import logging as log
 
 import tempfile
@@ -30,17 +36,284 @@ except ImportError:
                 self.name = None
 
 try:
-    from setuptools.errors import ExecError, CompileError
+    from setuptools.errors import ExecError, CompileError, LinkError
 except ImportError:
     from distutils.errors import DistutilsExecError as ExecError
-    from distutils.errors import CompileError
+    from distutils.errors import CompileError, LinkError
 
-from .compiler import new_compiler
+from .compiler import new_compiler, copy_compiler
+from .runtime import _user_cache_dir
+from .staging import _atomic
 
 __all__ = (
     'ProbeToolchain',
+    'get_session',
 )
 
+# type name -> compiler predefined macro giving its size (GCC and clang)
+_predef_sizeof = {
+    'short': '__SIZEOF_SHORT__',
+    'int': '__SIZEOF_INT__',
+    'long': '__SIZEOF_LONG__',
+    'long long': '__SIZEOF_LONG_LONG__',
+    'float': '__SIZEOF_FLOAT__',
+    'double': '__SIZEOF_DOUBLE__',
+    'long double': '__SIZEOF_LONG_DOUBLE__',
+    'size_t': '__SIZEOF_SIZE_T__',
+    'ptrdiff_t': '__SIZEOF_PTRDIFF_T__',
+    'wchar_t': '__SIZEOF_WCHAR_T__',
+    '__int128': '__SIZEOF_INT128__',
+    'void*': '__SIZEOF_POINTER__',
+}
+
+def _predefined_sizeof(typename):
+    """Map a type name to the predefined macro giving its size.
+    Returns 1 for char types, which need no macro, or None if there is no such macro.
+    """
+    T = ' '.join(typename.replace('*', ' * ').split())
+    if T.endswith('*') and '(' not in T and '[' not in T and not T[:-1].rstrip().endswith('::'):
+        # a plain pointer.  Not a pointer to member (eg. "int Foo::*"), whose size depends on the ABI
+        return _predef_sizeof['void*']
+    for prefix in ('unsigned ', 'signed '):
+        if T.startswith(prefix):
+            T = T[len(prefix):]
+    if T in ('unsigned', 'signed'):
+        T = 'int'
+    T = {'short int':'short', 'long int':'long', 'long long int':'long long'}.get(T, T)
+    if T=='char':
+        return 1
+    return _predef_sizeof.get(T)
+
+# start of a marker emitted by _eval_macros().  eg. "void D_FOO = |||"
+_marker_start = re.compile(r'void ([DU])_(\w+) = \|\|\|')
+_c_comment = re.compile(r'/\*.*?\*/', re.DOTALL)
+
+def _scan_macros(lines, macros):
+    """Extract macro values from preprocessor output in a single pass.
+
+    :param lines: Iterable of preprocessor output lines.  eg. an open file
+    :param list macros: Macro names to find
+    :returns: A list of (name, value) tuples in the order of macros
+    """
+    # Various pre-processor implementations are inconsistent about
+    # what "debris" is emitted in the output.
+    # eg. GCC strips C/C++ comments, while MSVC leaves them in.
+    # Only lines which contain a marker are examined, and comments are
+    # removed only from the expanded value.
+    wanted = set(macros)
+    found = {}
+    pending = None # (du, name, [value fragments])
+    for line in lines:
+        if pending is None and '|||' not in line:
+            continue
+        elif line.lstrip().startswith('#'):
+            continue # pre-processor directive line
+
+        pos = 0
+        while True:
+            if pending is None:
+                M = _marker_start.search(line, pos)
+                if M is None:
+                    break
+                pos = M.end()
+                if M.group(2) in wanted:
+                    pending = (M.group(1), M.group(2), [])
+                continue
+
+            du, name, parts = pending
+            idx = line.find('|||', pos)
+            if idx==-1:
+                parts.append(line[pos:]) # value continues on next line
+                break
+
+            parts.append(line[pos:idx])
+            pos = idx+3
+            pending = None
+            if du=='D':
+                val = ''.join(parts)
+                val = _c_comment.sub('', val)
+                val = '\n'.join([L for L in val.splitlines() if not L.startswith('//')])
+                found[name] = val.strip()
+            else:
+                found[name] = None
+
+        if pending is None and len(found)==len(wanted):
+            break # ignore remainder of output
+
+    missing = [name for name in macros if name not in found]
+    if missing:
+        raise RuntimeError("Failed to find preprocessor output for macros %r"%missing)
+
+    return [(name, found[name]) for name in macros]
+
+class ToolchainSession(object):
+    """State shared by all users of one compiler toolchain within a process.
+
+    Holds a customized compiler, from which independent copies are made,
+    a scratch directory, and lazily computed :py:class:`ToolchainInfo`.
+    Use :py:func:`get_session` to find the session for a toolchain.
+
+    The ``cache`` attribute is the default for ``ProbeToolchain(cache=None)`` using this session.
+    None (the default) to follow $SETUPTOOLS_DSO_PROBE_CACHE.  eg. set by ``build_dso --probe-cache``
+
+    Added in 2.12
+    """
+    def __init__(self, compiler=None):
+        self.compiler_name = compiler
+        self.compiler = new_compiler(compiler=compiler, verbose=False, dry_run=False, force=True)
+        self.cache = None
+        self._tdir = TemporaryDirectory()
+        self.tempdir = self._tdir.name
+        self._serial = itertools.count()
+        self._lock = threading.Lock()
+        # json of [headers, define_macros] -> ToolchainInfo
+        self._infos = {}
+        self._info_lock = threading.Lock()
+
+    def new_compiler(self, **kws):
+        """Return a copy of the session compiler.  cf. :py:func:`compiler.copy_compiler`
+        """
+        return copy_compiler(self.compiler, **kws)
+
+    def next_serial(self):
+        """Unique (within this session) integer
+        """
+        with self._lock:
+            return next(self._serial)
+
+    def info(self, headers=(), define_macros=()):
+        """:py:class:`ToolchainInfo` of this toolchain.
+        Computed once for each combination of headers and macros.  cf. :py:class:`ProbeToolchain`
+        """
+        key = json.dumps([list(headers), [list(M) for M in define_macros]])
+        with self._info_lock:
+            info = self._infos.get(key)
+            if info is None:
+                info = self._infos[key] = ToolchainInfo(ProbeToolchain(compiler=self.compiler_name, headers=headers,
+                                                                       define_macros=define_macros, _session=self))
+            return info
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+# environment which customize_compiler() uses to select and configure a toolchain
+_session_env = ('CC', 'CXX', 'CPP', 'LDSHARED', 'AR', 'ARFLAGS', 'CFLAGS', 'CPPFLAGS', 'LDFLAGS')
+
+def get_session(compiler=None):
+    """Return the process wide :py:class:`ToolchainSession` for a compiler toolchain.
+
+    :param str compiler: If not None, select non-default compiler toolchain
+
+    Added in 2.12
+    """
+    key = (compiler,) + tuple(os.environ.get(name) for name in _session_env)
+    with _sessions_lock:
+        sess = _sessions.get(key)
+        if sess is None:
+            sess = _sessions[key] = ToolchainSession(compiler)
+        return sess
+
+def _probe_cache_dir(cache=None):
+    """Resolve ProbeToolchain(cache=) to a directory, or None if disabled.
+    """
+    if cache is None:
+        cache = os.environ.get('SETUPTOOLS_DSO_PROBE_CACHE', '0')
+        if cache in ('0', ''):
+            cache = False
+        elif cache=='1':
+            cache = True
+    if cache is True:
+        return _user_cache_dir('probe')
+    return cache or None
+
+def clear_cache(cache=True):
+    """Remove all cached probe results.
+
+    :param cache: True for the default location, or a directory name.
+    """
+    cdir = _probe_cache_dir(cache)
+    if cdir and os.path.isdir(cdir):
+        log.info('Clear probe cache %s', cdir)
+        shutil.rmtree(cdir, ignore_errors=True)
+
+def _stamp(fnames):
+    """:returns: [[file name, size, modification time], ...] with None for files which do not exist
+    """
+    ret = []
+    for fname in fnames:
+        try:
+            S = os.stat(fname)
+            ret.append([fname, S.st_size, S.st_mtime])
+        except OSError:
+            ret.append([fname, None, None])
+    # as after a JSON round trip
+    return json.loads(json.dumps(ret))
+
+class _ProbeCache(object):
+    """Persistent store of probe results as JSON files in a directory.
+    """
+    def __init__(self, cdir):
+        self.dir = cdir
+
+    def _path(self, key):
+        key = hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+        return os.path.join(self.dir, key[:2], key+'.json')
+
+    def get(self, key):
+        try:
+            with open(self._path(key), 'r') as F:
+                return json.load(F)['value']
+        except (IOError, OSError, ValueError, KeyError):
+            return None
+
+    def put(self, key, value):
+        fname = self._path(key)
+        try:
+            if not os.path.isdir(os.path.dirname(fname)):
+                os.makedirs(os.path.dirname(fname))
+        except OSError:
+            pass # may race with another process
+        try:
+            with _atomic(fname) as tmp:
+                with open(tmp, 'w') as F:
+                    json.dump({'key':key, 'value':value}, F)
+        except (IOError, OSError) as e:
+            log.debug('Unable to cache probe result %s : %s', fname, e)
+
+    def executable(self, exe, vargs=('--version',)):
+        """Describe an executable by path, size, modification time, and its output when run with vargs.
+        The output is itself cached, keyed by path, size, and modification time.
+        """
+        path = shutil.which(exe) if hasattr(shutil, 'which') else exe # py >= 3.3
+        path = os.path.realpath(path or exe)
+        try:
+            S = os.stat(path)
+            ident = [path, S.st_size, S.st_mtime]
+        except OSError:
+            ident = [path, None, None]
+
+        vkey = ['version'] + ident if list(vargs)==['--version'] else ['output', list(vargs)] + ident
+        version = self.get(vkey)
+        if version is None:
+            try:
+                P = subprocess.Popen([path]+list(vargs), stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+                version = P.communicate()[0].decode('latin-1')
+            except OSError as e:
+                version = str(e)
+            self.put(vkey, version)
+
+        return ident + [version]
+
+    def identity(self, compiler):
+        """Describe the compiler executable.  cf. executable()
+        """
+        if compiler.compiler_type=='msvc':
+            ident = self.executable(getattr(compiler, 'cc', None), [])
+        else:
+            ident = self.executable((compiler.compiler_so or ['cc'])[0])
+
+        return ident + [compiler.compiler_type] + [getattr(compiler, name, None) for name in ('compiler', 'compiler_so', 'compiler_cxx', 'preprocessor', 'compile_options')]
+
 class ProbeToolchain(object):
     """Inspection of compiler
 
@@ -48,19 +321,33 @@ class ProbeToolchain(object):
     :param str compiler: If not None, select non-default compiler toolchain
     :param list headers: List of headers to include during all test compilations
     :param list define_macros: List of (macro, value) tuples to define during all test compilations
+    :param cache: Persistent cache of probe results.  False to disable,
+                  True to use a per-user cache directory, or a directory name.
+                  The default (None) follows ``build_dso --probe-cache`` when set,
+                  otherwise is enabled when $SETUPTOOLS_DSO_PROBE_CACHE is '1' (or a directory name).
+                  Results are keyed by compiler identity, flags, headers, and probe source.
+                  Each result is re-used only while the headers that its probe includes are unchanged.
+                  Only GCC like compilers, which can list these headers, use the cache.
+                  (Added in 2.12)
     """
     def __init__(self, verbose=False,
                  compiler=None,
-                 headers=None, define_macros=None):
+                 headers=None, define_macros=None,
+                 cache=None, _session=None):
         self.verbose = verbose
         self.headers = list(headers or [])
         self.define_macros = list(define_macros or [])
         self._info = None
-
-        self.compiler = new_compiler(compiler=compiler,
-                                     verbose=self.verbose,
-                                     dry_run=False,
-                                     force=True)
+        self._ident = None
+
+        # toolchain detection, and the scratch directory, are shared by all
+        # ProbeToolchain using the same compiler.
+        self._session = _session or get_session(compiler)
+        cdir = _probe_cache_dir(self._session.cache if cache is None else cache)
+        self._cache = _ProbeCache(cdir) if cdir else None
+        self.compiler = self._session.new_compiler(verbose=self.verbose,
+                                                   dry_run=False,
+                                                   force=True)
         # TODO: quiet compile errors?
 
         # clang '-flto' produces LLVM bytecode instead of ELF object files.
@@ -72,8 +359,74 @@ class ProbeToolchain(object):
                 ccmd = [arg for arg in ccmd if arg!='-flto']
                 setattr(self.compiler, name, ccmd)
 
-        self._tdir = TemporaryDirectory()
-        self.tempdir = self._tdir.name
+        self.tempdir = self._session.tempdir
+        self._serial_lock = threading.Lock()
+        self._predef = {}
+
+    def _cached(self, kind, src, kws, fn):
+        """Return cached result of a probe, or call fn() and cache its result.
+        """
+        if self._cache is None:
+            return fn()
+
+        if self._ident is None:
+            self._ident = self._cache.identity(self.compiler)
+
+        # modification time of directories changes when headers are added or removed
+        dirs = list(kws.get('include_dirs') or []) + [os.path.dirname(h) for h in self.headers if os.path.isabs(h)]
+        dirstamp = [(D, os.path.getmtime(D) if os.path.isdir(D) else None) for D in dirs]
+
+        key = ['v2', kind, self._ident, self.headers, self.define_macros, src,
+               sorted([(K, repr(V)) for K,V in kws.items()]), dirstamp]
+        # tuples and lists are equivalent after a JSON round trip
+        key = json.loads(json.dumps(key))
+
+        entry = self._cache.get(key)
+        if entry is not None and _stamp([dep for dep, _size, _mtime in entry['depends']])==entry['depends']:
+            log.debug('Probe cache hit %s', kind)
+            return entry['value']
+
+        # headers are listed before probing.  So an edit made while probing is noticed by the next lookup.
+        depends = self._probe_depends(src, kws)
+        if depends is None:
+            return fn()
+        stamps = _stamp(depends)
+        val = fn()
+        self._cache.put(key, {'value':val, 'depends':stamps})
+        return val
+
+    def _probe_depends(self, src, kws):
+        """Headers included by a probe source.
+        :returns: A list of file names, or None if these can not be listed.
+        """
+        if self.compiler.compiler_type not in ('unix', 'mingw32', 'cygwin'):
+            return None
+        srcname = self._scratch_name('probe_depends', language=kws.get('language') or 'c')
+        depname = srcname + '.d'
+        with open(srcname, 'w') as F:
+            F.write(src)
+        try:
+            # -MG lists missing headers, which may later be created
+            self.compiler.preprocess(srcname, None,
+                                     macros=self.define_macros + list(kws.get('define_macros') or []),
+                                     include_dirs=kws.get('include_dirs'),
+                                     extra_preargs=kws.get('extra_preargs'),
+                                     extra_postargs=list(kws.get('extra_postargs') or []) + ['-M', '-MG', '-MF', depname])
+            with open(depname, 'r') as F:
+                rule = F.read()
+        except (CompileError, ExecError, IOError, OSError) as e:
+            log.debug('Unable to list headers of probe : %s', e)
+            return None
+        # "target.o: source.c header.h \
+        #   other.h"
+        words = rule.replace('\\\n', ' ').replace('\\ ', '\0').partition(':')[2].split()
+        return [W.replace('\0', ' ') for W in words[1:]]
+
+    def _scratch_name(self, basename, language='c'):
+        """Unique source file path in self.tempdir.  eg. ".../try_compile_3.c"
+        """
+        n = self._session.next_serial()
+        return os.path.join(self.tempdir, self._source_name('%s_%d'%(basename, n), language=language))
 
     def _source_name(self, basename, language='c', **kws):
         for ext, lang in self.compiler.language_map.items():
@@ -94,7 +447,7 @@ class ProbeToolchain(object):
         :param list extra_postargs: Extra arguments to pass to the compiler
         """
         define_macros = self.define_macros + list(define_macros or [])
-        srcname = os.path.join(self.tempdir, self._source_name('try_compile', language=language))
+        srcname = self._scratch_name('try_compile', language=language)
 
         log.debug('/* test compile */\n'+src)
         with open(srcname, 'w') as F:
@@ -119,11 +472,35 @@ class ProbeToolchain(object):
         :param list extra_preargs: Extra arguments to pass to the compiler
         :param list extra_postargs: Extra arguments to pass to the compiler
         """
-        try:
-            self.compile(src, **kws)
-            return True
-        except (ExecError, CompileError):
-            return False
+        def probe():
+            try:
+                self.compile(src, **kws)
+                return True
+            except (ExecError, CompileError):
+                return False
+        return self._cached('try_compile', src, kws, probe)
+
+    def try_link(self, src, extra_link_args=None, **kws):
+        """Return True if provided source code compiles, and links as a shared library
+
+        :param str src: Source code string
+        :param list extra_link_args: Extra arguments to pass to the linker.  eg. ``['-Wl,--icf=safe']``
+        :param str language: Source code language: 'c' or 'c++'
+
+        Other arguments as for :py:meth:`try_compile`.  (Added in 2.12)
+        """
+        def probe():
+            try:
+                obj = self.compile(src, **kws)
+                out = self.compiler.shared_object_filename('try_link_%d'%self._session.next_serial(),
+                                                           output_dir=self.tempdir)
+                self.compiler.link_shared_object([obj], out,
+                                                 extra_postargs=list(extra_link_args or []),
+                                                 target_lang=kws.get('language', 'c'))
+                return True
+            except (ExecError, CompileError, LinkError):
+                return False
+        return self._cached('try_link', src, dict(kws, extra_link_args=extra_link_args), probe)
 
     def check_includes(self, headers, **kws):
         """Return true if all of the headers may be included (in order)
@@ -164,38 +541,166 @@ class ProbeToolchain(object):
         :param list extra_preargs: Extra arguments to pass to the compiler
         :param list extra_postargs: Extra arguments to pass to the compiler
         """
-        # borrow a trick from CMake.  see Modules/CheckTypeSize.c.in
-        src = ['#include <%s>'%h for h in self.headers+list(headers or ())]
-        src += [
-            '#define PROBESIZE (sizeof(%s))'%typename,
-            "char probe_info[] = {'P','R','O','B','E','I','N','F','O','[',"
-            "  ('0'+((PROBESIZE/10000)%10)),"
-            "  ('0'+((PROBESIZE/1000)%10)),"
-            "  ('0'+((PROBESIZE/100)%10)),"
-            "  ('0'+((PROBESIZE/10)%10)),"
-            "  ('0'+((PROBESIZE/1)%10)),"
-            "']'};",
-            ""
-        ]
+        return self.sizeof_many([typename], headers=headers, **kws)[typename]
 
-        obj = self.compile('\n'.join(src), **kws)
+    def sizeof_many(self, typenames, headers=None, **kws):
+        """Return sizes in bytes of several types with at most one test compile.
 
-        with open(obj, 'rb') as F:
-            raw = F.read()
+        Sizes of fundamental types are taken from compiler predefined macros
+        (eg. ``__SIZEOF_POINTER__``) when available.
 
-        if raw.find(b'\x01\x01\x01P\x01\x01\x01R\x01\x01\x01O\x01\x01\x01B\x01\x01\x01E\x01\x01\x01I\x01\x01\x01N\x01\x01\x01F\x01\x01\x01O')!=-1:
-            # MSVC
-            raw = raw.replace(b'\x01\x01\x01', b'')
+        :returns: An OrderedDict mapping each typename to an integer.
+        :param list typenames: List of type names
+        :param list headers: List of headers to include during all test compilations
+        :param str language: Source code language: 'c' or 'c++'
+        :param list define_macros: Extra macro definitions.
+        :param list include_dirs: Extra directories to search for headers
+        :param list extra_preargs: Extra arguments to pass to the compiler
+        :param list extra_postargs: Extra arguments to pass to the compiler
 
-        M = re.match(b'.*PROBEINFO\\[(\\d+)\\].*', raw, re.DOTALL)
-        if M is None:
-            print(repr(raw))
-            raise RuntimeError('Unable to find PROBEINFO for %s'%typename)
+        Added in 2.12
+        """
+        ret = OrderedDict()
+        predef = self._predefined_sizes(**kws)
+        todo = []
+        for T in typenames:
+            macro = _predefined_sizeof(T)
+            if macro==1:
+                ret[T] = 1
+            elif predef.get(macro) is not None:
+                ret[T] = int(predef[macro])
+            else:
+                ret[T] = None
+                todo.append(T)
 
-        size = int(M.group(1))
-        log.info('Probe sizeof(%s) = %d', typename, size)
+        if todo:
+            sizes = self._layout(['sizeof(%s)'%T for T in todo], headers=headers, **kws)
+            ret.update(zip(todo, sizes))
+
+        for T, size in ret.items():
+            log.info('Probe sizeof(%s) = %d', T, size)
+        return ret
 
-        return size
+    def alignof(self, typename, headers=None, **kws):
+        """Return alignment in bytes of provided typename.
+        Arguments as for :py:meth:`sizeof`.
+
+        Added in 2.12
+        """
+        return self.alignof_many([typename], headers=headers, **kws)[typename]
+
+    def alignof_many(self, typenames, headers=None, **kws):
+        """Return alignments in bytes of several types with one test compile.
+        Arguments as for :py:meth:`sizeof_many`.
+
+        :returns: An OrderedDict mapping each typename to an integer.
+
+        Added in 2.12
+        """
+        typenames = list(typenames)
+        # Name each type with a typedef, as a type name may not simply precede a member name.
+        # eg. "int[4]" or "void (*)(void)"
+        decls = ['#ifdef __cplusplus',
+                 'template<typename T> struct probe_type { typedef T type; };',
+                 '#  define PROBE_TYPEDEF(N, ...) typedef probe_type<__VA_ARGS__>::type N;',
+                 '#elif defined(__GNUC__) || (defined(_MSC_VER) && _MSC_VER>=1939)',
+                 '#  define PROBE_TYPEDEF(N, ...) typedef __typeof__(__VA_ARGS__) N;',
+                 '#else', # only simple type names
+                 '#  define PROBE_TYPEDEF(N, ...) typedef __VA_ARGS__ N;',
+                 '#endif']
+        for i, T in enumerate(typenames):
+            decls += ['PROBE_TYPEDEF(probe_t_%d, %s)'%(i, T),
+                      'struct probe_align_%d { char c; probe_t_%d x; };'%(i, i)]
+        aligns = self._layout(['offsetof(struct probe_align_%d, x)'%i for i in range(len(typenames))],
+                              headers=headers, decls=decls, **kws)
+        ret = OrderedDict(zip(typenames, aligns))
+        for T, align in ret.items():
+            log.info('Probe alignof(%s) = %d', T, align)
+        return ret
+
+    def offsetof(self, typename, member, headers=None, **kws):
+        """Return offset in bytes of a member of a struct or union.
+
+        :param str typename: Type name.  eg. "struct timespec"
+        :param str member: Member name.  eg. "tv_nsec"
+
+        Other arguments as for :py:meth:`sizeof`.
+
+        Added in 2.12
+        """
+        return self.offsetof_many([(typename, member)], headers=headers, **kws)[(typename, member)]
+
+    def offsetof_many(self, members, headers=None, **kws):
+        """Return offsets of several struct or union members with one test compile.
+
+        :returns: An OrderedDict mapping each (typename, member) tuple to an integer.
+        :param list members: List of (typename, member) tuples.
+
+        Other arguments as for :py:meth:`sizeof_many`.
+
+        Added in 2.12
+        """
+        members = [tuple(M) for M in members]
+        offsets = self._layout(['offsetof(%s, %s)'%M for M in members], headers=headers, **kws)
+        ret = OrderedDict(zip(members, offsets))
+        for (T, mem), off in ret.items():
+            log.info('Probe offsetof(%s, %s) = %d', T, mem, off)
+        return ret
+
+    def _predefined_sizes(self, **kws):
+        """Values of compiler predefined __SIZEOF_*__ macros.
+        Missing when the compiler does not provide them (eg. MSVC).
+        """
+        key = json.dumps(sorted([(K, repr(V)) for K,V in kws.items()]))
+        with self._serial_lock:
+            predef = self._predef.get(key)
+        if predef is None:
+            macros = sorted(set(_predef_sizeof.values()))
+            predef = self.eval_macros(macros, **kws)
+            with self._serial_lock:
+                self._predef[key] = predef
+        return predef
+
+    def _layout(self, exprs, headers=None, decls=(), **kws):
+        """Evaluate several integer constant expressions with one test compile.
+        """
+        # borrow a trick from CMake.  see Modules/CheckTypeSize.c.in
+        # Each value is encoded as a string "PROBEINFO[<index>:<value>]" which is
+        # found in the resulting object file.
+        src = ['#include <stddef.h>']
+        src += ['#include <%s>'%h for h in self.headers+list(headers or ())]
+        src += list(decls)
+        for i, expr in enumerate(exprs):
+            src += [
+                '#define PROBEVAL_%d ((unsigned long)(%s))'%(i, expr),
+                "char probe_info_%d[] = {'P','R','O','B','E','I','N','F','O','[',%s,':',"%(i, ','.join(["'%s'"%c for c in str(i)])),
+            ]
+            src += ["  ('0'+((PROBEVAL_%d/%d)%%10)),"%(i, 10**p) for p in range(7, -1, -1)]
+            src += ["']'};"]
+        src.append("")
+
+        def probe():
+            obj = self.compile('\n'.join(src), **kws)
+
+            with open(obj, 'rb') as F:
+                raw = F.read()
+
+            if raw.find(b'\x01\x01\x01P\x01\x01\x01R\x01\x01\x01O\x01\x01\x01B\x01\x01\x01E\x01\x01\x01I\x01\x01\x01N\x01\x01\x01F\x01\x01\x01O')!=-1:
+                # MSVC
+                raw = raw.replace(b'\x01\x01\x01', b'')
+
+            values = [None]*len(exprs)
+            for M in re.finditer(b'PROBEINFO\\[(\\d+):(\\d+)\\]', raw):
+                idx = int(M.group(1))
+                if idx<len(values):
+                    values[idx] = int(M.group(2))
+
+            for expr, val in zip(exprs, values):
+                if val is None:
+                    raise RuntimeError('Unable to find PROBEINFO for %s'%expr)
+            return values
+
+        return self._cached('layout', src, kws, probe)
 
     def check_symbol(self, symname, headers=None, **kws):
         """Return True if symbol name (macro, variable, or function) is defined/delcared
@@ -248,6 +753,147 @@ class ProbeToolchain(object):
         log.info('Probe Member %s::%s -> %s', struct, member, 'Present' if ret else 'Absent')
         return ret
 
+    def _check_batch(self, items, single, make_src, **kws):
+        """Evaluate many independent checks with as few compiles as possible.
+
+        All items are first compiled together.  On failure, the group is split in half
+        and each half re-tried, down to single items which are checked with single(item).
+
+        :param list items: Check arguments
+        :param callable single: single(item) -> bool.  The equivalent single check method.
+        :param callable make_src: make_src(items) -> str.  Source code for a group of checks.
+        :returns: A dict mapping item to bool.
+        """
+        results = {}
+        todo = [list(items)]
+        ncompile = 0
+        while todo:
+            group = todo.pop()
+            if len(group)==1:
+                results[group[0]] = single(group[0])
+                ncompile += 1
+            elif group:
+                ncompile += 1
+                if self.try_compile(make_src(group), **kws):
+                    results.update([(item, True) for item in group])
+                else:
+                    mid = len(group)//2
+                    todo.extend([group[mid:], group[:mid]])
+        log.debug('Batch of %d checks in %d compiles', len(items), ncompile)
+        return results
+
+    def check_headers(self, headers, **kws):
+        """Check for the presence of many headers.  Equivalent to calling
+        :py:meth:`check_include` for each header, with fewer compiler runs.
+
+        Compilers supporting ``__has_include`` first exclude absent headers
+        with a single preprocessor run.
+        Headers which are present are then compiled together.
+        Headers which can not be included on their own,
+        but only after some other header, should be listed in ``ProbeToolchain(headers=...)``.
+
+        :param list headers: List of header file names
+        :param str language: Source code language: 'c' or 'c++'
+        :param list define_macros: Extra macro definitions.
+        :param list include_dirs: Extra directories to search for headers
+        :param list extra_preargs: Extra arguments to pass to the compiler
+        :param list extra_postargs: Extra arguments to pass to the compiler
+        :returns: An OrderedDict mapping header name to True (present) or False (absent)
+
+        Added in 2.12
+        """
+        headers = list(headers)
+        candidates = headers
+
+        if len(headers)>1:
+            src = ['#if defined(__has_include)',
+                   '#  define SETUPTOOLS_DSO_HAS_INCLUDE 1']
+            for i, h in enumerate(headers):
+                src += ['#  if __has_include(<%s>)'%h,
+                        '#    define SETUPTOOLS_DSO_HAS_%d 1'%i,
+                        '#  endif']
+            src += ['#endif']
+            macros = ['SETUPTOOLS_DSO_HAS_%d'%i for i in range(len(headers))]
+            try:
+                defs = self._eval_macros(['SETUPTOOLS_DSO_HAS_INCLUDE']+macros, src, **kws)
+            except (ExecError, CompileError) as e:
+                log.debug('Unable to test __has_include : %s', e)
+            else:
+                if defs['SETUPTOOLS_DSO_HAS_INCLUDE'] is not None:
+                    candidates = [h for h, m in zip(headers, macros) if defs[m] is not None]
+
+        def make_src(group):
+            return '\n'.join(['#include <%s>'%h for h in self.headers+group])
+
+        results = self._check_batch(candidates, lambda h: self.check_include(h, **kws), make_src, **kws)
+        ret = OrderedDict([(h, results.get(h, False)) for h in headers])
+        log.info('Probe includes %s', ', '.join(['%s -> %s'%(h, 'Present' if v else 'Absent') for h, v in ret.items()]))
+        return ret
+
+    def check_symbols(self, symnames, headers=None, **kws):
+        """Check for many symbol names.  Equivalent to calling
+        :py:meth:`check_symbol` for each name, with fewer compiler runs.
+
+        :param list symnames: List of symbol names
+        :param list headers: List of headers to include during all test compilations
+        :param str language: Source code language: 'c' or 'c++'
+        :param list define_macros: Extra macro definitions.
+        :param list include_dirs: Extra directories to search for headers
+        :param list extra_preargs: Extra arguments to pass to the compiler
+        :param list extra_postargs: Extra arguments to pass to the compiler
+        :returns: An OrderedDict mapping symbol name to True (present) or False (absent)
+
+        Added in 2.12
+        """
+        symnames = list(symnames)
+
+        def make_src(group):
+            src = ['#include <%s>'%h for h in self.headers+list(headers or ())]
+            for i, symname in enumerate(group):
+                src += [
+                    'void* probe_symbol_%d(void) {'%i,
+                    '#if defined(%s)'%symname,
+                    '  return 0;',
+                    '#else',
+                    '  return (void*)&%s;'%symname,
+                    '#endif',
+                    '}',
+                ]
+            return '\n'.join(src+[''])
+
+        results = self._check_batch(symnames, lambda sym: self.check_symbol(sym, headers=headers, **kws), make_src, **kws)
+        return OrderedDict([(sym, results[sym]) for sym in symnames])
+
+    def check_members(self, members, headers=None, **kws):
+        """Check for many structure members.  Equivalent to calling
+        :py:meth:`check_member` for each, with fewer compiler runs.
+
+        :param list members: List of (struct, member) tuples
+        :param list headers: List of headers to include during all test compilations
+        :param str language: Source code language: 'c' or 'c++'
+        :param list define_macros: Extra macro definitions.
+        :param list include_dirs: Extra directories to search for headers
+        :param list extra_preargs: Extra arguments to pass to the compiler
+        :param list extra_postargs: Extra arguments to pass to the compiler
+        :returns: An OrderedDict mapping (struct, member) to True (present) or False (absent)
+
+        Added in 2.12
+        """
+        members = [tuple(M) for M in members]
+
+        def make_src(group):
+            src = ['#include <%s>'%h for h in self.headers+list(headers or ())]
+            for i, (struct, member) in enumerate(group):
+                src += [
+                    'int probe_member_%d(void) {'%i,
+                    '  return (int)sizeof( ((%s *)0)->%s); '%(struct, member),
+                    '}',
+                ]
+            return '\n'.join(src+[''])
+
+        results = self._check_batch(members, lambda M: self.check_member(M[0], M[1], headers=headers, **kws), make_src, **kws)
+        return OrderedDict([(M, results[M]) for M in members])
+
     def eval_macros(self, macros, headers=None, define_macros=None, language='c', **kws):
         """Expand C/C++ preprocessor macros.
 
@@ -268,11 +914,18 @@ class ProbeToolchain(object):
         if isinstance(macros, str):
             macros = [macros]
 
-        srcname = os.path.join(self.tempdir, self._source_name('eval_macros_in', language=language, **kws))
-        outname = os.path.join(self.tempdir, self._source_name('eval_macros_out', language=language, **kws))
+        src = ['#include <%s>'%h for h in self.headers+list(headers or ())]
+
+        return self._eval_macros(macros, src, define_macros=define_macros, language=language, **kws)
+
+    def _eval_macros(self, macros, src, define_macros=None, language='c', **kws):
+        """eval_macros() with a list of prelude source lines in place of headers
+        """
+        srcname = self._scratch_name('eval_macros_in', language=language)
+        outname = self._scratch_name('eval_macros_out', language=language)
 
         define_macros = self.define_macros + list(define_macros or [])
-        src = ['#include <%s>'%h for h in self.headers+list(headers or ())]
+        src = list(src)
 
         for macro in macros:
             src.append('''
@@ -285,50 +938,68 @@ void U_{macro} = ||||||; void X_{macro};
 
         src = '\n'.join(src)
 
-        with open(srcname, 'w') as F:
-            F.write(src)
+        def probe():
+            with open(srcname, 'w') as F:
+                F.write(src)
 
-        self.compiler.preprocess(srcname, outname, macros=define_macros, **kws)
+            self.compiler.preprocess(srcname, outname, macros=define_macros, **kws)
 
-        with open(outname, 'r') as F:
-            out = F.read()
+            with open(outname, 'r') as F:
+                return _scan_macros(F, macros)
 
-        # Various pre-processor implementations are inconsistent about
-        # what "debris" is emitted in the output.
-        # eg. GCC strips C/C++ comments, while MSVC leaves them in.
+        return OrderedDict(self._cached('eval_macros', src, dict(kws, language=language, define_macros=define_macros), probe))
 
-        # remove pre-processor directive lines
-        out = re.sub(r'^\s*#[^\n\r]*$', '', out, 0, re.MULTILINE)
-        # remove c++ line comments
-        out = re.sub(r'^//[^\n\r]*$', '', out, 0, re.MULTILINE)
-        # remove C comments
-        out = re.sub(r'/\*.*?\*/', '', out, 0, re.MULTILINE|re.DOTALL)
+    def run_parallel(self, probes, njobs=None):
+        """Run independent probes concurrently.
 
-        defs = OrderedDict()
+        Probes are run from a pool of threads, each driving a compiler process. ::
 
-        for name in macros:
-            pat = r'.*void ([DU])_%(name)s = \|\|\|(.*?)\|\|\|; void X_%(name)s;.*'%{'name':name}
-            M = re.match(pat, out, re.MULTILINE|re.DOTALL)
-            if M is None:
-                raise RuntimeError("In %r\nFailed to find match for %r using %r"%(out, name, pat))
-            du, val = M.groups()
-            if du=='D':
-                defs[name] = val.strip()
-            elif du=='U':
-                defs[name] = None
-            else:
-                raise ValueError("Logic error {0!r} : {1!r}".format(M, M.groups()) )
+            from functools import partial
+            has_foo_h, has_bar, sizeof_long = probe.run_parallel([
+                partial(probe.check_include, 'foo.h'),
+                partial(probe.check_symbol, 'bar', headers=['stdlib.h']),
+                partial(probe.sizeof, 'long'),
+            ])
 
-        return defs
+        :param list probes: List of callables taking no arguments.  eg. functools.partial
+        :param int njobs: Maximum number of concurrent probes.  Default is the same as
+                          for compiling DSOs.  cf. :ref:`num_jobs`
+        :returns: List of results in the same order as probes.
+                  If any probe raises an exception, the first is re-raised after all have completed.
+
+        Added in 2.12
+        """
+        probes = list(probes)
+        if njobs is None:
+            from .dsocmd import system_concurrency
+            njobs = system_concurrency()
+        njobs = max(1, min(njobs, len(probes)))
+
+        try:
+            from concurrent.futures import ThreadPoolExecutor
+        except ImportError: # py2
+            njobs = 1
+
+        if njobs==1:
+            return [fn() for fn in probes]
+
+        with ThreadPoolExecutor(max_workers=njobs) as pool:
+            futures = [pool.submit(fn) for fn in probes]
+            for F in futures:
+                F.exception() # wait for all
+            return [F.result() for F in futures]
 
     @property
     def info(self):
         """Inspect toolchain
 
+        Shared by all :py:class:`ProbeToolchain` using the same compiler toolchain,
+        headers, and define_macros.  So computed at most once per process.  (Changed in 2.12)
+
         :returns: A :py:class:`probe.ToolchainInfo`
         """
         if self._info is None:
-            self._info = ToolchainInfo(self)
+            self._info = self._session.info(self.headers, self.define_macros)
 
         return self._info
 
@@ -397,6 +1068,8 @@ class ToolchainInfo(object):
         '__GNUC_PATCHLEVEL__',
         '_MSC_VER',
         '_MSC_FULL_VER',
+        # pointer size, when the compiler predefines it
+        '__SIZEOF_POINTER__',
     ]
 
     __info = {
@@ -469,7 +1142,10 @@ class ToolchainInfo(object):
             if getattr(self, attr) is None:
                 log.warning("Warning: unable to classify "+attr)
 
-        self.address_width = 8*TC.sizeof('void*')
+        if D['__SIZEOF_POINTER__'] is not None:
+            self.address_width = 8*int(D['__SIZEOF_POINTER__'])
+        else:
+            self.address_width = 8*TC.sizeof('void*')
 
     def __repr__(self):
         S = []
@@ -483,5 +1159,19 @@ class ToolchainInfo(object):
         return 'ToolchainInfo({})'.format(', '.join(S))
     __str__ = __repr__
 
+def getargs():
+    from argparse import ArgumentParser
+    P = ArgumentParser(description='Inspect default compiler toolchain')
+    P.add_argument('--clear-cache', action='store_true',
+                   help='Remove cached probe results.  cf. $SETUPTOOLS_DSO_PROBE_CACHE')
+    return P
+
+def main():
+    args = getargs().parse_args()
+    if args.clear_cache:
+        clear_cache(_probe_cache_dir() or True)
+    else:
+        print(ProbeToolchain().info)
+
 if __name__=='__main__':
-    print(ProbeToolchain().info)
+    main()
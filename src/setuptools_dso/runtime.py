@@ -10,14 +10,16 @@ from __future__ import print_function
 import os
 import sys
 import logging
-import inspect
+import threading
 from importlib import import_module
-from collections import OrderedDict
+from collections import OrderedDict, deque
 
 __all__ = (
     'dylink_prepare_dso',
     'find_dso',
     'import_dsoinfo',
+    'lazy_cdll',
+    'preload',
 )
 
 _log = logging.getLogger(__name__)
@@ -26,6 +28,58 @@ _log = logging.getLogger(__name__)
 # Only effective on windows.
 _dso_dirs = set()
 
+# memo of resolved dependency closures.
+# (package, dso) -> info module
+_closures = {}
+
+# package manifests already imported, or found to be missing.
+# package name -> (manifest filename, dict, lazy build record or None) or None
+_manifests = {}
+
+# DSOs loaded from zip archives.  One memfd, or extracted file, per member.
+# path in archive (eg. "/some/app.pyz/pkg/libfoo.so"), or (archive, member) -> loadable path
+_materialized = {}
+# ctypes.CDLL of DSOs loaded in advance of their dependents, to keep them loaded.
+# eg. dependencies of a DSO within a zip archive, or CPU specific variants.
+_handles = {}
+
+try:
+    _string_types = (str, unicode) # py2
+except NameError:
+    _string_types = (str,)
+
+# guards _dso_dirs, _closures, _manifests, _materialized, and _handles
+_lock = threading.Lock()
+
+# x86-64 micro-architecture levels (cf. the x86-64 psABI), ordered from lowest.
+# level -> flags from /proc/cpuinfo needed in addition to those of all lower levels
+_isa_levels = [
+    ('x86-64-v2', ['cx16', 'lahf_lm', 'pni', 'popcnt', 'sse4_1', 'sse4_2', 'ssse3']), # pni is SSE3
+    ('x86-64-v3', ['avx', 'avx2', 'bmi1', 'bmi2', 'f16c', 'fma', 'abm', 'movbe', 'xsave']),
+    ('x86-64-v4', ['avx512f', 'avx512bw', 'avx512cd', 'avx512dq', 'avx512vl']),
+]
+
+# set of levels supported by the running CPU, once known
+_cpu_levels = None
+
+def _user_cache_dir(*parts):
+    """Per-user directory for cached files.
+    eg. "~/.cache/setuptools_dso/..."
+
+    Override with $SETUPTOOLS_DSO_CACHE_DIR
+    """
+    base = os.environ.get('SETUPTOOLS_DSO_CACHE_DIR')
+    if base:
+        pass
+    elif sys.platform == 'win32':
+        base = os.path.join(os.environ.get('LOCALAPPDATA') or os.path.expanduser('~'), 'setuptools_dso', 'Cache')
+    elif sys.platform == 'darwin':
+        base = os.path.join(os.path.expanduser('~'), 'Library', 'Caches', 'setuptools_dso')
+    else:
+        base = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'),
+                            'setuptools_dso')
+    return os.path.join(base, *parts)
+
 def add_dso_directory(path):
     path = os.path.normpath(path)
 
@@ -34,19 +88,20 @@ def add_dso_directory(path):
     if not os.path.isabs(path):
         raise ValueError('DSO search pathes must be absolute: {0!r}'.format(path))
 
-    elif path in _dso_dirs:
-        return
+    with _lock:
+        if path in _dso_dirs:
+            return
 
-    elif hasattr(os, 'add_dll_directory'): # py >= 3.8
-        os.add_dll_directory(path)
+        elif hasattr(os, 'add_dll_directory'): # py >= 3.8
+            os.add_dll_directory(path)
 
-    elif sys.platform == "win32":
-        paths = os.environ.get('PATH', '').split(os.pathsep)
-        paths.append(path)
-        os.environ['PATH'] = os.pathsep.join(paths)
+        elif sys.platform == "win32":
+            paths = os.environ.get('PATH', '').split(os.pathsep)
+            paths.append(path)
+            os.environ['PATH'] = os.pathsep.join(paths)
 
-    _log.debug('Extend DSO search path to {0!r}'.format(path))
-    _dso_dirs.add(path)
+        _log.debug('Extend DSO search path to {0!r}'.format(path))
+        _dso_dirs.add(path)
 
 def _dso2info(dso):
     """Return mangled name of DSO info module.
@@ -57,11 +112,104 @@ def _dso2info(dso):
     parts[-1] = '{}_dsoinfo'.format(parts[-1])
     return '.'.join(parts)
 
-def _auto_pkg():
-    # look 2 frames down in the call stack
-    caller_frame = inspect.stack()[2][0]
-    caller_mod = inspect.getmodule(caller_frame)
-    return caller_mod.__name__
+def _resolve_name(name, package):
+    """Resolve a possibly relative DSO name to an absolute name.
+    cf. importlib.util.resolve_name()
+
+    eg. ('..lib.adso', 'my.pkg.ext') -> 'my.pkg.lib.adso'
+    """
+    if not name.startswith('.'):
+        return name
+    level = len(name) - len(name.lstrip('.'))
+    bits = package.rsplit('.', level - 1)
+    if len(bits) < level:
+        raise ValueError('attempted relative import beyond top-level package')
+    rest = name[level:]
+    return '{0}.{1}'.format(bits[0], rest) if rest else bits[0]
+
+class ManifestInfo(object):
+    """Equivalent of an "info" module for a DSO listed in a package manifest.
+    eg. "my/pkg/libs/_dsomanifest.py" for DSO 'my.pkg.libs.adso'
+
+    Provides the same attributes as an info module, with the addition of
+
+    - `.closure` Names of all DSOs which must be loaded with this one, including itself.
+      Each DSO appears before its dependencies.
+    - `.isa_variants` Names of CPU micro-architecture levels for which variants were built.
+    """
+    def __init__(self, dsoname, manifest_file, entry):
+        dir = os.path.dirname(manifest_file)
+        self.__file__ = manifest_file
+        self.dsoname = dsoname
+        self.libname = entry['libname']
+        self.soname = entry['soname']
+        self.depends = entry['depends']
+        self.closure = entry['closure']
+        self.isa_variants = entry.get('isa_variants', [])
+        self._filename = os.path.join(dir, self.libname)
+        self.sofilename = os.path.join(dir, self.soname)
+
+    @property
+    def filename(self):
+        """Library file name without soversion.  Or .sofilename when this alias is not
+        installed.  eg. from a wheel.  (Changed in 2.12)
+        """
+        if self.libname!=self.soname and not os.path.exists(self._filename):
+            return self.sofilename
+        return self._filename
+
+    def __repr__(self):
+        return 'ManifestInfo({0!r}, {1!r})'.format(self.dsoname, self.__file__)
+
+def _manifest_info(dso):
+    """Lookup absolute DSO name in the manifest of its package.
+
+    :returns: A :py:class:`ManifestInfo`, or None if package has no manifest
+              or DSO is not listed.
+    """
+    pkg = dso.rpartition('.')[0]
+    if not pkg:
+        return None
+
+    with _lock:
+        found = pkg in _manifests
+        manifest = _manifests.get(pkg)
+
+    if not found:
+        try:
+            mod = import_module(pkg+'._dsomanifest')
+        except ImportError:
+            manifest = None # eg. built by setuptools_dso < 2.12
+        else:
+            manifest = (mod.__file__, mod.dsos, getattr(mod, 'lazy', None))
+            if manifest[2]: # built with --lazy-dsos
+                from .lazy import register
+                register(manifest[2])
+        with _lock:
+            _manifests[pkg] = manifest
+
+    if manifest is None or dso not in manifest[1]:
+        return None
+    info = ManifestInfo(dso, manifest[0], manifest[1][dso])
+    if manifest[2]:
+        from .lazy import _ensure_dso
+        _ensure_dso(manifest[2], info)
+    return info
+
+def _lookup_dso(dso, package):
+    """Return manifest entry, or info module, for absolute DSO name
+    """
+    info = _manifest_info(dso)
+    if info is None:
+        info = import_dsoinfo(dso, package=package)
+    return info
+
+def _auto_pkg(depth=2):
+    # look 2 frames down in the call stack.
+    # sys._getframe() avoids the cost of inspect.stack() collecting
+    # source context for every frame.
+    caller_frame = sys._getframe(depth)
+    return caller_frame.f_globals['__name__']
 
 def import_dsoinfo(dso, package=None):
     """Import and return "info" module for the named DSO.
@@ -89,23 +237,233 @@ def dylink_prepare_dso(dso, package=None):
 
     :param str dso: DSO name string (eg. 'my.pkg.libs.adso').
     :param str package: Package name to resolve relative imports.  cf. importlib.import_module
-    :returns: Info module for the named DSO
+    :returns: Info module for the named DSO.  Or since 2.12, an equivalent
+              :py:class:`ManifestInfo` when the package has a DSO manifest.
+
+    Since 2.12, if the DSO, or any dependency, was built with ``isa_variants``
+    then the variants selected for the running CPU are loaded.
     """
     if package is None:
         package = _auto_pkg()
-    todo, found = [dso], OrderedDict()
+    infos = _closure(dso, package)
+    if any([_isa_variant(info) for info in infos]):
+        # load the selected variants, so that the OS loader will reuse them (matching SONAME)
+        _load_closure(infos)
+    return infos[0]
 
-    # recursively walk dependencies
+def _closure(dso, package):
+    """Prepare, and return info for, the named DSO and all of its dependencies.
+
+    :returns: A list of info modules, or :py:class:`ManifestInfo`, beginning with the named DSO.
+              Topologically sorted so that each DSO appears before its dependencies.
+    """
+    key = (package, dso)
+    with _lock:
+        infos = _closures.get(key)
+    if infos is not None:
+        return infos
+
+    todo, found = deque([_resolve_name(dso, package)]), OrderedDict()
+    cwd = os.getcwd()
+
+    # recursively walk dependencies.
+    # DSOs found in a package manifest come with a pre-computed closure.
     while todo:
-        working = todo.pop(0)
-        info = import_dsoinfo(working, package=package)
+        working = todo.popleft()
+        if working in found:
+            continue
+        info = _lookup_dso(working, package)
         found[working] = info
         # libdir must be absolute, but __file__ may be relative if imported via $PWD
-        libdir = os.path.join(os.getcwd(), os.path.dirname(info.__file__))
-        add_dso_directory(libdir)
-        todo.extend([t for t in info.depends if t not in found])
+        libdir = os.path.join(cwd, os.path.dirname(info.__file__))
+        if os.path.isdir(libdir): # not in a zip archive
+            add_dso_directory(libdir)
+        todo.extend([t for t in getattr(info, 'closure', info.depends) if t not in found])
+
+    # breadth first walk order is not necessarily topological.
+    post, seen = [], set()
+    stack = [(next(iter(found)), False)]
+    while stack:
+        name, expanded = stack.pop()
+        if expanded:
+            post.append(found[name])
+        elif name not in seen:
+            seen.add(name)
+            stack.append((name, True))
+            stack.extend([(dep, False) for dep in reversed(found[name].depends) if dep not in seen])
+    infos = post[::-1]
+
+    with _lock:
+        _closures[key] = infos
+    return infos
+
+def _split_zip(path):
+    """Split a path to a file within a zip archive.
+    eg. "/some/app.pyz/pkg/libfoo.so" -> ("/some/app.pyz", "pkg/libfoo.so")
+
+    :returns: (archive, member) or None if path is not within a zip archive.
+    """
+    import zipfile
+    archive, member = path, []
+    while True:
+        if os.path.isfile(archive):
+            if member and zipfile.is_zipfile(archive):
+                return archive, '/'.join(reversed(member))
+            return None
+        archive, tail = os.path.split(archive)
+        if not tail:
+            return None
+        member.append(tail)
+
+def _materialize(path):
+    """Return a path from which the OS loader can load the file at path.
+    Files within a zip archive are copied out to memory (Linux memfd),
+    or to an extraction cache directory.
+    """
+    if os.path.exists(path):
+        return path
+
+    with _lock:
+        real = _materialized.get(path)
+    if real is not None:
+        return real
+
+    split = _split_zip(path)
+    if split is None:
+        return path # let the loader report the error
+    archive, member = split
+    mkey = (os.path.realpath(archive), member) # eg. path through a symlink
+    with _lock:
+        real = _materialized.get(mkey)
+    if real is not None:
+        with _lock:
+            return _materialized.setdefault(path, real)
+
+    import zipfile
+    with zipfile.ZipFile(archive) as Z:
+        data = Z.read(member)
+
+    fd = None
+    if hasattr(os, 'memfd_create') and os.environ.get('SETUPTOOLS_DSO_ZIP_EXTRACT', '0')=='0': # py >= 3.8, Linux
+        fd = os.memfd_create(os.path.basename(member), os.MFD_CLOEXEC)
+        try:
+            os.write(fd, data)
+        except Exception:
+            os.close(fd)
+            raise
+        # kept open so that the returned path remains valid.  eg. for a later ctypes.CDLL()
+        real = '/proc/self/fd/{0}'.format(fd)
+
+    else:
+        import hashlib
+        S = os.stat(archive)
+        key = hashlib.sha1('{0}\0{1}\0{2}'.format(os.path.abspath(archive), S.st_size, S.st_mtime).encode()).hexdigest()
+        # keep layout from archive so that $ORIGIN relative RPATH works
+        real = _user_cache_dir('zip', key[:16], *member.split('/'))
+        if not os.path.isfile(real):
+            if not os.path.isdir(os.path.dirname(real)):
+                os.makedirs(os.path.dirname(real))
+            tmp = '{0}.{1}.tmp'.format(real, os.getpid())
+            with open(tmp, 'wb') as F:
+                F.write(data)
+            os.chmod(tmp, 0o755)
+            getattr(os, 'replace', os.rename)(tmp, real) # py >= 3.3 for atomic replace on windows
+
+    with _lock:
+        winner = _materialized.setdefault(mkey, real)
+        _materialized.setdefault(path, winner)
+    if winner!=real and fd is not None:
+        os.close(fd) # another thread materialized this member first
+    _log.debug('Load {0!r} from {1!r}'.format(path, winner))
+    return winner
+
+def _load_closure(infos, start=0):
+    """Load DSOs of a closure, starting from infos[start], with dependencies
+    before dependents.  The handles are kept so that the libraries stay loaded.
+    Relies on the OS loader to reuse an already loaded library with a matching SONAME.
+    """
+    import ctypes
+    with _lock:
+        todo = [info for info in reversed(infos[start:]) if info.dsoname not in _handles] # dependencies before dependents
+    fnames = [_materialize(_sofilename(info)) for info in todo]
+    _readahead(fnames)
+    for info, fname in zip(todo, fnames):
+        with _lock:
+            loaded = info.dsoname in _handles
+        if not loaded:
+            lib = ctypes.CDLL(fname, ctypes.DEFAULT_MODE)
+            with _lock:
+                _handles.setdefault(info.dsoname, lib)
+
+def _prepare_zip(infos):
+    """For a DSO closure in a zip archive, load dependencies
+    so that the named DSO may then be loaded from a materialized file.
+    """
+    _load_closure(infos, 1)
 
-    return next(iter(found.values())) # first value
+def _cpu_isa_levels():
+    """Set of micro-architecture levels supported by the running CPU.
+
+    Only the "flags" of the first CPU in /proc/cpuinfo are read.  So empty if unknown,
+    eg. on other than Linux, or with an emulator which omits flags.
+    Then the baseline build is loaded, unless $SETUPTOOLS_DSO_ISA is set.
+    """
+    global _cpu_levels
+    if _cpu_levels is not None:
+        return _cpu_levels
+
+    flags, levels = set(), set()
+    try:
+        with open('/proc/cpuinfo', 'r') as F:
+            for line in F:
+                if line.startswith('flags'): # all CPUs are assumed to be the same
+                    flags = set(line.partition(':')[2].split())
+                    break
+    except (IOError, OSError) as e:
+        _log.debug('Unable to read CPU flags from /proc/cpuinfo : {0}'.format(e)) # not Linux
+
+    for level, required in _isa_levels:
+        if not flags.issuperset(required):
+            break
+        levels.add(level)
+
+    _log.debug('CPU supports {0!r}'.format(sorted(levels)))
+    _cpu_levels = levels
+    return levels
+
+def _isa_variant(info):
+    """Select the variant of a DSO to load for the running CPU.
+
+    May be overridden by setting $SETUPTOOLS_DSO_ISA to a level name (eg. "x86-64-v3"),
+    or to "baseline".
+
+    :returns: A level name, or None to use the baseline build.
+    """
+    variants = getattr(info, 'isa_variants', None) # absent in info modules from < 2.12
+    if not variants:
+        return None
+
+    override = os.environ.get('SETUPTOOLS_DSO_ISA')
+    if override:
+        return override if override in variants else None
+
+    levels = _cpu_isa_levels()
+    for level in reversed(variants):
+        if level in levels:
+            return level
+    _log.debug('Load baseline build of {0!r}.  CPU supports none of {1!r}'.format(info.dsoname, variants))
+    return None
+
+def _sofilename(info, so=True):
+    """File name of the DSO variant selected for the running CPU.
+    SO qualified, unless so=False.
+    """
+    fname = info.sofilename if so else info.filename
+    level = _isa_variant(info)
+    if level is None:
+        return fname
+    dir, base = os.path.split(fname)
+    return os.path.join(dir, 'glibc-hwcaps', level, base)
 
 def find_dso(dso, package=None, so=True):
     """Lookup DSO file name.  eg. for use with ctypes
@@ -117,6 +475,14 @@ def find_dso(dso, package=None, so=True):
                     No effect on Windows.
     :returns: Absolute path string of DSO file.
 
+    Since 2.12, if the DSO was built with ``isa_variants``, the path of the
+    best variant for the running CPU is returned.  (cf. $SETUPTOOLS_DSO_ISA)
+
+    Since 2.12, DSOs within a zip archive (eg. a zipapp) are supported on Linux.
+    Dependencies are loaded, and the returned path is an in-memory copy
+    (eg. "/proc/self/fd/3").  Elsewhere, or if $SETUPTOOLS_DSO_ZIP_EXTRACT=1,
+    the archive is extracted to a cache directory instead.
+
     eg. ::
 
         fname = setuptools_dso.find_dso('my.pkg.libs.adso')
@@ -124,9 +490,167 @@ def find_dso(dso, package=None, so=True):
     """
     if package is None:
         package = _auto_pkg()
-    mod = dylink_prepare_dso(dso, package=package)
-    return mod.sofilename if so else mod.filename
+    infos = _closure(dso, package)
+    mod = infos[0]
+    fname = _sofilename(mod, so=so)
+
+    if not os.path.exists(fname) and _split_zip(mod.sofilename) is not None:
+        # eg. a zipapp.
+        _prepare_zip(infos)
+        fname = _materialize(_sofilename(mod))
+
+    return fname
+
+
+def _readahead_one(fname):
+    try:
+        fd = os.open(fname, os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        finally:
+            os.close(fd)
+    except OSError as e:
+        _log.debug('Unable to readahead {0!r} : {1}'.format(fname, e))
+
+def _readahead(fnames):
+    """Hint that files will be read soon.  Best effort.
+    Hints are issued concurrently, as each may block while its reads are queued.
+    Returns once all are issued.
+    """
+    if not hasattr(os, 'posix_fadvise'): # py >= 3.3 and POSIX
+        return
+    fnames = [fname for fname in fnames if not fname.startswith('/proc/self/fd/')] # already in memory
+    threads = [threading.Thread(target=_readahead_one, args=(fname,)) for fname in fnames[1:]]
+    for T in threads:
+        T.daemon = True
+        T.start()
+    if fnames:
+        _readahead_one(fnames[0])
+    for T in threads:
+        T.join()
+
+def preload(dsos, mode=None, package=None):
+    """Load the named DSO(s), and all of their dependencies, with ctypes.
+
+    The library files of the whole closure are first hinted to the OS for readahead, concurrently,
+    then loaded in dependency order.
+    May be called from a background thread during application startup
+    to hide the latency of reading libraries from slow storage. eg. ::
+
+        threading.Thread(target=setuptools_dso.runtime.preload,
+                         args=(['my.pkg.libs.adso', 'my.pkg.libs.other'],),
+                         kwargs={'package': __name__}).start()
+
+    :param dsos: A DSO name string (eg. 'my.pkg.libs.adso'), or a list of such strings.
+    :param int mode: Passed to ctypes.CDLL().  Default ``ctypes.RTLD_GLOBAL``.
+    :param str package: Package name to resolve relative imports.  cf. importlib.import_module
+    :returns: An OrderedDict mapping DSO name to ctypes.CDLL in the order loaded.
 
+    Added in 2.12
+    """
+    import ctypes
+    if package is None:
+        package = _auto_pkg()
+    if mode is None:
+        mode = ctypes.RTLD_GLOBAL
+    if isinstance(dsos, _string_types):
+        dsos = [dsos]
+
+    order = OrderedDict()
+    for dso in dsos:
+        # dependencies before dependents
+        for info in reversed(_closure(dso, package)):
+            order.setdefault(info.dsoname, info)
+
+    fnames = [_materialize(_sofilename(info)) for info in order.values()]
+
+    # the whole closure, before the first is loaded
+    _readahead(fnames)
+
+    handles = OrderedDict()
+    for name, fname in zip(order, fnames):
+        _log.debug('Preload {0!r}'.format(fname))
+        handles[name] = ctypes.CDLL(fname, mode)
+    return handles
+
+class LazyCDLL(object):
+    """Stand-in for a ctypes.CDLL, which finds and loads the named DSO on first use.
+    cf. :py:func:`lazy_cdll`
+
+    Function pointers are looked up once, and cached with any prototype.
+    Safe for use from multiple threads.
+    """
+    def __init__(self, dso, package, mode=None, so=True, prototypes=None):
+        self._dso = dso
+        self._package = package
+        self._mode = mode
+        self._so = so
+        self._prototypes = dict(prototypes or {})
+        self._lib = None
+        self._lock = threading.Lock()
+
+    @property
+    def cdll(self):
+        """The underlying ctypes.CDLL.  Loaded if necessary.
+        """
+        lib = self._lib
+        if lib is None:
+            with self._lock:
+                lib = self._lib
+                if lib is None:
+                    import ctypes
+                    fname = find_dso(self._dso, package=self._package, so=self._so)
+                    _log.debug('Lazy load {0!r}'.format(fname))
+                    mode = ctypes.DEFAULT_MODE if self._mode is None else self._mode
+                    lib = self._lib = ctypes.CDLL(fname, mode)
+        return lib
+
+    def __getattr__(self, name):
+        # only reached for names not already cached in __dict__
+        if name.startswith('__') and name.endswith('__'):
+            raise AttributeError(name)
+        lib = self.cdll
+        with self._lock:
+            fn = self.__dict__.get(name)
+            if fn is None:
+                fn = getattr(lib, name)
+                proto = self._prototypes.get(name)
+                if proto is not None:
+                    fn.restype, argtypes = proto
+                    if argtypes is not None:
+                        fn.argtypes = argtypes
+                setattr(self, name, fn)
+        return fn
+
+    def __repr__(self):
+        return 'LazyCDLL({0!r}, loaded={1!r})'.format(self._dso, self._lib is not None)
+
+def lazy_cdll(dso, package=None, mode=None, so=True, prototypes=None):
+    """Deferred equivalent of ``ctypes.CDLL(find_dso(dso), mode)``.
+    Lookup and loading of the DSO happen on first attribute access.
+    Appropriate for module scope in place of an explicit ctypes.CDLL(). eg. ::
+
+        _lib = setuptools_dso.runtime.lazy_cdll('my.pkg.libs.adso', prototypes={
+            'adso_version': (ctypes.c_char_p, []),
+        })
+
+        def version():
+            return _lib.adso_version()
+
+    :param str dso: DSO name string (eg. 'my.pkg.libs.adso').
+    :param str package: Package name to resolve relative imports.  cf. importlib.import_module
+    :param int mode: Passed to ctypes.CDLL().  Default ``ctypes.DEFAULT_MODE``.
+    :param bool so: Passed to :py:func:`find_dso`
+    :param dict prototypes: Map of function name to a tuple of (restype, argtypes).
+                            Applied when the function is first accessed.
+                            argtypes may be None to leave unset.
+    :returns: A :py:class:`LazyCDLL`
+
+    Added in 2.12
+    """
+    if package is None:
+        package = _auto_pkg()
+    return LazyCDLL(dso, package, mode=mode, so=so, prototypes=prototypes)
 
 
 def _cli_info(args):
@@ -0,0 +1,189 @@
+# Copyright 2022  Michael Davidsaver
+# SPDX-License-Identifier: BSD
+# See LICENSE
+"""Place build products.  eg. for ``build_dso --inplace``, and install.
+
+Files are cloned (reflink) when the filesystem supports this,
+otherwise native libraries are hard linked, otherwise files are copied.
+Symlinks are re-created as symlinks.
+Destination files with the same content as the source are left alone.
+"""
+
+import os
+import sys
+import shutil
+import hashlib
+import threading
+import logging as log
+from contextlib import contextmanager
+
+__all__ = (
+    'stage_file',
+    'stage_tree',
+)
+
+# from linux/fs.h.  _IOW(0x94, 9, int)
+_FICLONE = 0x40049409
+
+def _reflink(src, dst):
+    """Create dst sharing the storage of src.  eg. on btrfs or xfs
+    :returns: True if successful.
+    """
+    if not sys.platform.startswith('linux'):
+        return False
+    import fcntl
+    with open(src, 'rb') as S:
+        with open(dst, 'wb') as D:
+            try:
+                fcntl.ioctl(D.fileno(), _FICLONE, S.fileno())
+                return True
+            except (IOError, OSError):
+                return False
+
+def _is_native(path):
+    """True for native libraries.  eg. "libfoo.so.1", "foo.pyd", or "foo.dylib"
+
+    Linkers replace, rather than re-write, an existing output file.
+    So only these may safely be hard linked.
+    """
+    name = os.path.basename(path)
+    return name.endswith(('.so', '.pyd', '.dll', '.dylib')) or '.so.' in name
+
+def _hash_file(fname):
+    """:returns: The hex SHA256 digest of the content of a file.
+    """
+    H = hashlib.sha256()
+    with open(fname, 'rb') as F:
+        for blk in iter(lambda: F.read(1024*1024), b''):
+            H.update(blk)
+    return H.hexdigest()
+
+@contextmanager
+def _atomic(dst):
+    """Yield a unique temp. name for concurrent writers, which then replaces dst.
+    So dst appears complete, or not at all.  The temp. file, or directory, is removed on error.
+    """
+    tmp = '{0}.{1}.{2}.tmp'.format(dst, os.getpid(), threading.current_thread().ident)
+    try:
+        yield tmp
+        if not hasattr(os, 'replace') and os.path.isfile(dst):
+            os.remove(dst) # py2
+        getattr(os, 'replace', os.rename)(tmp, dst)
+    except:
+        if os.path.isdir(tmp) and not os.path.islink(tmp):
+            shutil.rmtree(tmp, ignore_errors=True)
+        elif os.path.lexists(tmp):
+            os.remove(tmp)
+        raise
+
+def _same_content(src, dst):
+    with open(src, 'rb') as S:
+        with open(dst, 'rb') as D:
+            while True:
+                sblk, dblk = S.read(1024*1024), D.read(1024*1024)
+                if sblk!=dblk:
+                    return False
+                elif not sblk:
+                    return True
+
+def _identical(src, dst):
+    try:
+        if os.path.islink(dst) or not os.path.isfile(dst):
+            return False
+        S, D = os.stat(src), os.stat(dst)
+        if (S.st_dev, S.st_ino)==(D.st_dev, D.st_ino):
+            return True # hard linked
+        elif S.st_size!=D.st_size:
+            return False
+        # size and mtime are not enough.  eg. mtime granularity, or a source file re-written in place.
+        return _same_content(src, dst)
+    except (IOError, OSError):
+        return False
+
+def _copy_stat(src, tmp, preserve_mode, preserve_times):
+    if preserve_mode:
+        shutil.copymode(src, tmp)
+    if preserve_times:
+        S = os.stat(src)
+        os.utime(tmp, (S.st_atime, S.st_mtime))
+
+def _place(src, tmp, hardlink, preserve_mode, preserve_times):
+    if _reflink(src, tmp):
+        _copy_stat(src, tmp, preserve_mode, preserve_times)
+        return 'cloning'
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    if hardlink and hasattr(os, 'link'):
+        try:
+            os.link(src, tmp)
+            return 'linking'
+        except OSError:
+            pass # eg. different filesystems
+    shutil.copyfile(src, tmp)
+    _copy_stat(src, tmp, preserve_mode, preserve_times)
+    return 'copying'
+
+def stage_file(src, dst, hardlink=None, preserve_mode=True, preserve_times=True, verbose=1, dry_run=0):
+    """Place a copy of file src at dst.
+
+    :param bool hardlink: Whether src may be hard linked.
+                          Default (None) for native libraries, when both mode and times are preserved.
+    :param bool preserve_mode: Copy permission bits of src.  (Added in 2.12)
+    :param bool preserve_times: Copy access and modification times of src.  (Added in 2.12)
+    :returns: (dst, changed) like :py:func:`distutils.file_util.copy_file`
+    """
+    if os.path.isdir(dst):
+        dst = os.path.join(dst, os.path.basename(src))
+
+    if os.path.islink(src):
+        target = os.readlink(src)
+        if os.path.islink(dst) and os.readlink(dst)==target:
+            log.debug("not linking %s (unchanged)", dst)
+            return dst, False
+        if verbose:
+            log.info("symlink %s -> %s", dst, target)
+        if not dry_run:
+            if os.path.lexists(dst):
+                os.remove(dst)
+            os.symlink(target, dst)
+        return dst, True
+
+    if _identical(src, dst):
+        log.debug("not copying %s (unchanged)", src)
+        return dst, False
+
+    if hardlink is None:
+        # a hard link shares mode and times
+        hardlink = preserve_mode and preserve_times and _is_native(src)
+
+    if dry_run:
+        if verbose:
+            log.info("copying %s -> %s", src, dst)
+        return dst, True
+
+    # replace so that a DSO already loaded is not modified.
+    with _atomic(dst) as tmp:
+        how = _place(src, tmp, hardlink, preserve_mode, preserve_times)
+        if verbose:
+            log.info("%s %s -> %s", how, src, dst)
+    return dst, True
+
+def stage_tree(src, dst, verbose=1, dry_run=0):
+    """Place a copy of a directory tree.  Symlinks are preserved.
+    :returns: List of files under dst, like :py:func:`distutils.dir_util.copy_tree`
+    """
+    outputs = []
+    if not dry_run and not os.path.isdir(dst):
+        os.makedirs(dst)
+
+    for name in sorted(os.listdir(src)):
+        sname, dname = os.path.join(src, name), os.path.join(dst, name)
+        if name.startswith('.nfs'):
+            continue # NFS rename files
+        elif os.path.isdir(sname) and not os.path.islink(sname):
+            outputs.extend(stage_tree(sname, dname, verbose=verbose, dry_run=dry_run))
+        else:
+            stage_file(sname, dname, verbose=verbose, dry_run=dry_run)
+            outputs.append(dname)
+
+    return outputs
@@ -0,0 +1,73 @@
+# Copyright 2022  Michael Davidsaver
+# SPDX-License-Identifier: BSD
+# See LICENSE
+"""Benchmark of ProbeToolchain.eval_macros()
+
+Not collected as a test.  Run with:
+
+    python -m setuptools_dso.test.bench_probe
+"""
+from __future__ import print_function
+
+import re
+import time
+
+from .. import probe
+
+# large system headers
+_headers_c = ['stdio.h', 'stdlib.h', 'string.h', 'math.h', 'errno.h', 'limits.h', 'stdint.h', 'time.h']
+_headers_cxx = ['string', 'vector', 'map', 'iostream', 'algorithm', 'functional', 'memory', 'regex']
+
+_macros = ['EOF', 'BUFSIZ', 'RAND_MAX', 'EXIT_FAILURE', 'INT_MAX', 'LONG_MAX', 'UINT64_MAX', 'CLOCKS_PER_SEC',
+           'EINVAL', 'ENOMEM', 'M_PI', 'HUGE_VAL'] + ['NO_SUCH_MACRO_%d'%i for i in range(88)]
+
+def _legacy_scan(out, macros):
+    """Prior implementation.  Three whole output substitutions, then one search per macro.
+    """
+    out = re.sub(r'^\s*#[^\n\r]*$', '', out, 0, re.MULTILINE)
+    out = re.sub(r'^//[^\n\r]*$', '', out, 0, re.MULTILINE)
+    out = re.sub(r'/\*.*?\*/', '', out, 0, re.MULTILINE|re.DOTALL)
+    ret = []
+    for name in macros:
+        pat = r'.*void ([DU])_%(name)s = \|\|\|(.*?)\|\|\|; void X_%(name)s;.*'%{'name':name}
+        M = re.match(pat, out, re.MULTILINE|re.DOTALL)
+        du, val = M.groups()
+        ret.append((name, val.strip() if du=='D' else None))
+    return ret
+
+def _synthetic(nlines, macros):
+    out = ['# %d "big.h"\nextern int filler_%d(const char *s, /* comment */ int n);\n'%(i, i) for i in range(nlines)]
+    for i, name in enumerate(macros):
+        if i%2:
+            out.append('void U_%s = ||||||; void X_%s;\n'%(name, name))
+        else:
+            out.append('void D_%s = |||%d|||; void X_%s;\n'%(name, i, name))
+    return ''.join(out)
+
+def _time(fn, *args, **kws):
+    T0 = time.time()
+    ret = fn(*args, **kws)
+    return time.time()-T0, ret
+
+def main():
+    for nlines in (10000, 100000):
+        for nmacros in (10, 100):
+            macros = ['M%d'%i for i in range(nmacros)]
+            out = _synthetic(nlines, macros)
+            Tnew, new = _time(probe._scan_macros, out.splitlines(True), macros)
+            Told, old = _time(_legacy_scan, out, macros)
+            assert new==old, (new, old)
+            print('scan %7d lines (%5.1f MB) %3d macros: %8.4f s  (previously %8.4f s)'%(
+                  nlines, len(out)/1e6, nmacros, Tnew, Told))
+
+    T, _info = _time(lambda: probe.ProbeToolchain(cache=False).info)
+    print('ToolchainInfo: %.3f s'%T)
+
+    P = probe.ProbeToolchain(cache=False)
+    T, defs = _time(P.eval_macros, _macros, headers=_headers_c)
+    print('eval_macros() %d macros, C headers: %.3f s'%(len(_macros), T))
+    T, defs = _time(P.eval_macros, _macros, headers=_headers_c+_headers_cxx, language='c++')
+    print('eval_macros() %d macros, C++ headers: %.3f s'%(len(_macros), T))
+
+if __name__=='__main__':
+    main()
@@ -0,0 +1,76 @@
+# Copyright 2022  Michael Davidsaver
+# SPDX-License-Identifier: BSD
+# See LICENSE
+import os
+import shutil
+import tempfile
+import unittest
+
+from ..artifacts import ArtifactStore, _store_dir
+
+class TestArtifactStore(unittest.TestCase):
+    def setUp(self):
+        self.tdir = tempfile.mkdtemp()
+        self.store = ArtifactStore(os.path.join(self.tdir, 'store'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tdir, ignore_errors=True)
+
+    def _path(self, *parts):
+        return os.path.join(self.tdir, *parts)
+
+    def _write(self, name, body):
+        fname = self._path(*name.split('/'))
+        if not os.path.isdir(os.path.dirname(fname)):
+            os.makedirs(os.path.dirname(fname))
+        with open(fname, 'w') as F:
+            F.write(body)
+        return fname
+
+    def test_store_dir(self):
+        self.assertIsNone(_store_dir('0'))
+        self.assertEqual(_store_dir('/some/dir'), '/some/dir')
+        self.assertTrue(_store_dir('1').endswith('artifacts'))
+
+    def test_put_get(self):
+        key = self.store.key(['a', 1, None])
+        self.assertEqual(key, ArtifactStore(self.tdir).key(['a', 1, None]))
+        self.assertNotEqual(key, self.store.key(['a', 2, None]))
+
+        outputs = {'libx.so.1': self._path('build', 'libx.so.1'),
+                   'glibc-hwcaps/x86-64-v3/libx.so.1': self._path('build', 'glibc-hwcaps', 'x86-64-v3', 'libx.so.1')}
+        self.assertFalse(self.store.get(key, outputs))
+
+        self._write('build/libx.so.1', 'base')
+        self._write('build/glibc-hwcaps/x86-64-v3/libx.so.1', 'v3')
+        self.store.put(key, outputs)
+
+        # first entry is kept.  Linkers replace, rather than re-write, an output file
+        os.remove(self._path('build', 'libx.so.1'))
+        self._write('build/libx.so.1', 'other')
+        self.store.put(key, outputs)
+
+        dest = {'libx.so.1': self._path('other', 'libx.so.1'),
+                'glibc-hwcaps/x86-64-v3/libx.so.1': self._path('other', 'glibc-hwcaps', 'x86-64-v3', 'libx.so.1')}
+        self.assertTrue(self.store.get(key, dest))
+        with open(dest['libx.so.1']) as F:
+            self.assertEqual(F.read(), 'base')
+        with open(dest['glibc-hwcaps/x86-64-v3/libx.so.1']) as F:
+            self.assertEqual(F.read(), 'v3')
+
+        # entry lacks a file
+        self.assertFalse(self.store.get(key, {'libx.lib': self._path('other', 'libx.lib')}))
+
+    def test_not_linked(self):
+        key = self.store.key(['b'])
+        src = self._write('build/liby.so.1', 'base')
+        self.store.put(key, {'liby.so.1': src})
+        stored = os.path.join(self.store._path(key), 'liby.so.1')
+        self.assertFalse(os.path.samefile(src, stored))
+        os.utime(stored, (1000000000, 1000000000))
+
+        dst = self._path('other', 'liby.so.1')
+        self.assertTrue(self.store.get(key, {'liby.so.1': dst}))
+        self.assertFalse(os.path.samefile(dst, stored))
+        self.assertNotEqual(os.stat(dst).st_mtime, 1000000000)
+        self.assertEqual(os.stat(stored).st_mtime, 1000000000)
@@ -0,0 +1,180 @@
+# Copyright 2022  Michael Davidsaver
+# SPDX-License-Identifier: BSD
+# See LICENSE
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+try:
+    import Cython
+except ImportError:
+    Cython = None
+
+from .. import cythonjobs
+from ..dsocmd import Extension
+
+class TestDefer(unittest.TestCase):
+    def setUp(self):
+        self.tdir = tempfile.mkdtemp()
+        self.pkg = os.path.join(self.tdir, 'pkg')
+        os.mkdir(self.pkg)
+        self._write('pkg/__init__.pxd', '')
+        self._write('pkg/decl.pxd', 'include "consts.pxi"\ncdef extern int lib_val()\n')
+        self._write('pkg/consts.pxi', 'DEF MAGIC = 42\n')
+        self._write('pkg/mod.pxd', 'cdef int helper()\n')
+        self._write('pkg/mod.pyx', 'from pkg.decl cimport lib_val\ncimport libc.stdlib\n'
+                                   'cdef int helper(): return lib_val()\ndef get(): return helper()\n')
+        self._write('pkg/other.pyx', '# distutils: language = c++\ndef get(): return 1\n')
+        self._write('pkg/libs.pyx', '# distutils: libraries = m\ndef get(): return 1\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.tdir, ignore_errors=True)
+
+    def _write(self, name, body):
+        with open(os.path.join(self.tdir, name), 'w') as F:
+            F.write(body)
+
+    def _path(self, name):
+        return os.path.join(self.tdir, name)
+
+    @unittest.skipIf(Cython is None, "Cython not installed")
+    def test_depends(self):
+        deps = cythonjobs._depends(self._path('pkg/mod.pyx'), [self.tdir])
+        for name in ('pkg/consts.pxi', 'pkg/decl.pxd', 'pkg/mod.pxd'):
+            self.assertIn(self._path(name), deps)
+        # from Cython/Includes
+        self.assertTrue([dep for dep in deps if dep.endswith(os.path.join('libc', 'stdlib.pxd'))], deps)
+
+    def test_cache_dir(self):
+        # opt-in
+        orig = os.environ.pop('SETUPTOOLS_DSO_CYTHON_CACHE', None)
+        try:
+            self.assertIsNone(cythonjobs._cache_dir(None))
+            self.assertIsNone(cythonjobs._cache_dir(False))
+            self.assertEqual(cythonjobs._cache_dir('/some/dir'), '/some/dir')
+            self.assertTrue(cythonjobs._cache_dir(True).endswith('cython'))
+            os.environ['SETUPTOOLS_DSO_CYTHON_CACHE'] = '1'
+            self.assertTrue(cythonjobs._cache_dir(None).endswith('cython'))
+            os.environ['SETUPTOOLS_DSO_CYTHON_CACHE'] = '/other/dir'
+            self.assertEqual(cythonjobs._cache_dir(None), '/other/dir')
+        finally:
+            os.environ.pop('SETUPTOOLS_DSO_CYTHON_CACHE', None)
+            if orig is not None:
+                os.environ['SETUPTOOLS_DSO_CYTHON_CACHE'] = orig
+
+    def test_defer(self):
+        ext = Extension('pkg.other', [self._path('pkg/other.pyx')])
+        self.assertTrue(cythonjobs.defer_extension(ext, {'language_level':3}))
+        self.assertEqual(ext.language, 'c++')
+        self.assertEqual(ext.cython_options['language'], 'c++')
+        self.assertEqual(cythonjobs._args(ext.cython_options), ['--cplus', '-X', 'language_level=3'])
+
+        # not understood when deferring
+        ext = Extension('pkg.libs', [self._path('pkg/libs.pyx')])
+        self.assertFalse(cythonjobs.defer_extension(ext, {}))
+        ext = Extension('pkg.mod', [self._path('pkg/mod.pyx')])
+        self.assertFalse(cythonjobs.defer_extension(ext, {'annotate':True}))
+
+    @unittest.skipIf(Cython is None, "Cython not installed")
+    def test_generate(self):
+        cache = self._path('cache')
+        ext = Extension('pkg.mod', [self._path('pkg/mod.pyx')])
+        self.assertTrue(cythonjobs.defer_extension(ext, {'include_path':[self.tdir], 'cache':cache}))
+        opts = ext.cython_options
+
+        cythonjobs.cythonize_extension(ext)
+        self.assertEqual(ext.sources, [self._path('pkg/mod.c')])
+        self.assertTrue(os.path.isfile(self._path('pkg/mod.c')))
+        self.assertEqual(len(os.listdir(cache)), 1)
+
+    @unittest.skipIf(Cython is None, "Cython not installed")
+    def test_sys_path_pxd(self):
+        # a .pxd found through sys.path.  eg. numpy/__init__.pxd
+        site = self._path('site')
+        os.makedirs(os.path.join(site, 'other'))
+        self._write('site/other/__init__.pxd', 'cdef enum:\n    OTHER_VAL = 1\n')
+        self._write('pkg/user.pyx', 'from other cimport OTHER_VAL\ndef get(): return OTHER_VAL\n')
+        cache = self._path('cache')
+        # for this process, and for the Cython process
+        sys.path.insert(0, site)
+        orig = os.environ.get('PYTHONPATH')
+        os.environ['PYTHONPATH'] = os.pathsep.join([site] + ([orig] if orig else []))
+        try:
+            def generate():
+                ext = Extension('pkg.user', [self._path('pkg/user.pyx')])
+                self.assertTrue(cythonjobs.defer_extension(ext, {'language_level':3, 'cache':cache}))
+                if os.path.exists(self._path('pkg/user.c')):
+                    os.remove(self._path('pkg/user.c'))
+                cythonjobs.cythonize_extension(ext)
+                with open(self._path('pkg/user.c')) as F:
+                    return F.read()
+
+            self.assertIn('OTHER_VAL = 1', generate())
+            self._write('site/other/__init__.pxd', 'cdef enum:\n    OTHER_VAL = 2\n')
+            # not the stale cache entry
+            self.assertIn('OTHER_VAL = 2', generate())
+        finally:
+            sys.path.remove(site)
+            if orig is None:
+                del os.environ['PYTHONPATH']
+            else:
+                os.environ['PYTHONPATH'] = orig
+
+        # from cache
+        os.remove(self._path('pkg/mod.c'))
+        ext = Extension('pkg.mod', [self._path('pkg/mod.pyx')])
+        ext.cython_options = opts
+        cythonjobs.cythonize_extension(ext)
+        self.assertTrue(os.path.isfile(self._path('pkg/mod.c')))
+        self.assertEqual(len(os.listdir(cache)), 1)
+
+    @unittest.skipIf(Cython is None, "Cython not installed")
+    def test_sys_path_pxd(self):
+        # a .pxd found through sys.path.  eg. numpy/__init__.pxd
+        site = self._path('site')
+        os.makedirs(os.path.join(site, 'other'))
+        self._write('site/other/__init__.pxd', 'cdef enum:\n    OTHER_VAL = 1\n')
+        self._write('pkg/user.pyx', 'from other cimport OTHER_VAL\ndef get(): return OTHER_VAL\n')
+        cache = self._path('cache')
+        # for this process, and for the Cython process
+        sys.path.insert(0, site)
+        orig = os.environ.get('PYTHONPATH')
+        os.environ['PYTHONPATH'] = os.pathsep.join([site] + ([orig] if orig else []))
+        try:
+            def generate():
+                ext = Extension('pkg.user', [self._path('pkg/user.pyx')])
+                self.assertTrue(cythonjobs.defer_extension(ext, {'language_level':3, 'cache':cache}))
+                if os.path.exists(self._path('pkg/user.c')):
+                    os.remove(self._path('pkg/user.c'))
+                cythonjobs.cythonize_extension(ext)
+                with open(self._path('pkg/user.c')) as F:
+                    return F.read()
+
+            self.assertIn('OTHER_VAL = 1', generate())
+            self._write('site/other/__init__.pxd', 'cdef enum:\n    OTHER_VAL = 2\n')
+            # not the stale cache entry
+            self.assertIn('OTHER_VAL = 2', generate())
+        finally:
+            sys.path.remove(site)
+            if orig is None:
+                del os.environ['PYTHONPATH']
+            else:
+                os.environ['PYTHONPATH'] = orig
+
+    def test_cache_passthrough(self):
+        # cache= of a cythonize() which is not deferred is Cython's own option
+        import setuptools_dso
+        seen = []
+        orig = setuptools_dso._cythonize
+        def fake(exts, **kws):
+            seen.append(kws)
+            return exts
+        setuptools_dso._cythonize = fake
+        try:
+            setuptools_dso.cythonize([Extension('pkg.mod', [self._path('pkg/mod.pyx')])], cache=True)
+            setuptools_dso.cythonize([Extension('pkg.libs', [self._path('pkg/libs.pyx')])], defer=True, cache=True)
+        finally:
+            setuptools_dso._cythonize = orig
+        self.assertEqual(seen, [{'cache':True}, {'cache':True}])
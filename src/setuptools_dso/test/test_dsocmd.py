@@ -0,0 +1,105 @@
+# Copyright 2022  Michael Davidsaver
+# SPDX-License-Identifier: BSD
+# See LICENSE
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+from .. import runtime
+from ..compiler import new_compiler
+from ..dsocmd import DSO, Extension, build_dso, build_ext
+
+@unittest.skipIf(sys.platform in ('win32', 'darwin'), "ELF library names")
+class TestDso2Lib(unittest.TestCase):
+    def setUp(self):
+        from setuptools import Distribution
+        self.tdir = tempfile.mkdtemp()
+        self.dist = Distribution({'name':'pkg', 'packages':[],
+                                  'cmdclass':{'build_dso':build_dso, 'build_ext':build_ext}})
+        self.dist.x_dsos = []
+        self.cmd = self.dist.get_command_obj('build_ext')
+        self.cmd.build_lib = os.path.join(self.tdir, 'build')
+        self.cmd.ensure_finalized()
+        self.dist.get_command_obj('build_dso').dsos = self.dist.x_dsos
+
+    def tearDown(self):
+        runtime._manifests.clear()
+        shutil.rmtree(self.tdir, ignore_errors=True)
+
+    def _touch(self, *parts):
+        fname = os.path.join(self.tdir, *parts)
+        if not os.path.isdir(os.path.dirname(fname)):
+            os.makedirs(os.path.dirname(fname))
+        with open(fname, 'w'):
+            pass
+        return fname
+
+    def test_versioned_local(self):
+        # only the soversion qualified file.  eg. build_dso --artifact-store
+        self.dist.x_dsos.append(DSO('dsotestlocal.lib', [], soversion='2'))
+        self._touch('build', 'dsotestlocal', 'liblib.so.10')
+        fname = self._touch('build', 'dsotestlocal', 'liblib.so.2')
+
+        ext = Extension('dsotestlocal.ext', [], dsos=['dsotestlocal.lib'])
+        self.cmd.dso2lib_pre(ext)
+        self.assertEqual(ext.extra_objects, [fname])
+
+    def test_versioned_installed(self):
+        # eg. installed from a wheel, which omits the soversion alias
+        self._touch('site', 'dsotestinst', '__init__.py')
+        self._touch('site', 'dsotestinst', 'sub', '__init__.py')
+        with open(self._touch('site', 'dsotestinst', 'sub', '_dsomanifest.py'), 'w') as F:
+            F.write('dsos = %r\n'%({'dsotestinst.sub.lib': {'libname':'liblib.so', 'soname':'liblib.so.2',
+                                                            'depends':[], 'closure':['dsotestinst.sub.lib']}},))
+        self._touch('site', 'dsotestinst', 'sub', 'liblib.so.10')
+        fname = self._touch('site', 'dsotestinst', 'sub', 'liblib.so.2')
+
+        sys.path.insert(0, os.path.join(self.tdir, 'site'))
+        try:
+            ext = Extension('pkg.ext', [], dsos=['dsotestinst.sub.lib'])
+            self.cmd.dso2lib_pre(ext)
+        finally:
+            sys.path.remove(os.path.join(self.tdir, 'site'))
+            for name in list(sys.modules):
+                if name.startswith('dsotestinst'):
+                    del sys.modules[name]
+        self.assertEqual(ext.extra_objects, [fname])
+
+    def test_rebuild(self):
+        # watching re-builds with the lists given to setup().  eg. no duplicate -Wl,-rpath
+        self.dist.x_dsos.append(DSO('dsotestlocal.lib', []))
+        self._touch('build', 'dsotestlocal', 'liblib.so')
+        ext = Extension('dsotestlocal.ext', [], dsos=['dsotestlocal.lib'], extra_link_args=['-g'])
+        self.cmd.extensions = [ext]
+
+        def build_extensions():
+            for E in self.cmd.extensions:
+                self.cmd._prepare_extension(E)
+                self.cmd.dso2lib_pre(E)
+        self.cmd.build_extensions = build_extensions
+        build_extensions()
+        first = (list(ext.extra_link_args), list(ext.libraries), list(ext.library_dirs))
+        self.assertEqual(ext.extra_link_args[0], '-g')
+
+        bdso = self.cmd.get_finalized_command('build_dso')
+        for _i in range(2):
+            bdso._rebuild({'dsotestlocal.ext': None}, self.cmd)
+            self.assertEqual((ext.extra_link_args, ext.libraries, ext.library_dirs), first)
+
+    def test_static(self):
+        # what an archive, and the archives it uses, would have been linked against
+        self.dist.x_dsos.extend([
+            DSO('dsotestlocal.helper', [], kind='static', libraries=['m'], library_dirs=[self.tdir],
+                extra_link_args=['-pthread'], dsos=['dsotestlocal.inner']),
+            DSO('dsotestlocal.inner', [], kind='static', libraries=['z'], extra_link_args=['-Wl,--as-needed']),
+        ])
+        ext = Extension('dsotestlocal.ext', [], dsos=['dsotestlocal.helper'])
+        self.cmd.compiler = new_compiler()
+        self.cmd.dso2lib_pre(ext)
+
+        self.assertEqual(ext.extra_objects, [self.cmd._static_lib(D) for D in self.dist.x_dsos])
+        self.assertEqual(ext.libraries, ['m', 'z'])
+        self.assertIn(self.tdir, ext.library_dirs)
+        self.assertEqual(ext.extra_link_args, ['-pthread', '-Wl,--as-needed'])
@@ -0,0 +1,210 @@
+# Copyright 2022  Michael Davidsaver
+# SPDX-License-Identifier: BSD
+# See LICENSE
+import os
+import sys
+import stat
+import socket
+import shutil
+import tempfile
+import threading
+import unittest
+
+from .. import executor
+from ..compiler import new_compiler
+from .. import worker as _worker
+from ..worker import Worker, allowed_arg
+
+@unittest.skipIf(sys.platform=='win32', "needs gcc or clang")
+class TestRemote(unittest.TestCase):
+    def setUp(self):
+        self.tdir = tempfile.mkdtemp()
+        os.environ['SETUPTOOLS_DSO_WORKER_TOKEN'] = 'sekret'
+        self.worker = Worker(bind='127.0.0.1:0', njobs=2)
+        self.T = threading.Thread(target=self.worker.serve_forever)
+        self.T.daemon = True
+        self.T.start()
+
+        self.sources = []
+        for i in range(4):
+            src = os.path.join(self.tdir, 'src%d.c'%i)
+            with open(src, 'w') as F:
+                F.write('#include "defs.h"\nint probe_%d(void) { return MAGIC+%d; }\n'%(i, i))
+            self.sources.append(src)
+        os.mkdir(os.path.join(self.tdir, 'inc'))
+        with open(os.path.join(self.tdir, 'inc', 'defs.h'), 'w') as F:
+            F.write('#define MAGIC VAL\n')
+
+    def tearDown(self):
+        os.environ.pop('SETUPTOOLS_DSO_WORKER_TOKEN', None)
+        self.worker.shutdown()
+        self.T.join()
+        shutil.rmtree(self.tdir, ignore_errors=True)
+
+    def _compile(self, E, out='out', **kws):
+        return E.compile(self.sources, output_dir=os.path.join(self.tdir, out),
+                         macros=[('VAL', '42')], include_dirs=[os.path.join(self.tdir, 'inc')], **kws)
+
+    def test_remote(self):
+        E = executor.RemoteExecutor(new_compiler(), [self.worker.address])
+        self.assertEqual(len(E.workers), 1)
+        objs = self._compile(E, extra_postargs=['-O1'])
+        self.assertEqual(len(objs), len(self.sources))
+        self.assertEqual(E.nremote, len(self.sources))
+        self.assertEqual(self.worker.ncompiled, len(self.sources))
+        for obj in objs:
+            self.assertTrue(os.path.isfile(obj), obj)
+
+    def test_unauthorized(self):
+        code = b'asm(".incbin \\"/etc/passwd\\"");\n'
+        for token in (None, 'wrong'):
+            reply, data = executor._request(self.worker.address, {'op':'compile', 'language':'c', 'args':[]},
+                                            code, timeout=5.0, token=token)
+            self.assertFalse(reply['ok'])
+            self.assertTrue(reply['rejected'])
+            self.assertEqual(data, b'')
+        self.assertEqual(self.worker.ncompiled, 0)
+
+        # client with the wrong token
+        E = executor.RemoteExecutor(new_compiler(), [self.worker.address], token='wrong')
+        self.assertEqual(E.workers, [])
+
+        # replaying a valid header on another connection fails
+        family, addr = _worker.parse_address(self.worker.address)
+        sock = socket.create_connection(addr, timeout=5.0)
+        try:
+            _worker.recv_msg(sock)
+            header = {'op':'info', 'protocol':_worker.PROTOCOL, 'size':0}
+            header['auth'] = _worker.auth_token('sekret', '0'*64, header)
+            _worker.send_msg(sock, header)
+            reply, _data = _worker.recv_msg(sock)
+            self.assertTrue(reply['rejected'])
+        finally:
+            sock.close()
+
+    def test_token_required(self):
+        os.environ.pop('SETUPTOOLS_DSO_WORKER_TOKEN', None)
+        self.assertRaises(RuntimeError, Worker, bind='0.0.0.0:0', njobs=1)
+        self.assertRaises(RuntimeError, Worker, bind='127.0.0.1:0', njobs=1)
+
+    @unittest.skipIf(not hasattr(socket, 'AF_UNIX'), "unix sockets")
+    def test_unix_socket(self):
+        os.environ.pop('SETUPTOOLS_DSO_WORKER_TOKEN', None)
+        tdir = tempfile.mkdtemp()
+        try:
+            W = Worker(bind='unix:'+os.path.join(tdir, 'sock'), njobs=1)
+            try:
+                self.assertEqual(stat.S_IMODE(os.stat(os.path.join(tdir, 'sock')).st_mode) & 0o077, 0)
+            finally:
+                W.server.server_close() # not serving
+        finally:
+            shutil.rmtree(tdir, ignore_errors=True)
+
+    def test_fallback(self):
+        E = executor.RemoteExecutor(new_compiler(), [self.worker.address])
+        # a worker would not accept
+        objs = self._compile(E, extra_postargs=['-fstack-usage'])
+        self.assertEqual(E.nremote, 0)
+        for obj in objs:
+            self.assertTrue(os.path.isfile(obj), obj)
+
+        # worker gone
+        self.worker.shutdown()
+        objs = self._compile(E, out='out2')
+        self.assertEqual(E.nremote, 0)
+        for obj in objs:
+            self.assertTrue(os.path.isfile(obj), obj)
+
+    def test_select(self):
+        os.environ['SETUPTOOLS_DSO_WORKERS'] = '127.0.0.1:1,'+self.worker.address
+        try:
+            E = executor.get_executor(new_compiler())
+            self.assertIsInstance(E, executor.RemoteExecutor)
+            self.assertListEqual([W.address for W in E.workers], [self.worker.address])
+
+            os.environ['SETUPTOOLS_DSO_WORKERS'] = '127.0.0.1:1'
+            E = executor.get_executor(new_compiler())
+            self.assertIs(type(E), executor.LocalExecutor)
+        finally:
+            del os.environ['SETUPTOOLS_DSO_WORKERS']
+
+    def test_allowed(self):
+        for arg in ('-O2', '-fPIC', '-Wall', '-std=c99', '-march=x86-64-v3', '-g'):
+            self.assertTrue(allowed_arg(arg), arg)
+        for arg in ('-o', '-B/tmp', '-fplugin=evil.so', '@args', '-Wl,-rpath', '-specs=x', '-I/usr/include'):
+            self.assertFalse(allowed_arg(arg), arg)
+
+@unittest.skipIf(sys.platform in ('win32', 'darwin'), "needs gcc or clang")
+class TestBatch(unittest.TestCase):
+    def setUp(self):
+        self.tdir = tempfile.mkdtemp()
+        self.CC = new_compiler()
+        self.nspawn = 0
+        orig = self.CC.spawn
+        def spawn(cmd, **kws):
+            self.nspawn += 1
+            return orig(cmd, **kws)
+        self.CC.spawn = spawn
+        self.E = executor.LocalExecutor(self.CC, njobs=1, batch=True)
+
+    def tearDown(self):
+        shutil.rmtree(self.tdir, ignore_errors=True)
+
+    def _source(self, name, code):
+        src = os.path.join(self.tdir, name)
+        if not os.path.isdir(os.path.dirname(src)):
+            os.makedirs(os.path.dirname(src))
+        with open(src, 'w') as F:
+            F.write(code)
+        return src
+
+    def test_batch(self):
+        self.assertTrue(self.E.batch)
+        sources = [self._source('a/x.c', 'int ax(void) { return MAGIC; }\n'),
+                   self._source('b/x.c', 'int bx(void) { return MAGIC; }\n'),
+                   self._source('a/y.c', 'int ay(void) { return MAGIC; }\n'),
+                   self._source('a/z.cpp', 'int az() { return MAGIC; }\n')]
+        self.assertListEqual([[os.path.basename(src) for _obj, (src, _ext) in batch]
+                              for batch in self.E._batches([(src+'.o', (src, os.path.splitext(src)[1])) for src in sources])],
+                             [['x.c', 'y.c'], ['x.c'], ['z.cpp']])
+
+        objs = self.E.compile(sources, output_dir=os.path.join(self.tdir, 'out'), macros=[('MAGIC', '42')])
+        self.assertEqual(self.nspawn, 0)
+        self.assertEqual(len(set(objs)), len(sources))
+        for obj in objs:
+            self.assertTrue(os.path.isfile(obj), obj)
+        # each object is from the correct source
+        with open(objs[1], 'rb') as F:
+            self.assertIn(b'bx', F.read())
+
+    def test_error(self):
+        from ..compiler import CompileError
+        sources = [self._source('good.c', 'int good;\n'),
+                   self._source('bad.c', 'intentionally invalid syntax\n')]
+        self.assertRaises(CompileError, self.E.compile, sources, output_dir=os.path.join(self.tdir, 'out'))
+        # only the failed source is retried individually
+        self.assertEqual(self.nspawn, 1)
+        self.assertTrue(os.path.isfile(os.path.join(self.tdir, 'out', self.tdir.lstrip(os.sep), 'good.o')))
+
+    def test_abs_paths(self):
+        cwd = os.getcwd()
+        os.chdir(self.tdir)
+        try:
+            self._source('inc/magic.h', '#define MAGIC 42\n')
+            self._source('extra.o', '')
+            self.assertListEqual(executor._abs_paths(['-Iinc', '-isystem', 'inc', '-iquoteinc', '-include', 'inc/magic.h',
+                                                      '-x', 'c', '-O2', 'extra.o', '/abs']),
+                                 ['-I'+os.path.abspath('inc'), '-isystem', os.path.abspath('inc'),
+                                  '-iquote'+os.path.abspath('inc'), '-include', os.path.abspath('inc/magic.h'),
+                                  '-x', 'c', '-O2', os.path.abspath('extra.o'), '/abs'])
+            self.assertIsNone(executor._abs_paths(['-MD']))
+            self.assertIsNone(executor._abs_paths(['-MF', 'x.d']))
+
+            sources = [self._source('x.c', 'int x(void) { return MAGIC; }\n'),
+                       self._source('y.c', 'int y(void) { return MAGIC; }\n')]
+            objs = self.E.compile(sources, output_dir='out', extra_preargs=['-include', 'inc/magic.h'])
+            self.assertEqual(self.nspawn, 0)
+            for obj in objs:
+                self.assertTrue(os.path.isfile(obj), obj)
+        finally:
+            os.chdir(cwd)
@@ -0,0 +1,37 @@
+# Copyright 2022  Michael Davidsaver
+# SPDX-License-Identifier: BSD
+# See LICENSE
+import os
+import sys
+import subprocess
+import unittest
+
+_check = '''
+import sys
+import setuptools_dso
+setuptools_dso.find_dso, setuptools_dso.dylink_prepare_dso
+print(' '.join([mod for mod in ('setuptools', 'distutils', 'multiprocessing', 'Cython',
+                                'setuptools_dso.dsocmd', 'setuptools_dso.probe')
+                if mod in sys.modules]))
+'''
+
+@unittest.skipIf(sys.version_info < (3, 7), "needs module __getattr__")
+class TestImport(unittest.TestCase):
+    def test_runtime_only(self):
+        """Runtime use must not pull in build time dependencies
+        """
+        env = os.environ.copy()
+        topdir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        env['PYTHONPATH'] = os.pathsep.join([topdir] + [p for p in env.get('PYTHONPATH', '').split(os.pathsep) if p])
+        out = subprocess.check_output([sys.executable, '-c', _check], env=env)
+        self.assertEqual(out.decode().strip(), '')
+
+    def test_build_names(self):
+        import setuptools_dso
+        from setuptools_dso.dsocmd import DSO
+        from setuptools_dso.probe import ProbeToolchain
+        self.assertIs(setuptools_dso.DSO, DSO)
+        self.assertIs(setuptools_dso.ProbeToolchain, ProbeToolchain)
+        self.assertRaises(AttributeError, getattr, setuptools_dso, 'no_such_name')
+        for name in setuptools_dso.__all__:
+            self.assertIn(name, dir(setuptools_dso))
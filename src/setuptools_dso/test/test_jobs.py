@@ -0,0 +1,118 @@
+# Copyright 2022  Michael Davidsaver
+# SPDX-License-Identifier: BSD
+# See LICENSE
+import sys
+import time
+import threading
+import unittest
+
+from ..jobs import Scheduler, Cancelled, popen
+
+class TestScheduler(unittest.TestCase):
+    def test_deps(self):
+        S = Scheduler(4)
+        order = []
+        lock = threading.Lock()
+        def step(name, delay=0.0):
+            time.sleep(delay)
+            with lock:
+                order.append(name)
+            return name
+
+        A = S.submit(step, 'A', 0.1)
+        B = S.submit(step, 'B', 0.05)
+        C = S.submit(step, 'C', deps=[A, B, None])
+        D = S.submit(step, 'D', deps=[C])
+        S.wait()
+
+        self.assertEqual(order, ['B', 'A', 'C', 'D'])
+        self.assertEqual([J.result() for J in (A, B, C, D)], ['A', 'B', 'C', 'D'])
+
+    def test_concurrent(self):
+        S = Scheduler(2)
+        barrier = threading.Event()
+        # deadlocks unless both run concurrently
+        A = S.submit(barrier.wait, 5.0)
+        B = S.submit(barrier.set)
+        S.wait()
+        self.assertTrue(A.result())
+
+    def test_free_slots(self):
+        S = Scheduler(3)
+        self.assertEqual(S.free_slots(), 3)
+        started, release = threading.Semaphore(0), threading.Event()
+        def block():
+            started.release()
+            release.wait(5.0)
+        S.submit(block)
+        started.acquire()
+        self.assertEqual(S.free_slots(), 2)
+        S.submit(block)
+        S.submit(block)
+        started.acquire()
+        started.acquire()
+        self.assertEqual(S.free_slots(), 1) # never less
+        release.set()
+        S.wait()
+
+    def test_keep_going(self):
+        S = Scheduler(2, keep_going=True)
+        ran = []
+        def fail(msg):
+            raise RuntimeError(msg)
+        A = S.submit(fail, 'oops')
+        B = S.submit(ran.append, 'B', deps=[A])
+        C = S.submit(ran.append, 'C')
+        E = S.submit(fail, 'again', deps=[C])
+
+        # raise the first failure
+        try:
+            S.wait()
+            self.fail("not raised")
+        except RuntimeError as e:
+            self.assertEqual(str(e), 'oops')
+        S.wait(check=False)
+
+        self.assertTrue(A.failed())
+        self.assertTrue(B.failed())
+        self.assertIs(B.exception(), A.exception())
+        self.assertRaises(RuntimeError, B.result)
+        self.assertFalse(C.failed())
+        self.assertTrue(E.failed())
+        self.assertEqual(ran, ['C'])
+
+        # dependency already failed
+        D = S.submit(ran.append, 'D', deps=[A])
+        self.assertTrue(D.failed())
+        self.assertEqual(ran, ['C'])
+
+    def test_fail_fast(self):
+        S = Scheduler(1)
+        ran = []
+        def fail():
+            raise RuntimeError('oops')
+        A = S.submit(fail)
+        B = S.submit(ran.append, 'B') # queued behind A
+        self.assertRaises(RuntimeError, S.wait)
+
+        self.assertIsInstance(B.exception(), Cancelled)
+        self.assertIsInstance(S.submit(ran.append, 'C').exception(), Cancelled)
+        self.assertEqual(ran, [])
+
+    def test_kill(self):
+        S = Scheduler(2)
+        started = threading.Event()
+        def sleep():
+            P = popen([sys.executable, '-c', 'import time; time.sleep(30)'])
+            started.set()
+            return P.wait()
+        def fail():
+            started.wait(5.0)
+            raise RuntimeError('oops')
+        A = S.submit(sleep)
+        B = S.submit(fail)
+
+        T0 = time.time()
+        self.assertRaises(RuntimeError, S.wait)
+        self.assertLess(time.time()-T0, 10.0)
+        self.assertNotEqual(A.result(), 0)
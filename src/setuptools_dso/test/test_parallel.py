@@ -1,12 +1,141 @@
 # Copyright 2022  Michael Davidsaver
 # SPDX-License-Identifier: BSD
 # See LICENSE
-
+import os
+import shutil
+import tempfile
 import unittest
 
-from ..dsocmd import _system_concurrency
+from ..dsocmd import _system_concurrency, DSO, Extension, build, build_dso, build_ext
+from ..jobs import Scheduler
 
 class TestFindConcur(unittest.TestCase):
     def test_system_concurrency(self):
         njobs = _system_concurrency()
         self.assertGreaterEqual(njobs, 1)
+
+class TestBuild(unittest.TestCase):
+    def setUp(self):
+        self.tdir = tempfile.mkdtemp()
+        self.cwd = os.getcwd()
+        os.mkdir(os.path.join(self.tdir, 'pkg'))
+        for name, body in [('pkg/__init__.py', ''),
+                           ('lib.c', 'int lib_val(void) { return 42; }\n'),
+                           ('ext.c', '#include <Python.h>\nint lib_val(void);\n'
+                                     'static struct PyModuleDef def = {PyModuleDef_HEAD_INIT, "ext", NULL, -1, NULL};\n'
+                                     'PyMODINIT_FUNC PyInit_ext(void) { return PyModule_Create(&def); }\n')]:
+            with open(os.path.join(self.tdir, name), 'w') as F:
+                F.write(body)
+        os.chdir(self.tdir)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tdir, ignore_errors=True)
+
+    def test_build(self):
+        from setuptools import Distribution
+        dist = Distribution({
+            'name':'pkg',
+            'packages':['pkg'],
+            'ext_modules':[Extension('pkg.ext', ['ext.c'], dsos=['pkg.lib'])],
+            'cmdclass':{'build':build, 'build_dso':build_dso, 'build_ext':build_ext},
+        })
+        dist.script_name = 'setup.py'
+        dist.x_dsos = [DSO('pkg.lib', ['lib.c'])]
+
+        waits = []
+        orig = Scheduler.wait
+        def wait(S, check=True):
+            waits.append((S, [J.name for J in S._jobs]))
+            return orig(S, check)
+        Scheduler.wait = wait
+        try:
+            dist.run_command('build')
+        finally:
+            Scheduler.wait = orig
+
+        bdso, bext = dist.get_command_obj('build_dso'), dist.get_command_obj('build_ext')
+        self.assertIs(bdso.scheduler, bext.scheduler)
+        self.assertEqual(set([S for S, _names in waits]), set([bext.scheduler]))
+        # nothing waited for until the Extension was also submitted
+        self.assertIn('compile pkg.ext', waits[0][1])
+        self.assertIn('link pkg.lib', waits[0][1])
+        self.assertTrue(os.path.isfile(bext.get_ext_fullpath('pkg.ext')))
+
+    def test_artifact_key(self):
+        # the key of a DSO changes with any local DSO it is linked against
+        from setuptools import Distribution
+        with open('user.c', 'w') as F:
+            F.write('int lib_val(void);\nint user_val(void) { return lib_val(); }\n')
+
+        def key(val):
+            with open('lib.c', 'w') as F:
+                F.write('int lib_val(void) { return %d; }\n'%val)
+            dist = Distribution({'name':'pkg', 'packages':['pkg'],
+                                 'cmdclass':{'build_dso':build_dso, 'build_ext':build_ext}})
+            dist.x_dsos = [DSO('pkg.lib', ['lib.c']), DSO('pkg.user', ['user.c'], dsos=['pkg.lib'])]
+            cmd = dist.get_command_obj('build_dso')
+            cmd.artifact_store = os.path.join(self.tdir, 'store')
+            cmd.force = True # computes keys of up-to-date DSOs
+            dist.run_command('build_dso')
+            return cmd._keys['pkg.user'].result()
+
+        K1 = key(1)
+        self.assertIsNotNone(K1)
+        self.assertNotEqual(K1, key(2))
+        self.assertEqual(K1, key(1))
+
+    def test_library_compiler(self):
+        # each job has its own compiler.  shlib_compiler for a Library, as setuptools
+        from setuptools import Distribution
+        from setuptools.extension import Library
+        from ..compiler import new_compiler
+
+        dist = Distribution({'name':'pkg', 'cmdclass':{'build_ext':build_ext}})
+        cmd = dist.get_command_obj('build_ext')
+        cmd.ensure_finalized()
+        cmd.compiler, cmd.shlib_compiler = new_compiler(), new_compiler()
+        cmd.shlib_compiler.which = 'shlib'
+
+        lib, ext = Library('pkg.lib', ['lib.c']), Extension('pkg.ext', ['ext.c'])
+        C1, C2 = cmd._ext_compiler(lib), cmd._ext_compiler(ext)
+        self.assertEqual(getattr(C1, 'which', None), 'shlib')
+        self.assertIsNone(getattr(C2, 'which', None))
+        self.assertIsNot(C1, cmd.shlib_compiler)
+        self.assertIsNot(C2, cmd.compiler)
+        C2.compiler_so.append('-DJOB_ONLY')
+        self.assertNotIn('-DJOB_ONLY', cmd.compiler.compiler_so)
+
+    def test_preprocess_digest(self):
+        # preprocessed again only when the source, or a header it includes, changes
+        from setuptools import Distribution
+        with open('lib.h', 'w') as F:
+            F.write('#define VAL 42\n')
+        with open('lib.c', 'w') as F:
+            F.write('#include "lib.h"\nint lib_val(void) { return VAL; }\n')
+        dist = Distribution({'name':'pkg', 'packages':['pkg'],
+                             'cmdclass':{'build_dso':build_dso, 'build_ext':build_ext}})
+        dist.x_dsos = [DSO('pkg.lib', ['lib.c'])]
+        cmd = dist.get_command_obj('build_dso')
+        dist.run_command('build_dso')
+
+        calls = []
+        orig = cmd.compiler.preprocess
+        def preprocess(*args, **kws):
+            calls.append(args[0])
+            return orig(*args, **kws)
+        cmd.compiler.preprocess = preprocess
+
+        D1 = cmd._preprocess_digest('lib.c', [], ['.'], [])
+        self.assertIsNotNone(D1)
+        self.assertEqual(cmd._preprocess_digest('lib.c', [], ['.'], []), D1)
+        self.assertEqual(len(calls), 1)
+
+        with open('lib.h', 'w') as F:
+            F.write('#define VAL 4242\n')
+        D2 = cmd._preprocess_digest('lib.c', [], ['.'], [])
+        self.assertEqual(len(calls), 2)
+        self.assertNotEqual(D1, D2)
+
+        cmd._preprocess_digest('lib.c', [('X', '1')], ['.'], [])
+        self.assertEqual(len(calls), 3)
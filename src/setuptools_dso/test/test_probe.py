@@ -2,6 +2,9 @@
 # SPDX-License-Identifier: BSD
 # See LICENSE
 import os
+import sys
+import shutil
+import tempfile
 import unittest
 
 from .. import probe
@@ -23,6 +26,11 @@ class TryCompile(unittest.TestCase):
         self.assertTrue(self.probe.check_symbol('abort', headers=['stdlib.h']))
         self.assertFalse(self.probe.check_symbol('intentionally_undeclared_symbol', headers=['stdlib.h']))
 
+    def test_try_link(self):
+        self.assertTrue(self.probe.try_link('int probe_link(void) { return 0; }'))
+        self.assertFalse(self.probe.try_link('int probe_link(void) { return 0; }',
+                                             extra_link_args=['-Wl,--intentionally-invalid-option']))
+
     def test_macros(self):
         inp = os.path.join(self.probe.tempdir, 'defs.h')
         with open(inp, 'w') as F:
@@ -49,6 +57,23 @@ is a test
             ('MULTILINE', 'this is a test'),
         ])
 
+    def test_scan(self):
+        # MSVC style output, with comments and line breaks
+        out = """#line 1 "defs.h"
+int unrelated = a || b;
+/* |||not a marker||| */
+void D_FOO = |||
+  42 /* answer */|||; void X_FOO;
+#line 7
+void U_BAR = ||||||; void X_BAR; void D_BAZ = |||"x"|||; void X_BAZ;
+"""
+        self.assertListEqual(probe._scan_macros(out.splitlines(True), ['BAZ', 'FOO', 'BAR']), [
+            ('BAZ', '"x"'),
+            ('FOO', '42'),
+            ('BAR', None),
+        ])
+        self.assertRaises(RuntimeError, probe._scan_macros, out.splitlines(True), ['MISSING'])
+
     def test_predef(self):
         # self ID for supported compilers
         defs = self.probe.eval_macros(['__GNUC__', '__clang__', '_MSC_VER'])
@@ -74,3 +99,207 @@ is a test
         self.assertIn(info.target_arch, ("aarch64", "arm32", "amd64", "i386"))
         self.assertIn(info.address_width, (32, 64))
         self.assertIn(info.endian, ("little", "big"))
+
+class TestCache(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        self.cdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.cdir, ignore_errors=True)
+
+    def test_cache(self):
+        P = probe.ProbeToolchain(cache=self.cdir)
+        expect = (P.try_compile('#include <stdlib.h>'),
+                  P.check_include('no-such-header.h'),
+                  P.sizeof('short'),
+                  P.eval_macros(['__GNUC__', '_MSC_VER']),
+                  repr(P.info))
+
+        P = probe.ProbeToolchain(cache=self.cdir)
+        def nope(*args, **kws):
+            raise AssertionError("Compiler invoked with %r"%(args,))
+        P.compiler.spawn = nope
+        P.compiler.compile = nope
+        P.compiler.preprocess = nope
+        self.assertEqual(expect, (P.try_compile('#include <stdlib.h>'),
+                                  P.check_include('no-such-header.h'),
+                                  P.sizeof('short'),
+                                  P.eval_macros(['__GNUC__', '_MSC_VER']),
+                                  repr(P.info)))
+        self.assertRaises(AssertionError, P.try_compile, 'int uncached;')
+
+        probe.clear_cache(self.cdir)
+        self.assertFalse(os.path.exists(self.cdir))
+
+    @unittest.skipIf(sys.platform=='win32', "needs gcc or clang")
+    def test_header_edit(self):
+        inc = os.path.join(self.cdir, 'inc')
+        os.mkdir(inc)
+        hdr = os.path.join(inc, 'probe_hdr.h')
+        src = '#include "probe_hdr.h"\nint probe_arr[PROBE_LEN];\n'
+
+        def edit(val):
+            dstamp = os.stat(inc)
+            with open(hdr, 'w') as F:
+                F.write('#define PROBE_LEN %d\n'%val)
+            # an edit in place does not change the directory
+            os.utime(inc, (dstamp.st_atime, dstamp.st_mtime))
+
+        edit(1)
+        self.assertTrue(probe.ProbeToolchain(cache=self.cdir).try_compile(src, include_dirs=[inc]))
+        self.assertTrue(probe.ProbeToolchain(cache=self.cdir).try_compile(src, include_dirs=[inc]))
+
+        edit(-1)
+        S = os.stat(hdr)
+        os.utime(hdr, (S.st_atime, S.st_mtime+10))
+        self.assertFalse(probe.ProbeToolchain(cache=self.cdir).try_compile(src, include_dirs=[inc]))
+
+class TestBatch(unittest.TestCase):
+    def setUp(self):
+        self.probe = probe.ProbeToolchain(cache=False)
+        self.ncompile = 0
+        orig = self.probe.compiler.compile
+        def compile(*args, **kws):
+            self.ncompile += 1
+            return orig(*args, **kws)
+        self.probe.compiler.compile = compile
+
+    def test_headers(self):
+        headers = ['stdlib.h', 'no-such-header.h', 'stdio.h', 'string.h', 'also-missing.h']
+        ret = self.probe.check_headers(headers)
+        self.assertListEqual(list(ret.items()), [(h, self.probe.check_include(h)) for h in headers])
+
+    def test_symbols(self):
+        syms = ['RAND_MAX', 'abort', 'malloc', 'free', 'calloc', 'realloc', 'exit', 'atexit',
+                'intentionally_undeclared_symbol', 'getenv', 'qsort', 'bsearch', 'abs', 'labs', 'atoi', 'atol']
+        self.ncompile = 0
+        ret = self.probe.check_symbols(syms, headers=['stdlib.h'])
+        self.assertLess(self.ncompile, len(syms))
+        self.assertListEqual(list(ret.items()), [(S, self.probe.check_symbol(S, headers=['stdlib.h'])) for S in syms])
+
+    def test_members(self):
+        members = [('struct tm', 'tm_sec'), ('struct tm', 'no_such_member'), ('struct tm', 'tm_year')]
+        ret = self.probe.check_members(members, headers=['time.h'])
+        self.assertListEqual(list(ret.items()), [(M, self.probe.check_member(M[0], M[1], headers=['time.h'])) for M in members])
+
+    def test_layout(self):
+        self.ncompile = 0
+        sizes = self.probe.sizeof_many(['char', 'unsigned char', 'short', 'void*', 'struct tm', 'struct timespec'],
+                                       headers=['time.h'])
+        self.assertLessEqual(self.ncompile, 1)
+        self.assertEqual(sizes['char'], 1)
+        self.assertEqual(sizes['unsigned char'], 1)
+        self.assertEqual(sizes['short'], 2)
+        self.assertIn(sizes['void*'], (4, 8))
+        self.assertGreaterEqual(sizes['struct tm'], 9*4)
+
+        # compiled, bypassing predefined macros
+        self.assertEqual(self.probe._layout(['sizeof(short)', 'sizeof(void*)', 'sizeof(struct tm)'], headers=['time.h']),
+                         [sizes['short'], sizes['void*'], sizes['struct tm']])
+
+        self.ncompile = 0
+        aligns = self.probe.alignof_many(['char', 'short', 'struct timespec'], headers=['time.h'])
+        self.assertEqual(self.ncompile, 1)
+        self.assertListEqual(list(aligns.items())[:2], [('char', 1), ('short', 2)])
+        self.assertIn(self.probe.alignof('double'), (4, 8))
+
+        # type names which can not precede a member name
+        ptr = self.probe.alignof('void*')
+        aligns = self.probe.alignof_many(['int[4]', 'void (*)(void)', 'char[3]'])
+        self.assertListEqual(list(aligns.items()), [('int[4]', self.probe.alignof('int')),
+                                                    ('void (*)(void)', ptr), ('char[3]', 1)])
+        self.assertEqual(self.probe.alignof('int[4]', language='c++'), self.probe.alignof('int'))
+
+        members = [('struct tm', 'tm_sec'), ('struct timespec', 'tv_sec'), ('struct timespec', 'tv_nsec')]
+        self.ncompile = 0
+        offsets = self.probe.offsetof_many(members, headers=['time.h'])
+        self.assertEqual(self.ncompile, 1)
+        self.assertListEqual(list(offsets.items()), [
+            (members[0], 0),
+            (members[1], 0),
+            (members[2], sizes['struct timespec']//2),
+        ])
+        self.assertEqual(self.probe.offsetof('struct tm', 'tm_min', headers=['time.h']), 4)
+
+    def test_predefined_sizeof(self):
+        self.assertEqual(probe._predefined_sizeof('unsigned long int'), '__SIZEOF_LONG__')
+        self.assertEqual(probe._predefined_sizeof('std::string *'), '__SIZEOF_POINTER__')
+        self.assertEqual(probe._predefined_sizeof('int Foo::* *'), '__SIZEOF_POINTER__')
+        # pointers to member are compiled
+        self.assertIsNone(probe._predefined_sizeof('int Foo::*'))
+        self.assertIsNone(probe._predefined_sizeof('int (Foo::*)(int)'))
+
+class TestSession(unittest.TestCase):
+    def test_shared(self):
+        A = probe.ProbeToolchain(headers=['stdlib.h'])
+        B = probe.ProbeToolchain(define_macros=[('FOO', '1')])
+        self.assertIs(A._session, B._session)
+        self.assertIs(A._session, probe.get_session())
+        self.assertEqual(A.tempdir, B.tempdir)
+        # info is computed with the headers and macros of each
+        self.assertIsNot(A.info, B.info)
+        self.assertIs(A.info, probe.ProbeToolchain(headers=['stdlib.h']).info)
+
+        # each has an independent compiler
+        self.assertIsNot(A.compiler, B.compiler)
+        A.compiler.compiler_so.append('-DPROBE_TEST_ONLY')
+        self.assertNotIn('-DPROBE_TEST_ONLY', B.compiler.compiler_so)
+        self.assertNotIn('-DPROBE_TEST_ONLY', A._session.compiler.compiler_so)
+
+        # scratch files do not collide
+        self.assertTrue(A.try_compile('int a;'))
+        self.assertTrue(B.try_compile('int b;'))
+        self.assertEqual(A.eval_macros('FOO')['FOO'], None)
+        self.assertEqual(B.eval_macros('FOO')['FOO'], '1')
+
+    def test_copy(self):
+        from ..compiler import new_compiler, copy_compiler
+        orig = new_compiler()
+        CC = copy_compiler(orig, verbose=True)
+        self.assertTrue(CC.verbose)
+        for name, val in vars(CC).items():
+            if isinstance(val, list) and val:
+                self.assertIsNot(val, getattr(orig, name))
+            fn = getattr(val, 'func', val)
+            self.assertIsNot(getattr(fn, '__self__', None), orig, name)
+            for arg in getattr(val, 'args', ()):
+                self.assertIsNot(getattr(arg, '__self__', None), orig, name)
+
+class TestParallel(unittest.TestCase):
+    def test_parallel(self):
+        from functools import partial
+        P = probe.ProbeToolchain(cache=False)
+        probes = [
+            partial(P.check_include, 'stdlib.h'),
+            partial(P.check_include, 'no-such-header.h'),
+            partial(P.sizeof, 'short'),
+            partial(P.sizeof, 'long long'),
+            partial(P.check_symbol, 'abort', headers=['stdlib.h']),
+            partial(P.check_symbol, 'intentionally_undeclared_symbol', headers=['stdlib.h']),
+            partial(P.eval_macros, ['RAND_MAX', 'NO_SUCH_MACRO'], headers=['stdlib.h']),
+        ]
+        serial = [fn() for fn in probes]
+        for i in range(3):
+            self.assertListEqual(P.run_parallel(probes, njobs=4), serial)
+
+    def test_error(self):
+        P = probe.ProbeToolchain(cache=False)
+        def oops():
+            raise KeyError('oops')
+        self.assertRaises(KeyError, P.run_parallel, [lambda: 1, oops], njobs=2)
+
+    def test_cache(self):
+        # default for cache=None.  eg. from build_dso --probe-cache
+        sess = probe.get_session()
+        tdir = tempfile.mkdtemp()
+        try:
+            sess.cache = tdir
+            self.assertEqual(probe.ProbeToolchain()._cache.dir, tdir)
+            self.assertIsNone(probe.ProbeToolchain(cache=False)._cache)
+            sess.cache = False
+            self.assertIsNone(probe.ProbeToolchain()._cache)
+        finally:
+            sess.cache = None
+            shutil.rmtree(tdir, ignore_errors=True)
@@ -0,0 +1,415 @@
+# Copyright 2022  Michael Davidsaver
+# SPDX-License-Identifier: BSD
+# See LICENSE
+import os
+import sys
+import shutil
+import tempfile
+import threading
+import unittest
+import importlib
+
+from .. import runtime
+
+_info_template = '''
+import os
+dsoname = {dsoname!r}
+libname = {libname!r}
+soname = {soname!r}
+depends = {depends!r}
+dir = os.path.dirname(__file__)
+filename = os.path.join(dir, libname)
+sofilename = os.path.join(dir, soname)
+del dir
+del os
+'''
+
+class FakeTree(object):
+    """Populate a temporary python package with DSO info modules.
+    The DSO files themselves are empty.
+    """
+    def __init__(self, pkg, dsos, manifest=False):
+        self.pkg = pkg
+        self.root = tempfile.mkdtemp()
+        pkgdir = os.path.join(self.root, *pkg.split('.'))
+        os.makedirs(pkgdir)
+        parts = pkg.split('.')
+        for i in range(len(parts)):
+            with open(os.path.join(self.root, *(parts[:i+1]+['__init__.py'])), 'w'):
+                pass
+        for base, depends in dsos:
+            libname = 'lib%s.so'%base
+            with open(os.path.join(pkgdir, libname), 'wb'):
+                pass
+            with open(os.path.join(pkgdir, base+'_dsoinfo.py'), 'w') as F:
+                F.write(_info_template.format(dsoname='%s.%s'%(pkg, base),
+                                              libname=libname, soname=libname,
+                                              depends=['%s.%s'%(pkg, d) for d in depends]))
+        if manifest:
+            with open(os.path.join(pkgdir, '_dsomanifest.py'), 'w') as F:
+                F.write('dsos = %r\n'%dict([('%s.%s'%(pkg, base), {
+                    'libname': 'lib%s.so'%base,
+                    'soname': 'lib%s.so'%base,
+                    'depends': ['%s.%s'%(pkg, d) for d in depends],
+                    'closure': ['%s.%s'%(pkg, d) for d in [base]+depends],
+                }) for base, depends in dsos]))
+        sys.path.insert(0, self.root)
+        importlib.invalidate_caches()
+
+    def close(self):
+        sys.path.remove(self.root)
+        for name in list(sys.modules):
+            if name==self.pkg.split('.')[0] or name.startswith(self.pkg.split('.')[0]+'.'):
+                del sys.modules[name]
+        shutil.rmtree(self.root, ignore_errors=True)
+
+class TestRuntime(unittest.TestCase):
+    pkg = 'dsotestpkg.lib'
+    manifest = False
+
+    def setUp(self):
+        self.tree = FakeTree(self.pkg, [
+            ('a', ['c', 'b']), # breadth first order is not topological
+            ('b', ['c']),
+            ('c', []),
+        ], manifest=self.manifest)
+        runtime._closures.clear()
+        runtime._manifests.clear()
+
+    def tearDown(self):
+        self.tree.close()
+        runtime._closures.clear()
+        runtime._manifests.clear()
+
+    def test_auto_pkg(self):
+        def caller():
+            return runtime._auto_pkg()
+        self.assertEqual(caller(), __name__)
+
+    def test_closure(self):
+        info = runtime.dylink_prepare_dso(self.pkg+'.a')
+        self.assertEqual(info.dsoname, self.pkg+'.a')
+        self.assertIs(runtime._closures[(__name__, self.pkg+'.a')][0], info)
+        # served from memo
+        self.assertIs(runtime.dylink_prepare_dso(self.pkg+'.a'), info)
+
+        fname = runtime.find_dso(self.pkg+'.c')
+        self.assertTrue(os.path.isabs(fname), fname)
+        self.assertEqual(os.path.basename(fname), 'libc.so')
+
+    def test_relative(self):
+        self.assertEqual(runtime._resolve_name('..lib.a', 'dsotestpkg.ext'), 'dsotestpkg.lib.a')
+        info = runtime.dylink_prepare_dso('.a', package=self.pkg)
+        self.assertEqual(info.dsoname, self.pkg+'.a')
+
+    def test_lookup(self):
+        info = runtime.dylink_prepare_dso(self.pkg+'.b')
+        self.assertEqual(isinstance(info, runtime.ManifestInfo), self.manifest)
+        self.assertEqual(info.depends, [self.pkg+'.c'])
+
+class TestRuntimeManifest(TestRuntime):
+    manifest = True
+
+    def test_no_alias(self):
+        # as installed from a wheel.  only "liba.so.0"
+        pkgdir = os.path.join(self.tree.root, *self.pkg.split('.'))
+        info = runtime.ManifestInfo(self.pkg+'.a', os.path.join(pkgdir, '_dsomanifest.py'), {
+            'libname': 'liba.so',
+            'soname': 'liba.so.0',
+            'depends': [],
+            'closure': [self.pkg+'.a'],
+        })
+        self.assertEqual(info.filename, os.path.join(pkgdir, 'liba.so'))
+        with open(os.path.join(pkgdir, 'liba.so.0'), 'wb'):
+            pass
+        os.remove(os.path.join(pkgdir, 'liba.so'))
+        self.assertEqual(info.filename, os.path.join(pkgdir, 'liba.so.0'))
+
+    def test_lazy_cdll(self):
+        import ctypes
+        class FakeFn(object):
+            restype = argtypes = None
+        class FakeCDLL(object):
+            def __init__(self, name, mode):
+                loaded.append(os.path.basename(name))
+            def __getattr__(self, name):
+                return FakeFn()
+        loaded = []
+        orig, ctypes.CDLL = ctypes.CDLL, FakeCDLL
+        try:
+            lib = runtime.lazy_cdll(self.pkg+'.b', prototypes={'foo': (ctypes.c_int, [ctypes.c_char_p])})
+            self.assertListEqual(loaded, [])
+            foo = lib.foo
+            self.assertListEqual(loaded, ['libb.so'])
+            self.assertIs(lib.foo, foo)
+            self.assertIs(foo.restype, ctypes.c_int)
+            self.assertListEqual(foo.argtypes, [ctypes.c_char_p])
+            self.assertIsNone(lib.bar.restype)
+            self.assertListEqual(loaded, ['libb.so'])
+        finally:
+            ctypes.CDLL = orig
+
+    def test_preload(self):
+        import ctypes
+        loaded, events = [], []
+        def CDLL(name, mode):
+            loaded.append(os.path.basename(name))
+            events.append('load')
+            return name
+        def readahead(fname):
+            events.append('readahead')
+        orig, ctypes.CDLL = ctypes.CDLL, CDLL
+        orig_ra, runtime._readahead_one = runtime._readahead_one, readahead
+        try:
+            handles = runtime.preload([self.pkg+'.a', self.pkg+'.b'])
+            self.assertListEqual(list(runtime.preload(u''+self.pkg+'.c')), [self.pkg+'.c']) # unicode with py2
+        finally:
+            ctypes.CDLL = orig
+            runtime._readahead_one = orig_ra
+        # dependencies first
+        self.assertListEqual(loaded[:3], ['libc.so', 'libb.so', 'liba.so'])
+        self.assertListEqual(list(handles), [self.pkg+'.c', self.pkg+'.b', self.pkg+'.a'])
+        if hasattr(os, 'posix_fadvise'):
+            # the whole closure, before the first load
+            self.assertListEqual(events[:6], ['readahead']*3 + ['load']*3)
+
+class TestISA(unittest.TestCase):
+    class Info(object):
+        dsoname = 'pkg.lib.a'
+        sofilename = os.path.join(os.sep, 'site', 'pkg', 'lib', 'liba.so.0')
+        filename = os.path.join(os.sep, 'site', 'pkg', 'lib', 'liba.so')
+        isa_variants = ['x86-64-v2', 'x86-64-v3']
+
+    def setUp(self):
+        self.orig = runtime._cpu_levels
+        os.environ.pop('SETUPTOOLS_DSO_ISA', None)
+
+    def tearDown(self):
+        runtime._cpu_levels = self.orig
+        os.environ.pop('SETUPTOOLS_DSO_ISA', None)
+
+    def test_cpu(self):
+        runtime._cpu_levels = None
+        levels = runtime._cpu_isa_levels()
+        self.assertTrue(levels.issubset(['x86-64-v2', 'x86-64-v3', 'x86-64-v4']), levels)
+        self.assertIs(runtime._cpu_isa_levels(), levels)
+
+    def test_select(self):
+        info = self.Info()
+        runtime._cpu_levels = set(['x86-64-v2', 'x86-64-v3', 'x86-64-v4'])
+        self.assertEqual(runtime._isa_variant(info), 'x86-64-v3')
+        self.assertEqual(runtime._sofilename(info),
+                         os.path.join(os.sep, 'site', 'pkg', 'lib', 'glibc-hwcaps', 'x86-64-v3', 'liba.so.0'))
+        self.assertEqual(runtime._sofilename(info, so=False),
+                         os.path.join(os.sep, 'site', 'pkg', 'lib', 'glibc-hwcaps', 'x86-64-v3', 'liba.so'))
+
+        runtime._cpu_levels = set(['x86-64-v2'])
+        self.assertEqual(runtime._isa_variant(info), 'x86-64-v2')
+
+        runtime._cpu_levels = set()
+        self.assertIsNone(runtime._isa_variant(info))
+        self.assertEqual(runtime._sofilename(info), info.sofilename)
+        self.assertEqual(runtime._sofilename(info, so=False), info.filename)
+
+        os.environ['SETUPTOOLS_DSO_ISA'] = 'x86-64-v2'
+        self.assertEqual(runtime._isa_variant(info), 'x86-64-v2')
+        os.environ['SETUPTOOLS_DSO_ISA'] = 'baseline'
+        runtime._cpu_levels = set(['x86-64-v2', 'x86-64-v3'])
+        self.assertIsNone(runtime._isa_variant(info))
+
+        # info module from < 2.12
+        del os.environ['SETUPTOOLS_DSO_ISA']
+        info.isa_variants = None
+        self.assertIsNone(runtime._isa_variant(info))
+
+@unittest.skipUnless(sys.platform.startswith('linux'), "ELF only")
+class TestZip(unittest.TestCase):
+    """Load DSOs from a zip archive on sys.path
+    """
+    pkg = 'dsotestzip.lib'
+
+    def setUp(self):
+        import zipfile
+        from ..compiler import new_compiler
+        self.tdir = tempfile.mkdtemp()
+        CC = new_compiler()
+        libs = {
+            'b': ([], 'int dsotest_b(void) { return 7; }\n'),
+            'a': (['b'], 'int dsotest_b(void);\nint dsotest_a(void) { return dsotest_b()+1; }\n'),
+        }
+        self.archive = os.path.join(self.tdir, 'app.zip')
+        with zipfile.ZipFile(self.archive, 'w') as Z:
+            for name in ('__init__.py', 'lib/__init__.py'):
+                Z.writestr('dsotestzip/'+name, '')
+            for base in ('b', 'a'):
+                depends, code = libs[base]
+                src = os.path.join(self.tdir, base+'.c')
+                with open(src, 'w') as F:
+                    F.write(code)
+                objs = CC.compile([src], output_dir=self.tdir)
+                libname = 'lib%s.so'%base
+                CC.link_shared_object(objs, os.path.join(self.tdir, libname),
+                                      libraries=depends, library_dirs=[self.tdir],
+                                      extra_postargs=['-Wl,-h,'+libname])
+                Z.write(os.path.join(self.tdir, libname), 'dsotestzip/lib/'+libname)
+                Z.writestr('dsotestzip/lib/%s_dsoinfo.py'%base, _info_template.format(
+                    dsoname='%s.%s'%(self.pkg, base), libname=libname, soname=libname,
+                    depends=['%s.%s'%(self.pkg, d) for d in depends]))
+        sys.path.insert(0, self.archive)
+        importlib.invalidate_caches()
+
+    def tearDown(self):
+        sys.path.remove(self.archive)
+        for name in list(sys.modules):
+            if name.startswith('dsotestzip'):
+                del sys.modules[name]
+        runtime._closures.clear()
+        runtime._handles.clear()
+        shutil.rmtree(self.tdir, ignore_errors=True)
+
+    def _check(self):
+        import ctypes
+        fname = runtime.find_dso(self.pkg+'.a')
+        self.assertFalse(fname.startswith(self.archive), fname)
+        lib = ctypes.CDLL(fname)
+        self.assertEqual(lib.dsotest_a(), 8)
+
+    @unittest.skipUnless(hasattr(os, 'memfd_create'), "needs memfd")
+    def test_memfd(self):
+        self._check()
+        fname = runtime.find_dso(self.pkg+'.a')
+        self.assertTrue(fname.startswith('/proc/self/fd/'))
+        # one memfd per member
+        def memfds():
+            ret = set()
+            for fd in os.listdir('/proc/self/fd'):
+                try:
+                    if os.readlink('/proc/self/fd/'+fd).startswith('/memfd:'):
+                        ret.add(fd)
+                except OSError:
+                    pass # eg. the fd of listdir()
+            return ret
+        before = memfds()
+        runtime._closures.clear()
+        self.assertEqual(runtime.find_dso(self.pkg+'.a'), fname)
+        runtime.preload(self.pkg+'.a', package=self.pkg)
+        self.assertEqual(memfds(), before)
+
+    def test_extract(self):
+        os.environ['SETUPTOOLS_DSO_ZIP_EXTRACT'] = '1'
+        os.environ['SETUPTOOLS_DSO_CACHE_DIR'] = os.path.join(self.tdir, 'cache')
+        try:
+            self._check()
+            self.assertTrue(runtime.find_dso(self.pkg+'.a').startswith(os.path.join(self.tdir, 'cache')))
+        finally:
+            del os.environ['SETUPTOOLS_DSO_ZIP_EXTRACT']
+            del os.environ['SETUPTOOLS_DSO_CACHE_DIR']
+
+# stand-in for "setup.py build_ext -i --build-only=..."
+_lazy_setup = '''
+import os, sys
+top = os.path.dirname(os.path.abspath(__file__))
+for name in sys.argv[-1].split('=', 1)[1].split(','):
+    if name.endswith('.ext'):
+        fname = os.path.join(top, *name.split('.')) + '.py'
+    else:
+        fname = os.path.join(top, *name.split('.')[:-1] + ['lib%s.so.0'%name.split('.')[-1]])
+    with open(fname, 'a') as F:
+        F.write('built = True\\n')
+'''
+
+class TestLazy(unittest.TestCase):
+    pkg = 'dsotestlazy'
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.setup = os.path.join(self.root, 'setup.py')
+        with open(self.setup, 'w') as F:
+            F.write(_lazy_setup)
+        libdir = os.path.join(self.root, self.pkg, 'lib')
+        os.makedirs(libdir)
+        for name in ('__init__.py', 'lib/__init__.py'):
+            with open(os.path.join(self.root, self.pkg, name), 'w'):
+                pass
+        with open(os.path.join(libdir, '_dsomanifest.py'), 'w') as F:
+            F.write('dsos = %r\nlazy = %r\n'%({
+                self.pkg+'.lib.a': {'libname':'liba.so', 'soname':'liba.so.0', 'depends':[], 'closure':[self.pkg+'.lib.a']},
+            }, {
+                'setup': self.setup,
+                'dsos': [self.pkg+'.lib.a'],
+                'extensions': [self.pkg+'.ext'],
+            }))
+        sys.path.insert(0, self.root)
+        importlib.invalidate_caches()
+        self.meta_path = sys.meta_path[:]
+        runtime._closures.clear()
+        runtime._manifests.clear()
+
+    def tearDown(self):
+        from .. import lazy
+        sys.meta_path[:] = self.meta_path
+        lazy._projects.clear()
+        sys.path.remove(self.root)
+        for name in list(sys.modules):
+            if name.startswith(self.pkg):
+                del sys.modules[name]
+        runtime._closures.clear()
+        runtime._manifests.clear()
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def test_build(self):
+        fname = runtime.find_dso(self.pkg+'.lib.a')
+        self.assertEqual(fname, os.path.join(self.root, self.pkg, 'lib', 'liba.so.0'))
+        self.assertTrue(os.path.isfile(fname))
+        self.assertTrue(os.path.isfile(os.path.join(self.root, 'build', 'setuptools_dso-lazy.lock')))
+
+        mod = importlib.import_module(self.pkg+'.ext')
+        self.assertTrue(mod.built)
+        # not built again
+        runtime._closures.clear()
+        runtime._manifests.clear()
+        runtime.find_dso(self.pkg+'.lib.a')
+        with open(fname) as F:
+            self.assertEqual(F.read(), 'built = True\n')
+
+    def test_lock_per_name(self):
+        # a build of one DSO does not block lookups, or a build of another name, by other threads
+        from .. import lazy
+        record = {'setup': self.setup, 'dsos': [self.pkg+'.lib.a'], 'extensions': [self.pkg+'.ext']}
+        lazy.build(record, [self.pkg+'.lib.a'], check=lambda: True)
+        L = lazy._build_locks[self.pkg+'.lib.a']
+        with L:
+            done = []
+            def other():
+                lazy.register(record)
+                lazy.LazyBuildFinder().find_spec('dsotestlazy_nosuch')
+                lazy.build(record, [self.pkg+'.ext'], check=lambda: True)
+                done.append(True)
+            T = threading.Thread(target=other)
+            T.start()
+            T.join(5.0)
+            self.assertEqual(done, [True])
+        self.assertIsNot(lazy._build_locks[self.pkg+'.ext'], L)
+
+    def test_import_first(self):
+        from setuptools import Distribution
+        from ..dsocmd import DSO, Extension, build_dso, build_ext
+        dist = Distribution({
+            'cmdclass':{'build_dso':build_dso, 'build_ext':build_ext},
+            'name':self.pkg,
+            'packages':[self.pkg, self.pkg+'.lib'],
+            'ext_modules':[Extension(self.pkg+'.ext', ['ext.c'], dsos=[self.pkg+'.lib.a'])],
+            'x_dsos':[DSO(self.pkg+'.lib.a', ['a.c'])],
+        })
+        dist.script_name = self.setup
+        cmd = build_dso(dist)
+        cmd.build_lib = self.root
+        cmd.ensure_finalized()
+        cmd.lazy_dsos = True
+        cmd.gen_manifest()
+        with open(os.path.join(self.root, self.pkg, '__init__.py'), 'w') as F:
+            F.write('from .lib import _dsomanifest\n')
+
+        # no DSO looked up yet
+        mod = importlib.import_module(self.pkg+'.ext')
+        self.assertTrue(mod.built)
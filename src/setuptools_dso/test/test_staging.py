@@ -0,0 +1,83 @@
+# Copyright 2022  Michael Davidsaver
+# SPDX-License-Identifier: BSD
+# See LICENSE
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+from ..staging import stage_file, stage_tree
+
+class TestStage(unittest.TestCase):
+    def setUp(self):
+        self.tdir = tempfile.mkdtemp()
+        self.src = os.path.join(self.tdir, 'src')
+        self.dst = os.path.join(self.tdir, 'dst')
+        os.makedirs(os.path.join(self.src, 'pkg'))
+        self._write('pkg/libfoo.so.1', 'native')
+        self._write('pkg/foo_dsoinfo.py', 'info = 1\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.tdir, ignore_errors=True)
+
+    def _write(self, name, body):
+        with open(os.path.join(self.src, name), 'w') as F:
+            F.write(body)
+
+    def _read(self, name):
+        with open(os.path.join(self.dst, name), 'r') as F:
+            return F.read()
+
+    def test_file(self):
+        src, dst = os.path.join(self.src, 'pkg', 'foo_dsoinfo.py'), os.path.join(self.tdir, 'foo_dsoinfo.py')
+        self.assertEqual(stage_file(src, dst), (dst, True))
+        self.assertEqual(stage_file(src, dst), (dst, False))
+        # not hard linked
+        self._write('pkg/foo_dsoinfo.py', 'info = 2\n')
+        with open(dst, 'r') as F:
+            self.assertEqual(F.read(), 'info = 1\n')
+        self.assertEqual(stage_file(src, dst), (dst, True))
+        with open(dst, 'r') as F:
+            self.assertEqual(F.read(), 'info = 2\n')
+
+    @unittest.skipIf(sys.platform=='win32', "symlinks")
+    def test_tree(self):
+        os.symlink('libfoo.so.1', os.path.join(self.src, 'pkg', 'libfoo.so'))
+
+        out = stage_tree(self.src, self.dst)
+        self.assertEqual(sorted(out), sorted([os.path.join(self.dst, 'pkg', name)
+                                              for name in ('foo_dsoinfo.py', 'libfoo.so', 'libfoo.so.1')]))
+
+        self.assertEqual(os.readlink(os.path.join(self.dst, 'pkg', 'libfoo.so')), 'libfoo.so.1')
+        self.assertEqual(self._read('pkg/libfoo.so'), 'native')
+        self.assertEqual(self._read('pkg/foo_dsoinfo.py'), 'info = 1\n')
+
+        # replaced, not re-written, even when hard linked
+        os.remove(os.path.join(self.src, 'pkg', 'libfoo.so.1'))
+        self._write('pkg/libfoo.so.1', 'rebuilt')
+        stage_tree(self.src, self.dst)
+        self.assertEqual(self._read('pkg/libfoo.so.1'), 'rebuilt')
+
+    def test_same_stat(self):
+        src, dst = os.path.join(self.src, 'pkg', 'foo_dsoinfo.py'), os.path.join(self.tdir, 'foo_dsoinfo.py')
+        self.assertEqual(stage_file(src, dst), (dst, True))
+        # same size and mtime, different content
+        S = os.stat(src)
+        self._write('pkg/foo_dsoinfo.py', 'info = 3\n')
+        os.utime(src, (S.st_atime, S.st_mtime))
+        self.assertEqual(stage_file(src, dst), (dst, True))
+        with open(dst, 'r') as F:
+            self.assertEqual(F.read(), 'info = 3\n')
+
+    def test_preserve(self):
+        src, dst = os.path.join(self.src, 'pkg', 'libfoo.so.1'), os.path.join(self.tdir, 'libfoo.so.1')
+        os.utime(src, (1000000000, 1000000000))
+        self.assertEqual(stage_file(src, dst, preserve_times=False), (dst, True))
+        self.assertFalse(os.path.samefile(src, dst))
+        self.assertNotEqual(os.stat(dst).st_mtime, 1000000000)
+        os.remove(dst)
+
+        self.assertEqual(stage_file(src, dst, hardlink=False), (dst, True))
+        self.assertFalse(os.path.samefile(src, dst))
+        self.assertEqual(os.stat(dst).st_mtime, 1000000000)
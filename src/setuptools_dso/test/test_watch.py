@@ -0,0 +1,89 @@
+# Copyright 2022  Michael Davidsaver
+# SPDX-License-Identifier: BSD
+# See LICENSE
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from .. import watch
+from ..dsocmd import DSO, Extension, _watch_files, _affected
+
+class TestWatcher(unittest.TestCase):
+    poll = False
+
+    def setUp(self):
+        self.tdir = tempfile.mkdtemp()
+        self.fname = os.path.join(self.tdir, 'a.c')
+        with open(self.fname, 'w'):
+            pass
+        os.environ['SETUPTOOLS_DSO_WATCH_POLL'] = '1' if self.poll else '0'
+
+    def tearDown(self):
+        os.environ.pop('SETUPTOOLS_DSO_WATCH_POLL', None)
+        shutil.rmtree(self.tdir, ignore_errors=True)
+
+    def test_change(self):
+        with watch.Watcher([self.tdir], debounce=0.1) as W:
+            self.assertEqual(W.wait(timeout=0.1), set())
+
+            def edit():
+                with open(self.fname, 'w') as F:
+                    F.write('int a;\n')
+                with open(os.path.join(self.tdir, 'b.h'), 'w') as F:
+                    F.write('int b;\n')
+            T = threading.Timer(0.1, edit)
+            T.start()
+            try:
+                changed = W.wait(timeout=5.0)
+            finally:
+                T.join()
+        self.assertEqual(changed, set([self.fname, os.path.join(self.tdir, 'b.h')]))
+
+class TestWatcherPoll(TestWatcher):
+    poll = True
+
+class TestAffected(unittest.TestCase):
+    def setUp(self):
+        self.tdir = os.path.realpath(tempfile.mkdtemp())
+        for name in ('inc', 'src', 'build'):
+            os.mkdir(os.path.join(self.tdir, name))
+        # only include directories within the current directory are watched
+        self.cwd = os.getcwd()
+        os.chdir(self.tdir)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tdir, ignore_errors=True)
+
+    def _path(self, *parts):
+        return os.path.join(self.tdir, *parts)
+
+    def test_affected(self):
+        dsos = [
+            DSO('pkg.lib.helper', [self._path('src', 'helper.c')], kind='static'),
+            DSO('pkg.lib.a', [self._path('src', 'a.c'), self._path('src', 'b.c')],
+                include_dirs=[self._path('inc'), '/usr/include'], dsos=['pkg.lib.helper']),
+        ]
+        ext = Extension('pkg.ext', [self._path('ext.c')], dsos=['pkg.lib.a'])
+        targets = [(T,)+_watch_files(T, [self._path('build')]) for T in dsos+[ext]]
+
+        self.assertEqual(targets[1][2], set([self._path('src'), self._path('inc')]))
+
+        def affected(*names):
+            return _affected(targets, set([self._path(*N.split('/')) for N in names]), dsos)
+
+        # only the changed source is re-compiled
+        self.assertEqual(affected('src/b.c'), {'pkg.lib.a': set([self._path('src', 'b.c')])})
+        # header changes re-compile everything
+        self.assertEqual(affected('inc/a.h'), {'pkg.lib.a': None})
+        self.assertEqual(affected('inc/README'), {})
+        # ext is not re-linked against a shared DSO
+        self.assertEqual(affected('ext.c'), {'pkg.ext': set([self._path('ext.c')])})
+        # consumers of a static DSO are re-linked
+        self.assertEqual(affected('src/helper.c'), {
+            'pkg.lib.helper': set([self._path('src', 'helper.c')]),
+            'pkg.lib.a': set(),
+        })
+        self.assertEqual(_affected(targets, None, dsos), {'pkg.lib.helper': None, 'pkg.lib.a': None, 'pkg.ext': None})
@@ -0,0 +1,169 @@
+# Copyright 2022  Michael Davidsaver
+# SPDX-License-Identifier: BSD
+# See LICENSE
+"""Wait for changes to files.  cf. build_dso --watch
+
+Uses inotify on Linux, otherwise polls modification times.
+Set $SETUPTOOLS_DSO_WATCH_POLL=1 to always poll.  eg. for sources on NFS.
+"""
+
+import os
+import sys
+import time
+import errno
+import struct
+import select
+import logging as log
+
+__all__ = (
+    'Watcher',
+)
+
+# from linux/inotify.h
+_IN_MODIFY      = 0x00000002
+_IN_ATTRIB      = 0x00000004
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM  = 0x00000040
+_IN_MOVED_TO    = 0x00000080
+_IN_CREATE      = 0x00000100
+_IN_DELETE      = 0x00000200
+_IN_Q_OVERFLOW  = 0x00004000
+_IN_NONBLOCK    = 0o4000
+_IN_CLOEXEC     = 0o2000000
+
+_IN_MASK = _IN_MODIFY | _IN_ATTRIB | _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE
+
+# struct inotify_event { int wd; uint32_t mask, cookie, len; char name[]; }
+_event = struct.Struct('iIII')
+
+class _Inotify(object):
+    def __init__(self, dirs):
+        import ctypes, ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self._fd = libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1')
+        self._wd = {}
+        try:
+            for D in dirs:
+                wd = libc.inotify_add_watch(self._fd, os.fsencode(D) if hasattr(os, 'fsencode') else D, _IN_MASK)
+                if wd < 0:
+                    raise OSError(ctypes.get_errno(), 'inotify_add_watch %s'%D) # eg. ENOSPC from max_user_watches
+                self._wd[wd] = D
+        except:
+            self.close()
+            raise
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+    def read(self, timeout):
+        """:returns: A set of changed paths, or None if events were lost
+        """
+        if not select.select([self._fd], [], [], timeout)[0]:
+            return set()
+        try:
+            buf = os.read(self._fd, 64*1024)
+        except OSError as e:
+            if e.errno==errno.EAGAIN:
+                return set()
+            raise
+
+        changed, i = set(), 0
+        while i < len(buf):
+            wd, mask, _cookie, nlen = _event.unpack_from(buf, i)
+            name = buf[i+_event.size : i+_event.size+nlen].rstrip(b'\0')
+            i += _event.size + nlen
+            if mask & _IN_Q_OVERFLOW:
+                return None
+            elif wd in self._wd and name:
+                changed.add(os.path.join(self._wd[wd], name.decode(sys.getfilesystemencoding())))
+        return changed
+
+class _Poll(object):
+    interval = 0.5
+
+    def __init__(self, dirs):
+        self._dirs = list(dirs)
+        self._prev = self._scan()
+
+    def close(self):
+        pass
+
+    def _scan(self):
+        ret = {}
+        for D in self._dirs:
+            try:
+                names = os.listdir(D)
+            except OSError:
+                continue
+            for name in names:
+                fname = os.path.join(D, name)
+                try:
+                    S = os.stat(fname)
+                except OSError:
+                    continue # removed since listdir()
+                ret[fname] = (S.st_mtime, S.st_size)
+        return ret
+
+    def read(self, timeout):
+        time.sleep(self.interval if timeout is None else min(self.interval, timeout))
+        cur = self._scan()
+        prev, self._prev = self._prev, cur
+        return set([fname for fname in set(cur)|set(prev) if cur.get(fname)!=prev.get(fname)])
+
+class Watcher(object):
+    """Wait for changes to the files in some directories.
+
+    :param dirs: Directory names.  Sub-directories are not watched.
+    :param float debounce: Wait until no further changes occur for this many seconds,
+                           so that a burst of changes (eg. "git checkout") is seen at once.
+    """
+    def __init__(self, dirs, debounce=0.2):
+        dirs = sorted(set([os.path.abspath(D) for D in dirs if os.path.isdir(D)]))
+        self.debounce = debounce
+        self._impl = None
+        if sys.platform.startswith('linux') and os.environ.get('SETUPTOOLS_DSO_WATCH_POLL', '0')!='1':
+            try:
+                self._impl = _Inotify(dirs)
+            except (OSError, AttributeError) as e:
+                log.warning("Unable to use inotify, polling instead : %s", e)
+        if self._impl is None:
+            self._impl = _Poll(dirs)
+        log.debug("Watching %s", dirs)
+
+    def close(self):
+        self._impl.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, A, B, C):
+        self.close()
+
+    def wait(self, timeout=None):
+        """Wait for, then collect, changes.
+
+        :param float timeout: Give up after this many seconds.  None waits forever.
+        :returns: A set of absolute paths of files which changed.  Empty on timeout.
+                  None if the changes are not known (eg. inotify queue overflow).
+        """
+        deadline = None if timeout is None else time.time()+timeout
+        while True:
+            changed = self._impl.read(None if deadline is None else max(0.0, deadline-time.time()))
+            if changed is None or changed:
+                break
+            elif deadline is not None and time.time()>=deadline:
+                return set()
+
+        # debounce
+        while True:
+            more = self._impl.read(self.debounce)
+            if more is not None and not more:
+                return changed
+            elif more is None or changed is None:
+                changed = None
+            else:
+                changed |= more
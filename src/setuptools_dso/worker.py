@@ -0,0 +1,312 @@
+# Copyright 2022  Michael Davidsaver
+# SPDX-License-Identifier: BSD
+# See LICENSE
+"""Reference compile worker for :py:class:`setuptools_dso.executor.RemoteExecutor`
+
+Compiles preprocessed translation units sent by clients, using the compiler of this host. ::
+
+    export SETUPTOOLS_DSO_WORKER_TOKEN=...
+    python -m setuptools_dso.worker --bind buildbox:3632
+
+Binds to localhost by default, or to a unix socket when there is no token.
+Only compiler arguments which do not name files are accepted.
+
+Compiling arbitrary code is not safe.  eg. ``asm(".incbin ...")`` can read any file readable by the worker.
+So each request must prove knowledge of a shared secret, $SETUPTOOLS_DSO_WORKER_TOKEN,
+by an HMAC of a per-connection challenge and the request header.
+This is checked before any payload is read.
+A worker without a token only binds to a unix socket accessible only by its owner.
+Any local user may connect to a TCP port, even on localhost.
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import hmac
+import json
+import socket
+import hashlib
+import struct
+import shutil
+import tempfile
+import threading
+import subprocess
+import logging as log
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+__all__ = (
+    'Worker',
+)
+
+# protocol version.  Requests from clients with a different version are rejected.
+PROTOCOL = 2
+
+# Each message is a 4 byte big endian length, a JSON header of that length,
+# then header['size'] bytes of payload.
+# On connect, the worker sends a header with a random 'challenge'.
+# The client then sends one request header with 'auth'.  cf. auth_token()
+_len = struct.Struct('>I')
+
+def _token(token=None):
+    return token if token is not None else (os.environ.get('SETUPTOOLS_DSO_WORKER_TOKEN') or None)
+
+def auth_token(token, challenge, header):
+    """HMAC-SHA256 of a worker challenge, and a request header (excluding 'auth'), keyed by a shared secret.
+    """
+    msg = challenge + json.dumps(dict([(K, V) for K, V in header.items() if K!='auth']), sort_keys=True)
+    return hmac.new(token.encode('utf-8'), msg.encode('utf-8'), hashlib.sha256).hexdigest()
+
+# compiler arguments accepted from clients.  Anything else causes a fallback to a local compile.
+_allow_prefix = ('-O', '-f', '-m', '-g', '-W', '-w', '-std=', '-pthread', '-pipe', '-ansi', '-pedantic')
+# arguments which read or write files, or are passed through to other tools
+_deny_prefix = ('-fplugin', '-fdump', '-fprofile', '-fauto-profile', '-fsanitize-blacklist', '-fsanitize-ignorelist',
+                '-fcallgraph-info', '-fstack-usage', '-Wa,', '-Wl,', '-Wp,', '-frecord-gcc-switches')
+
+def allowed_arg(arg):
+    """True if a compiler argument may be sent to, and accepted by, a worker.
+    """
+    if '/' in arg or '\\' in arg or '@' in arg:
+        return False
+    return arg.startswith(_allow_prefix) and not arg.startswith(_deny_prefix)
+
+def _recvall(sock, n):
+    parts = []
+    while n:
+        part = sock.recv(min(n, 1<<20))
+        if not part:
+            raise EOFError('Connection closed')
+        parts.append(part)
+        n -= len(part)
+    return b''.join(parts)
+
+def send_msg(sock, header, payload=b''):
+    header = dict(header, size=len(payload))
+    raw = json.dumps(header).encode('utf-8')
+    sock.sendall(_len.pack(len(raw)) + raw + payload)
+
+def recv_header(sock):
+    """Receive only the header of a message.  The caller must then receive header['size'] bytes of payload.
+    """
+    n, = _len.unpack(_recvall(sock, _len.size))
+    if n > 1<<20:
+        raise ValueError('Header too long')
+    header = json.loads(_recvall(sock, n).decode('utf-8'))
+    if not isinstance(header, dict):
+        raise ValueError('Header must be an object')
+    return header
+
+def recv_msg(sock):
+    """:returns: (header, payload)
+    """
+    header = recv_header(sock)
+    return header, _recvall(sock, header.get('size', 0))
+
+def _default_bind(token=None):
+    """Listening address when none is given.  A unix socket when there is no token.
+    eg. "$XDG_RUNTIME_DIR/setuptools_dso-worker.sock"
+    """
+    if _token(token) is not None:
+        return '127.0.0.1:3632'
+    from .runtime import _user_cache_dir
+    rdir = os.environ.get('XDG_RUNTIME_DIR') or _user_cache_dir()
+    return 'unix:'+os.path.join(rdir, 'setuptools_dso-worker.sock')
+
+def parse_address(addr):
+    """Parse a worker address.
+    eg. "unix:/path/to/sock" or "host:port"
+
+    :returns: (family, address)
+    """
+    if addr.startswith('unix:'):
+        return socket.AF_UNIX, addr[5:]
+    host, _sep, port = addr.rpartition(':')
+    if not host or not port:
+        raise ValueError('Worker address must be "host:port" or "unix:/path", not %r'%addr)
+    return socket.AF_INET6 if ':' in host else socket.AF_INET, (host.strip('[]'), int(port))
+
+class _Handler(socketserver.BaseRequestHandler):
+    def handle(self):
+        challenge = hashlib.sha256(os.urandom(32)).hexdigest()
+        try:
+            send_msg(self.request, {'protocol':PROTOCOL, 'challenge':challenge})
+            header = recv_header(self.request)
+            if not self.server.worker.authorized(challenge, header):
+                # payload not read
+                log.warning('Rejected request from %r without valid token', self.client_address)
+                send_msg(self.request, {'ok':False, 'rejected':True, 'output':'Not authorized'})
+                return
+            payload = _recvall(self.request, header.get('size', 0))
+        except (EOFError, ValueError, TypeError, socket.error) as e:
+            log.debug('Bad request from %r : %r', self.client_address, e)
+            return
+
+        if header.get('protocol')!=PROTOCOL:
+            reply, obj = {'ok':False, 'rejected':True, 'output':'Protocol mismatch'}, b''
+        elif header.get('op')=='info':
+            reply, obj = {'ok':True, 'njobs':self.server.worker.njobs}, b''
+        elif header.get('op')=='compile':
+            reply, obj = self.server.worker.compile(header, payload)
+        else:
+            reply, obj = {'ok':False, 'rejected':True, 'output':'Unknown op'}, b''
+
+        try:
+            send_msg(self.request, reply, obj)
+        except socket.error as e:
+            log.debug('Unable to reply to %r : %r', self.client_address, e)
+
+class _TCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class _TCP6Server(_TCPServer):
+    address_family = socket.AF_INET6
+
+if hasattr(socketserver, 'UnixStreamServer'):
+    class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+
+class Worker(object):
+    """Compile server.
+
+    :param str bind: Listening address.  "host:port" or "unix:/path/to/sock".
+                     Port 0 selects a free port.  Default from :py:func:`_default_bind`.
+    :param int njobs: Number of concurrent compiles.  Default from :py:func:`dsocmd.system_concurrency`.
+    :param str token: Shared secret which clients must know.  Default from $SETUPTOOLS_DSO_WORKER_TOKEN.
+                      Required unless binding to a unix socket.
+    """
+    def __init__(self, bind=None, njobs=None, token=None):
+        from .compiler import new_compiler
+        if njobs is None:
+            from .dsocmd import system_concurrency
+            njobs = system_concurrency()
+        self.njobs = njobs
+        self._slots = threading.BoundedSemaphore(njobs)
+
+        CC = new_compiler()
+        if CC.compiler_type!='unix':
+            raise RuntimeError('Worker requires a gcc or clang like compiler, not %r'%CC.compiler_type)
+        # executable names only.  Flags come from clients.
+        self.executables = {
+            'c': CC.compiler_so[:1],
+            'c++': (getattr(CC, 'compiler_so_cxx', None) or CC.compiler_cxx)[:1],
+        }
+
+        self._token = _token(token)
+        if bind is None:
+            bind = _default_bind(self._token)
+        family, addr = parse_address(bind)
+        # any local user may connect to a TCP port, even on localhost
+        if self._token is None and family!=socket.AF_UNIX:
+            raise RuntimeError('Worker bound to %s requires a token.  Set $SETUPTOOLS_DSO_WORKER_TOKEN, or bind to "unix:/path"'%bind)
+        if family==socket.AF_UNIX:
+            if os.path.exists(addr):
+                os.unlink(addr)
+            if os.path.dirname(addr) and not os.path.isdir(os.path.dirname(addr)):
+                os.makedirs(os.path.dirname(addr))
+            # only accessible by the owner from the moment it is created
+            umask = os.umask(0o177)
+            try:
+                self.server = _UnixServer(addr, _Handler)
+            finally:
+                os.umask(umask)
+        else:
+            self.server = (_TCP6Server if family==socket.AF_INET6 else _TCPServer)(addr, _Handler)
+        self.server.worker = self
+
+        self.ncompiled = 0
+        self._lock = threading.Lock()
+
+    @property
+    def address(self):
+        """Address string which clients may connect to.  cf. $SETUPTOOLS_DSO_WORKERS
+        """
+        addr = self.server.server_address
+        if self.server.address_family==socket.AF_UNIX:
+            return 'unix:'+addr
+        elif self.server.address_family==socket.AF_INET6:
+            return '[%s]:%d'%addr[:2]
+        return '%s:%d'%addr
+
+    def authorized(self, challenge, header):
+        """True if a request header was sent by a client knowing the token.  Or if no token is required.
+        """
+        if self._token is None:
+            return True
+        auth = header.get('auth')
+        if not isinstance(auth, str):
+            return False
+        return hmac.compare_digest(auth, auth_token(self._token, challenge, header))
+
+    def serve_forever(self):
+        self.server.serve_forever()
+
+    def shutdown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def compile(self, header, payload):
+        """Compile one preprocessed translation unit.
+        :returns: (reply header, object file bytes)
+        """
+        lang, args = header.get('language'), list(header.get('args') or [])
+        exe = self.executables.get(lang)
+        bad = [arg for arg in args if not allowed_arg(arg)]
+        if exe is None or bad:
+            return {'ok':False, 'rejected':True, 'output':'Rejected language %r or arguments %r'%(lang, bad)}, b''
+
+        with self._slots:
+            tdir = tempfile.mkdtemp(prefix='dsoworker-')
+            try:
+                src = os.path.join(tdir, 'input.i' if lang=='c' else 'input.ii')
+                obj = os.path.join(tdir, 'output.o')
+                with open(src, 'wb') as F:
+                    F.write(payload)
+                cmd = exe + args + ['-c', src, '-o', obj]
+                log.debug('Worker compile: %s', ' '.join(cmd))
+                P = subprocess.Popen(cmd, cwd=tdir, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+                output = P.communicate()[0].decode('utf-8', 'replace')
+                if P.returncode!=0:
+                    return {'ok':False, 'output':output}, b''
+                with open(obj, 'rb') as F:
+                    data = F.read()
+            finally:
+                shutil.rmtree(tdir, ignore_errors=True)
+
+        with self._lock:
+            self.ncompiled += 1
+        return {'ok':True, 'output':output}, data
+
+def getargs():
+    from argparse import ArgumentParser
+    P = ArgumentParser(description='setuptools_dso compile worker.  cf. $SETUPTOOLS_DSO_WORKERS')
+    P.add_argument('--bind', default=None,
+                   help='Listening address.  "host:port" or "unix:/path/to/sock".  '
+                        '(default: 127.0.0.1:3632 with $SETUPTOOLS_DSO_WORKER_TOKEN, otherwise a unix socket)')
+    P.add_argument('-j', '--jobs', type=int, default=None,
+                   help='Number of concurrent compiles')
+    P.add_argument('-v', '--verbose', action='store_true')
+    return P
+
+def main():
+    args = getargs().parse_args()
+    log.basicConfig(level=log.DEBUG if args.verbose else log.INFO)
+    try:
+        W = Worker(bind=args.bind, njobs=args.jobs)
+    except RuntimeError as e:
+        sys.exit(str(e))
+    print('Listening on %s with %d jobs'%(W.address, W.njobs))
+    sys.stdout.flush()
+    try:
+        W.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        W.shutdown()
+
+if __name__=='__main__':
+    main()